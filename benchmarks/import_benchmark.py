@@ -0,0 +1,230 @@
+"""
+Times each stage of importing synthetic models and writes the results as JSON.
+
+Blender provides bpy and mathutils, so run it with Blender from anywhere, no window, network or GPU is needed:
+blender --background --factory-startup --python benchmarks/import_benchmark.py -- [--output results.json] [--repeat 3]
+
+A library is generated with synthetic_library.py (its size options are accepted here too) unless --library points
+to one that was generated before. Every model is imported with the parse cache off (cold) and on after one
+import to fill it (warm). Settings, the parse cache and the library index are kept in a temporary directory
+so the addon's own config isn't touched.
+
+Stages are exclusive, time spent in a stage that is called from another stage only counts once:
+index      FileSystem.build_search_paths
+locate     FileSystem.locate
+read       LDrawFile reading a file or restoring it from the parse cache
+parse      LDrawFile parsing lines into commands
+records    LDrawFile building command records from commands
+traverse   LDrawNode.load
+mesh       ldraw_mesh.create_mesh and create_edge_mesh
+materials  BlenderMaterials.get_material
+objects    ldraw_object.create_object and create_edge_obj
+other      everything else in blender_import.do_import
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import bpy
+
+ADDON_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.dirname(ADDON_ROOT))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+ADDON_NAME = os.path.basename(ADDON_ROOT)
+
+import synthetic_library
+
+addon = importlib.import_module(ADDON_NAME)
+blender_import = importlib.import_module(f"{ADDON_NAME}.blender_import")
+ldraw_mesh = importlib.import_module(f"{ADDON_NAME}.ldraw_mesh")
+ldraw_object = importlib.import_module(f"{ADDON_NAME}.ldraw_object")
+ImportSettings = importlib.import_module(f"{ADDON_NAME}.import_settings").ImportSettings
+FileSystem = importlib.import_module(f"{ADDON_NAME}.filesystem").FileSystem
+LDrawFile = importlib.import_module(f"{ADDON_NAME}.ldraw_file").LDrawFile
+LDrawNode = importlib.import_module(f"{ADDON_NAME}.ldraw_node").LDrawNode
+BlenderMaterials = importlib.import_module(f"{ADDON_NAME}.blender_materials").BlenderMaterials
+ParseCache = importlib.import_module(f"{ADDON_NAME}.parse_cache").ParseCache
+PartArchive = importlib.import_module(f"{ADDON_NAME}.part_archive").PartArchive
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.__local = threading.local()
+
+    def reset(self):
+        for stage in self.seconds:
+            self.seconds[stage] = 0.0
+            self.calls[stage] = 0
+
+    def __stack(self):
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = []
+            self.__local.stack = stack
+        return stack
+
+    # each entry on the stack is the time spent in stages called from that stage
+    def wrap(self, stage, func):
+        self.seconds.setdefault(stage, 0.0)
+        self.calls.setdefault(stage, 0)
+
+        def timed(*args, **kwargs):
+            stack = self.__stack()
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()
+                self.seconds[stage] += elapsed - nested
+                self.calls[stage] += 1
+                if len(stack) > 0:
+                    stack[-1] += elapsed
+
+        return timed
+
+    def wrap_function(self, stage, owner, name):
+        setattr(owner, name, self.wrap(stage, getattr(owner, name)))
+
+    # class attributes are wrapped as they are stored so classmethods stay classmethods
+    def wrap_method(self, stage, cls, name):
+        attr = cls.__dict__[name]
+        if isinstance(attr, classmethod):
+            setattr(cls, name, classmethod(self.wrap(stage, attr.__func__)))
+        else:
+            setattr(cls, name, self.wrap(stage, attr))
+
+
+def wrap_stages(timer):
+    timer.wrap_method("index", FileSystem, "build_search_paths")
+    timer.wrap_method("locate", FileSystem, "locate")
+    timer.wrap_method("read", LDrawFile, "_LDrawFile__read_source")
+    timer.wrap_method("parse", LDrawFile, "_LDrawFile__parse_lines")
+    timer.wrap_method("records", LDrawFile, "_LDrawFile__build_records")
+    timer.wrap_method("traverse", LDrawNode, "load")
+    timer.wrap_function("mesh", ldraw_mesh, "create_mesh")
+    timer.wrap_function("mesh", ldraw_mesh, "create_edge_mesh")
+    timer.wrap_method("materials", BlenderMaterials, "get_material")
+    timer.wrap_function("objects", ldraw_object, "create_object")
+    timer.wrap_function("objects", ldraw_object, "create_edge_obj")
+
+
+def clear_scene():
+    ids = []
+    for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.materials, bpy.data.images, bpy.data.collections):
+        ids.extend(collection)
+    bpy.data.batch_remove(ids)
+
+
+def run_import(timer, filepath, use_parse_cache):
+    clear_scene()
+    ImportSettings.settings["use_parse_cache"] = use_parse_cache
+    timer.reset()
+
+    start = time.perf_counter()
+    blender_import.do_import(filepath)
+    total = time.perf_counter() - start
+
+    stages = {}
+    for stage, seconds in timer.seconds.items():
+        stages[stage] = {"seconds": seconds, "calls": timer.calls[stage]}
+    stages["other"] = {"seconds": total - sum(timer.seconds.values()), "calls": 1}
+
+    return {
+        "total": total,
+        "stages": stages,
+        "parts": LDrawNode.part_count,
+        "files": LDrawFile.unique_file_count,
+        "references": LDrawFile.reference_count,
+        "parse_cache_hits": ParseCache.hits,
+        "objects": len(bpy.data.objects),
+        "meshes": len(bpy.data.meshes),
+        "meshes_built": ldraw_mesh.meshes_built,
+        "meshes_reused": ldraw_mesh.meshes_reused,
+        "materials": len(bpy.data.materials),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="import_benchmark.py")
+    parser.add_argument("--library", help="a library generated before, otherwise one is generated in a temporary directory")
+    parser.add_argument("--output", default="import_benchmark.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--prefetch", action="store_true", help="read files on the prefetch pool, read is then timed on its threads")
+    synthetic_library.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="ldraw_benchmark_")
+    library = args.library
+    if library is None:
+        library = os.path.join(work_dir, "ldraw")
+        print(f"generating {library}")
+        models = synthetic_library.generate_from_args(library, args)
+    else:
+        models = {
+            "small": os.path.join(library, "models", "small.ldr"),
+            "large": os.path.join(library, "models", "large.mpd"),
+        }
+
+    ImportSettings.settings_path = os.path.join(work_dir, "ImportOptions.json")
+    ParseCache.cache_path = os.path.join(work_dir, "parsed")
+    FileSystem.library_index_path = os.path.join(work_dir, "library_index.pickle")
+    PartArchive.archive_path = os.path.join(work_dir, "parts.ldpa")
+
+    ImportSettings.settings = dict(ImportSettings.default_settings)
+    ImportSettings.settings["ldraw_path"] = library
+    ImportSettings.settings["studio_ldraw_path"] = ""
+    ImportSettings.settings["prefetch_files"] = args.prefetch
+    ImportSettings.settings["parse_in_processes"] = False
+    ImportSettings.settings["use_part_archive"] = False
+
+    addon.register()
+    timer = StageTimer()
+    wrap_stages(timer)
+
+    runs = []
+    for name, filepath in models.items():
+        for mode, use_parse_cache in (("cold", False), ("warm", True)):
+            # fill the parse cache
+            if use_parse_cache:
+                run_import(timer, filepath, use_parse_cache)
+
+            for i in range(args.repeat):
+                result = run_import(timer, filepath, use_parse_cache)
+                result.update({"model": name, "mode": mode, "run": i})
+                runs.append(result)
+                print(f"{name} {mode} {i}: {result['total']:.3f}s " + ", ".join(
+                    f"{stage} {values['seconds']:.3f}" for stage, values in result["stages"].items()
+                ))
+
+    results = {
+        "blender": bpy.app.version_string,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "library": library,
+        "generator": {k: v for k, v in vars(args).items() if k not in ("library", "output", "repeat")},
+        "runs": runs,
+    }
+    with open(args.output, 'w', encoding='utf-8', newline="\n") as file:
+        json.dump(results, file, indent=4)
+    print(f"written: {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if "--" in args:
+        args = args[args.index("--") + 1:]
+    else:
+        args = args[1:]
+    main(args)
@@ -0,0 +1,111 @@
+"""
+Measures how many lines per second LDrawFile parses.
+
+Blender provides bpy and mathutils, so run it with Blender from anywhere:
+blender --background --factory-startup --python benchmarks/parse_benchmark.py -- path/to/model.mpd [--repeat 5] [--addon path]
+
+Every FILE block of the model is read into memory first, so only parsing is timed.
+The parse cache, file lookup and node building aren't involved.
+
+--addon times the addon in another folder instead of this one, for example a checkout of an older version,
+so the lines per second before and after a change can be compared on the same model:
+git worktree add ../baseline <commit>
+blender --background --factory-startup --python benchmarks/parse_benchmark.py -- model.mpd --addon ../baseline
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+ADDON_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def read_blocks(filepath):
+    blocks = []
+    current_lines = None
+
+    with open(filepath, 'r', encoding='utf-8') as file:
+        for line in file:
+            clean_line = " ".join(line.split())
+            if clean_line == "":
+                continue
+
+            if clean_line.startswith("0 FILE "):
+                current_lines = []
+                blocks.append((clean_line.split(maxsplit=2)[2].lower(), current_lines))
+                continue
+
+            if clean_line.startswith("0 NOFILE"):
+                current_lines = None
+                continue
+
+            # a plain ldr or dat file is a single block
+            if current_lines is None:
+                if len(blocks) > 0:
+                    continue
+                current_lines = []
+                blocks.append((os.path.basename(filepath), current_lines))
+
+            current_lines.append(line)
+
+    return blocks
+
+
+# LDrawFile.parse_lines(filename, lines) of the addon in addon_root
+# before parse_lines was added, a file was parsed by __parse_file, which also looked up and parsed every subfile
+# get_file is replaced so subfile lines are parsed without that, like parse_lines does
+def load_parse_lines(addon_root):
+    sys.path.insert(0, os.path.dirname(addon_root))
+    LDrawFile = importlib.import_module(f"{os.path.basename(addon_root)}.ldraw_file").LDrawFile
+
+    if hasattr(LDrawFile, "parse_lines"):
+        return LDrawFile.parse_lines
+
+    LDrawFile.get_file = classmethod(lambda cls, filename: None)
+
+    def parse_lines(filename, lines):
+        ldraw_file = LDrawFile(filename)
+        ldraw_file.lines = lines
+        ldraw_file._LDrawFile__parse_file()
+        return ldraw_file
+
+    return parse_lines
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="parse_benchmark.py")
+    parser.add_argument("filepath")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--addon", default=ADDON_ROOT, help="the folder of the addon to time, this one by default")
+    args = parser.parse_args(argv)
+
+    filepath = args.filepath
+    repeat = args.repeat
+    parse_lines = load_parse_lines(os.path.realpath(args.addon))
+
+    blocks = read_blocks(filepath)
+    line_count = sum(len(lines) for filename, lines in blocks)
+
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for filename, lines in blocks:
+            parse_lines(filename, lines)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print(f"{args.addon}")
+    print(f"{filepath}: {line_count} lines in {len(blocks)} files")
+    print(f"best of {repeat}: {best:.3f}s, {line_count / best:,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if "--" in args:
+        args = args[args.index("--") + 1:]
+    else:
+        args = args[1:]
+    main(args)
@@ -0,0 +1,316 @@
+"""
+Writes a synthetic LDraw library and models for benchmarks.
+
+It only uses the standard library, so it also runs without Blender:
+python benchmarks/synthetic_library.py path/to/library [--parts 50] [--submodels 20] ...
+
+The output is the same for the same options:
+- p/ has edge, disc and cylinder primitives, a stud built from them, and a chain of primitives nested --depth deep
+- parts/ has --parts bricks with a subpart, a grid of up to --studs studs each and the nested chain
+- models/large.mpd has --submodels FILE blocks of --parts-per-submodel bricks,
+  a !DATA png and a submodel with TEXMAP planar geometry
+"""
+
+import argparse
+import math
+import os
+import random
+import struct
+import zlib
+
+# solid colors from LDConfig.ldr
+COLOR_CODES = ["0", "1", "2", "4", "14", "15", "71", "72"]
+
+
+def write_file(library, relative_path, lines):
+    full_path = os.path.join(library, *relative_path.split("/"))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w', encoding='utf-8', newline="\n") as file:
+        file.write("\n".join(lines))
+        file.write("\n")
+
+
+def header(description, name, part_type):
+    return [
+        f"0 {description}",
+        f"0 Name: {name}",
+        "0 Author: Synthetic Library",
+        f"0 !LDRAW_ORG {part_type} UPDATE 2024-01",
+        "0 !LICENSE Licensed under CC BY 4.0 : see CAreadme.txt",
+        "",
+        "0 BFC CERTIFY CCW",
+        "",
+    ]
+
+
+def fmt(value):
+    value = round(value, 4)
+    if value == 0:
+        return "0"
+    return f"{value:g}"
+
+
+def subfile_line(color_code, x, y, z, matrix, filename):
+    values = " ".join(fmt(v) for v in (x, y, z) + matrix)
+    return f"1 {color_code} {values} {filename}"
+
+
+IDENTITY = (1, 0, 0, 0, 1, 0, 0, 0, 1)
+
+
+def ldconfig():
+    lines = [
+        "0 LDraw.org Configuration File",
+        "0 Name: LDConfig.ldr",
+        "0 Author: Synthetic Library",
+        "0 !LDRAW_ORG Configuration UPDATE 2024-01",
+        "",
+    ]
+    colors = [
+        ("Black", "0", "#1B2A34", "#808080"),
+        ("Blue", "1", "#1E5AA8", "#333333"),
+        ("Green", "2", "#00852B", "#333333"),
+        ("Red", "4", "#B40000", "#333333"),
+        ("Yellow", "14", "#FAC80A", "#333333"),
+        ("White", "15", "#F4F4F4", "#333333"),
+        ("Main_Colour", "16", "#FFFF80", "#333333"),
+        ("Edge_Colour", "24", "#7F7F7F", "#333333"),
+        ("Light_Bluish_Grey", "71", "#969696", "#333333"),
+        ("Dark_Bluish_Grey", "72", "#646464", "#333333"),
+    ]
+    for name, code, value, edge in colors:
+        lines.append(f"0 !COLOUR {name:<20} CODE {code:>3} VALUE {value} EDGE {edge}")
+    return lines
+
+
+def circle_points(segments, fraction=1.0):
+    points = []
+    for i in range(int(segments * fraction) + 1):
+        angle = 2 * math.pi * i / segments
+        points.append((math.cos(angle), math.sin(angle)))
+    return points
+
+
+def primitives(library, segments):
+    points = circle_points(segments)
+
+    lines = header("Circle 1.0", "4-4edge.dat", "Primitive")
+    for (x1, z1), (x2, z2) in zip(points, points[1:]):
+        lines.append(f"2 24 {fmt(x1)} 0 {fmt(z1)} {fmt(x2)} 0 {fmt(z2)}")
+    write_file(library, "p/4-4edge.dat", lines)
+
+    lines = header("Disc 1.0", "4-4disc.dat", "Primitive")
+    for (x1, z1), (x2, z2) in zip(points, points[1:]):
+        lines.append(f"3 16 0 0 0 {fmt(x1)} 0 {fmt(z1)} {fmt(x2)} 0 {fmt(z2)}")
+    write_file(library, "p/4-4disc.dat", lines)
+
+    lines = header("Cylinder 1.0", "4-4cyli.dat", "Primitive")
+    for (x1, z1), (x2, z2) in zip(points, points[1:]):
+        lines.append(f"4 16 {fmt(x1)} 1 {fmt(z1)} {fmt(x2)} 1 {fmt(z2)} {fmt(x2)} 0 {fmt(z2)} {fmt(x1)} 0 {fmt(z1)}")
+    for (x1, z1), (x2, z2) in zip(points, points[1:]):
+        lines.append(f"5 24 {fmt(x1)} 0 {fmt(z1)} {fmt(x1)} 1 {fmt(z1)} {fmt(x2)} 0 {fmt(z2)} {fmt(-x1)} 0 {fmt(-z1)}")
+    write_file(library, "p/4-4cyli.dat", lines)
+
+    # high resolution versions so the resolution option finds something
+    points48 = circle_points(segments * 3)
+    lines = header("Hi-Res Disc 1.0", "48\\4-4disc.dat", "Primitive")
+    for (x1, z1), (x2, z2) in zip(points48, points48[1:]):
+        lines.append(f"3 16 0 0 0 {fmt(x1)} 0 {fmt(z1)} {fmt(x2)} 0 {fmt(z2)}")
+    write_file(library, "p/48/4-4disc.dat", lines)
+
+    lines = header("Stud", "stud.dat", "Primitive")
+    lines += [
+        subfile_line(16, 0, -4, 0, (6, 0, 0, 0, 1, 0, 0, 0, 6), "4-4edge.dat"),
+        subfile_line(16, 0, 0, 0, (6, 0, 0, 0, 1, 0, 0, 0, 6), "4-4edge.dat"),
+        subfile_line(16, 0, -4, 0, (6, 0, 0, 0, 4, 0, 0, 0, 6), "4-4cyli.dat"),
+        "0 BFC INVERTNEXT",
+        subfile_line(16, 0, -4, 0, (6, 0, 0, 0, -1, 0, 0, 0, 6), "4-4disc.dat"),
+    ]
+    write_file(library, "p/stud.dat", lines)
+
+
+# each level places the next one twice with a small transform so the whole chain has 2 ** depth discs
+def nested_primitives(library, depth):
+    for level in range(depth):
+        name = f"nest{level}.dat"
+        lines = header(f"Nested Primitive Level {level}", name, "Primitive")
+        if level + 1 < depth:
+            child = f"nest{level + 1}.dat"
+        else:
+            child = "4-4disc.dat"
+        lines.append(subfile_line(16, 0, 0, 0, (0.5, 0, 0, 0, 1, 0, 0, 0, 0.5), child))
+        lines.append(subfile_line(16, 1, 0, 0, (0, 0, 0.5, 0, 1, 0, -0.5, 0, 0), child))
+        write_file(library, f"p/{name}", lines)
+
+
+def box_lines(width, height, length):
+    x = width / 2
+    z = length / 2
+    y = height
+    corners = [
+        (-x, 0, -z), (x, 0, -z), (x, 0, z), (-x, 0, z),
+        (-x, y, -z), (x, y, -z), (x, y, z), (-x, y, z),
+    ]
+    faces = [(0, 1, 2, 3), (7, 6, 5, 4), (0, 4, 5, 1), (1, 5, 6, 2), (2, 6, 7, 3), (3, 7, 4, 0)]
+    lines = []
+    for face in faces:
+        values = " ".join(fmt(v) for i in face for v in corners[i])
+        lines.append(f"4 16 {values}")
+    edges = [(0, 1), (1, 2), (2, 3), (3, 0), (4, 5), (5, 6), (6, 7), (7, 4), (0, 4), (1, 5), (2, 6), (3, 7)]
+    for a, b in edges:
+        values = " ".join(fmt(v) for v in corners[a] + corners[b])
+        lines.append(f"2 24 {values}")
+    return lines
+
+
+def parts(library, part_count, studs, depth):
+    part_names = []
+    for i in range(part_count):
+        name = f"{90000 + i}.dat"
+        subpart_name = f"{90000 + i}s01.dat"
+        part_names.append(name)
+
+        # 1 x 1 up to a square of about studs studs
+        side = max(1, int(math.sqrt(studs)))
+        width = 1 + i % side
+        length = 1 + (i // side) % side
+
+        lines = header(f"Brick {width} x {length} Subpart", f"s\\{subpart_name}", "Subpart")
+        lines += box_lines(width * 20 - 8, 20, length * 20 - 8)
+        write_file(library, f"parts/s/{subpart_name}", lines)
+
+        lines = header(f"Brick {width} x {length}", name, "Part")
+        lines += [
+            "0 !CATEGORY Brick",
+            f"0 !KEYWORDS synthetic, benchmark, {width}x{length}",
+            "",
+        ]
+        lines += box_lines(width * 20, 24, length * 20)
+        lines.append(subfile_line(16, 0, 4, 0, IDENTITY, f"s\\{subpart_name}"))
+        for sx in range(width):
+            for sz in range(length):
+                x = (sx - (width - 1) / 2) * 20
+                z = (sz - (length - 1) / 2) * 20
+                lines.append(subfile_line(16, x, 0, z, IDENTITY, "stud.dat"))
+        if depth > 0:
+            lines.append(subfile_line(16, 0, 24, 0, (4, 0, 0, 0, 1, 0, 0, 0, 4), "nest0.dat"))
+        write_file(library, f"parts/{name}", lines)
+    return part_names
+
+
+# a 2 x 2 png, enough for an image to be created from the !DATA block
+def tiny_png():
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    raw = b"".join(b"\x00" + bytes([255, 0, 0, 0, 255, 0]) for _ in range(2))
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", 2, 2, 8, 2, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(raw)),
+        chunk(b"IEND", b""),
+    ])
+
+
+def large_mpd(library, part_names, submodels, parts_per_submodel, rng):
+    import base64
+
+    lines = ["0 FILE large.ldr", "0 Synthetic Large Model", "0 Name: large.ldr", "0 Author: Synthetic Library", ""]
+    for i in range(submodels):
+        x = (i % 10) * 200
+        z = (i // 10) * 200
+        lines.append(subfile_line(16, x, 0, z, IDENTITY, f"submodel{i}.ldr"))
+    lines.append(subfile_line(16, 0, -100, 0, IDENTITY, "textured.ldr"))
+    lines.append("0 NOFILE")
+
+    for i in range(submodels):
+        lines += [f"0 FILE submodel{i}.ldr", f"0 Submodel {i}", f"0 Name: submodel{i}.ldr", "0 Author: Synthetic Library", ""]
+        for j in range(parts_per_submodel):
+            color_code = rng.choice(COLOR_CODES)
+            x = rng.randrange(-10, 10) * 20
+            y = -24 * (j % 8)
+            z = rng.randrange(-10, 10) * 20
+            if rng.random() < 0.5:
+                matrix = IDENTITY
+            else:
+                matrix = (0, 0, 1, 0, 1, 0, -1, 0, 0)
+            lines.append(subfile_line(color_code, x, y, z, matrix, rng.choice(part_names)))
+            if j % 25 == 24:
+                lines.append("0 STEP")
+        lines.append("0 NOFILE")
+
+    lines += [
+        "0 FILE textured.ldr",
+        "0 Textured Tile",
+        "0 Name: textured.ldr",
+        "0 Author: Synthetic Library",
+        "",
+        "0 !TEXMAP START PLANAR -20 0 -20 20 0 -20 -20 0 20 synthetic.png",
+        "0 !: 4 16 -20 0 -20 20 0 -20 20 0 20 -20 0 20",
+        "0 !TEXMAP FALLBACK",
+        "4 16 -20 0 -20 20 0 -20 20 0 20 -20 0 20",
+        "0 !TEXMAP END",
+        "0 NOFILE",
+        "0 !DATA synthetic.png",
+    ]
+    data = base64.b64encode(tiny_png()).decode('ascii')
+    for start in range(0, len(data), 76):
+        lines.append(f"0 !: {data[start:start + 76]}")
+
+    write_file(library, "models/large.mpd", lines)
+
+
+def small_model(library, part_names, count, rng):
+    lines = ["0 Synthetic Small Model", "0 Name: small.ldr", "0 Author: Synthetic Library", ""]
+    for i in range(count):
+        lines.append(subfile_line(rng.choice(COLOR_CODES), i * 40, 0, 0, IDENTITY, rng.choice(part_names)))
+    write_file(library, "models/small.ldr", lines)
+
+
+def generate(library, part_count=50, studs=16, depth=6, segments=16, submodels=20, parts_per_submodel=100, seed=1):
+    rng = random.Random(seed)
+
+    write_file(library, "LDConfig.ldr", ldconfig())
+    primitives(library, segments)
+    nested_primitives(library, depth)
+    part_names = parts(library, part_count, studs, depth)
+    small_model(library, part_names, min(part_count, 10), rng)
+    large_mpd(library, part_names, submodels, parts_per_submodel, rng)
+
+    return {
+        "small": os.path.join(library, "models", "small.ldr"),
+        "large": os.path.join(library, "models", "large.mpd"),
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--parts", type=int, default=50, help="number of bricks")
+    parser.add_argument("--studs", type=int, default=16, help="most studs on a brick")
+    parser.add_argument("--depth", type=int, default=6, help="levels of nested primitives under each brick")
+    parser.add_argument("--segments", type=int, default=16, help="segments of circular primitives")
+    parser.add_argument("--submodels", type=int, default=20, help="FILE blocks in the large mpd")
+    parser.add_argument("--parts-per-submodel", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def generate_from_args(library, args):
+    return generate(
+        library,
+        part_count=args.parts,
+        studs=args.studs,
+        depth=args.depth,
+        segments=args.segments,
+        submodels=args.submodels,
+        parts_per_submodel=args.parts_per_submodel,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="synthetic_library.py")
+    parser.add_argument("library")
+    add_arguments(parser)
+    args = parser.parse_args()
+    models = generate_from_args(args.library, args)
+    for name, filepath in models.items():
+        print(f"{name}: {filepath}")
@@ -8,19 +8,31 @@ from .ldraw_file import LDrawFile
 from .ldraw_node import LDrawNode
 from .filesystem import FileSystem
 from .ldraw_color import LDrawColor
+from .parse_cache import ParseCache
+from .part_archive import PartArchive
+from .structural_key import StructuralKey
 from . import helpers
 from . import strings
 from . import group
 from . import ldraw_meta
+from . import ldraw_mesh
 from . import ldraw_object
+from . import ldraw_instancing
 from . import matrices
 
 
 def do_import(filepath, color_code="16", return_mesh=False):
+    return helpers.run_to_end(import_steps(filepath, color_code=color_code, return_mesh=return_mesh))
+
+
+# do_import as a generator that yields (parts done, parts total) after each part
+# so a modal operator can spread an import over many event loop ticks
+def import_steps(filepath, color_code="16", return_mesh=False):
     print(filepath)  # TODO: multiple filepaths?
 
-    ImportSettings.save_settings()
     ImportSettings.apply_settings()
+    ImportSettings.reset_import_only_settings()
+    ImportSettings.save_settings()
 
     BlenderMaterials.reset_caches()
     FileSystem.reset_caches()
@@ -29,11 +41,17 @@ def do_import(filepath, color_code="16", return_mesh=False):
     LDrawNode.reset_caches()
     group.reset_caches()
     ldraw_meta.reset_caches()
+    ldraw_mesh.reset_caches()
     ldraw_object.reset_caches()
+    ldraw_instancing.reset_caches()
     matrices.reset_caches()
+    ParseCache.reset_caches()
+    PartArchive.reset_caches()
+    StructuralKey.reset_caches()
 
     FileSystem.build_search_paths(parent_filepath=filepath)
     LDrawFile.read_color_table()
+    PartArchive.open(LDrawFile.library_version())
     BlenderMaterials.create_blender_node_groups()
 
     ldraw_file = LDrawFile.get_file(filepath)
@@ -50,8 +68,24 @@ def do_import(filepath, color_code="16", return_mesh=False):
 
     group.groups_setup(filepath)
 
-    # return root_node.load()
-    obj = root_node.load(color_code=color_code, return_mesh=return_mesh)
+    part_total = LDrawNode.count_parts(ldraw_file)
+    walk = root_node.walk(color_code=color_code, return_mesh=return_mesh)
+    try:
+        while True:
+            try:
+                next(walk)
+            except StopIteration as e:
+                obj = e.value
+                break
+            yield min(LDrawNode.placed_count, part_total), part_total
+    finally:
+        # the files of an mpd that weren't used don't keep it open, also when the import is cancelled
+        LDrawFile.close_sources()
+
+    if ImportOptions.instance_parts and not return_mesh:
+        instancer = ldraw_instancing.build(ldraw_file.name, group.top_collection)
+        if obj is None:
+            obj = instancer
 
     # s = {str(k): v for k, v in sorted(LDrawNode.geometry_datas2.items(), key=lambda ele: ele[1], reverse=True)}
     # helpers.write_json("gs2.json", s, indent=4)
@@ -59,6 +93,24 @@ def do_import(filepath, color_code="16", return_mesh=False):
 
     return obj
 
+
+# the datablocks an import creates, by the name of their bpy.data collection
+__created_data = ("objects", "meshes", "materials", "node_groups", "images", "collections")
+
+
+# the datablocks that exist before an import, so the ones it creates can be removed if it's cancelled
+def snapshot_data():
+    return {name: {datablock.as_pointer() for datablock in getattr(bpy.data, name)} for name in __created_data}
+
+
+def rollback_data(snapshot):
+    created = []
+    for name in __created_data:
+        existing = snapshot[name]
+        created.extend(datablock for datablock in getattr(bpy.data, name) if datablock.as_pointer() not in existing)
+    bpy.data.batch_remove(created)
+
+
 def __load_materials(file):
     ImportOptions.parent_to_empty = False
 
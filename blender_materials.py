@@ -1,20 +1,21 @@
 import bpy
 
 import os
-import uuid
 
 from .definitions import APP_ROOT
 from .ldraw_color import LDrawColor
 from .filesystem import FileSystem
+from .structural_key import StructuralKey
 from . import strings
 
 
 class BlenderMaterials:
-    __key_map = {}
+    # StructuralKey -> material, so faces don't look up materials by name in bpy.data
+    __materials = {}
 
     @classmethod
     def reset_caches(cls):
-        cls.__key_map.clear()
+        cls.__materials.clear()
 
     # https://github.com/bblanimation/abs-plastic-materials
     @classmethod
@@ -51,17 +52,22 @@ class BlenderMaterials:
         bfc_certified = bfc_certified is True
 
         if easy_key:
-            key = color_code + "-" + color.name
+            key = StructuralKey.get(("material", color_code, color.name), name=color_code + "-" + color.name)
         else:
             key = cls.__build_key(color, bfc_certified, part_slopes, parts_cloth, texmap, pe_texmap)
 
+        material = cls.__materials.get(key)
+        if material is not None:
+            return material
+
         # Reuse current material if it exists, otherwise create a new material
-        material = bpy.data.materials.get(key)
+        material = bpy.data.materials.get(key.name)
         if material is not None:
+            cls.__materials[key] = material
             return material
 
         material = cls.__create_node_based_material(
-            key,
+            key.name,
             color,
             bfc_certified=bfc_certified,
             part_slopes=part_slopes,
@@ -70,11 +76,12 @@ class BlenderMaterials:
             pe_texmap=pe_texmap,
             mark_as_asset=mark_as_asset
         )
+        cls.__materials[key] = material
         return material
 
     @classmethod
     def __build_key(cls, color, bfc_certified, part_slopes, parts_cloth, texmap, pe_texmap):
-        _key = ()
+        _key = ("material",)
 
         _key += (color.name, color.code,)
 
@@ -94,16 +101,7 @@ class BlenderMaterials:
         if pe_texmap is not None:
             _key += (pe_texmap.texture,)
 
-        str_key = str(_key)
-        if len(str_key) < 60:
-            return str(str_key)
-
-        key = cls.__key_map.get(_key)
-        if key is None:
-            cls.__key_map[_key] = str(uuid.uuid4())
-            key = cls.__key_map.get(_key)
-
-        return key
+        return StructuralKey.get(_key, label=f"{color.code}-{color.name}")
 
     @classmethod
     def __create_node_based_material(cls, key, color, bfc_certified=True, part_slopes=None, parts_cloth=False, texmap=None, pe_texmap=None, mark_as_asset=False):
@@ -1,10 +1,18 @@
 import os
 import string
-import glob
+import pickle
 from sys import platform
 from pathlib import Path
 import tempfile
 
+try:
+    from .definitions import APP_ROOT
+except ImportError as e:
+    print(e)
+    import traceback
+    print(traceback.format_exc())
+    from definitions import APP_ROOT
+
 
 def locate_ldraw():
     ldraw_folder_name = 'ldraw'
@@ -92,12 +100,21 @@ class FileSystem:
         return FileSystem.resolution_choices[FileSystem.resolution][0]
 
     search_dirs = []
-    lowercase_paths = {}
+
+    # lowercase path relative to a search dir -> full path, filled in search_dirs order so the first match wins
+    library_index = {}
+
+    # directory -> (mtime_ns, files, subdirs), kept between imports and sessions
+    # a directory is only scanned again when its mtime changes
+    library_index_path = os.path.join('config', 'cache', 'library_index.pickle')
+    library_index_version = 1
+    __dir_listings = None
+    __dir_listings_changed = False
 
     @classmethod
     def reset_caches(cls):
         cls.search_dirs.clear()
-        cls.lowercase_paths.clear()
+        cls.library_index.clear()
 
     @classmethod
     def build_search_paths(cls, parent_filepath=None):
@@ -157,22 +174,111 @@ class FileSystem:
             path = os.path.join(root, "models")
             cls.append_search_path(path)
 
+        cls.save_dir_listings()
+
     # build a list of folders to search for parts
-    # build a map of lowercase to actual filenames
+    # on a case sensitive filesystem add the files in that folder and every folder below it to the library index
+    # root folders only contribute their own files
+    # a case insensitive filesystem finds a file whatever the case of its name, so locate checks the folders instead
     @classmethod
     def append_search_path(cls, path, root=False):
         cls.search_dirs.append(path)
-        if cls.case_sensitive_filesystem:
-            cls.append_lowercase_paths(path, '*')
-            if root:
-                return
-            cls.append_lowercase_paths(path, '**/*')
+        if not cls.case_sensitive_filesystem:
+            return
+
+        depth = None
+        if root:
+            depth = 0
+        cls.__index_dir(path, "", depth)
+
+    @classmethod
+    def __index_dir(cls, path, relative_path, depth):
+        listing = cls.__get_dir_listing(path)
+        if listing is None:
+            return
+
+        files, subdirs = listing
+        for name in files:
+            lc_path = os.path.join(relative_path, name).lower()
+            cls.library_index.setdefault(lc_path, os.path.join(path, name))
+
+        # a depth of None has no limit
+        if depth is None or depth > 0:
+            for name in subdirs:
+                cls.__index_dir(os.path.join(path, name), os.path.join(relative_path, name), None if depth is None else depth - 1)
 
     @classmethod
-    def append_lowercase_paths(cls, path, pattern):
-        files = glob.glob(os.path.join(path, pattern))
-        for file in files:
-            cls.lowercase_paths.setdefault(file.lower(), file)
+    def __get_dir_listing(cls, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        if cls.__dir_listings is None:
+            cls.load_dir_listings()
+
+        listing = cls.__dir_listings.get(path)
+        if listing is not None and listing[0] == mtime:
+            return listing[1], listing[2]
+
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+        except OSError as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
+            return None
+
+        files.sort()
+        subdirs.sort()
+        cls.__dir_listings[path] = (mtime, files, subdirs)
+        cls.__dir_listings_changed = True
+        return files, subdirs
+
+    @classmethod
+    def load_dir_listings(cls):
+        cls.__dir_listings = {}
+        full_path = os.path.join(APP_ROOT, cls.library_index_path)
+        if not os.path.isfile(full_path):
+            return
+
+        try:
+            with open(full_path, 'rb') as file:
+                data = pickle.load(file)
+            if data.get("version") == cls.library_index_version:
+                cls.__dir_listings = data["dirs"]
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
+
+    @classmethod
+    def save_dir_listings(cls):
+        if not cls.__dir_listings_changed:
+            return
+
+        try:
+            full_path = os.path.join(APP_ROOT, cls.library_index_path)
+            Path(os.path.dirname(full_path)).mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{full_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file:
+                pickle.dump({
+                    "version": cls.library_index_version,
+                    "dirs": cls.__dir_listings,
+                }, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, full_path)
+            cls.__dir_listings_changed = False
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
 
     @classmethod
     def locate(cls, filename):
@@ -183,18 +289,16 @@ class FileSystem:
         if os.path.isfile(part_path):
             return part_path
 
+        full_path = cls.library_index.get(part_path.lower())
+        if full_path is not None:
+            return full_path
+
+        # the index is only built on case sensitive filesystems and only has what was there when build_search_paths ran
         for dir in cls.search_dirs:
             full_path = os.path.join(dir, part_path)
             if os.path.isfile(full_path):
                 return full_path
 
-            lc_path = full_path.lower()
-            if lc_path in cls.lowercase_paths:
-                full_path = cls.lowercase_paths.get(lc_path)
-
-            if os.path.isfile(full_path):
-                return full_path
-
         # TODO: requests retrieve missing items from ldraw.org
 
         print(f"missing {filename}")
@@ -1,98 +1,217 @@
-class FaceData:
+import numpy as np
+
+from . import matrices
+
+
+class GeometryBlock:
     """
-    Raw vertex information
+    The type 2, 3, 4 and 5 lines of one load of a file, kept as rows of file.vertices
+    until they are added to a GeometryData. All of file.vertices is transformed at once the first time.
     """
 
-    def __init__(self, vertices, color_code, texmap=None, pe_texmap=None):
-        self.vertices = vertices
-        self.color_code = color_code
-        self.texmap = texmap
-        self.pe_texmap = pe_texmap
-
+    # rows of a face for [vertex count - 3][is reversed]
+    # triangles repeat their last vertex so every face has 4 rows
     # https://github.com/rredford/LdrawToObj/blob/802924fb8d42145c4f07c10824e3a7f2292a6717/LdrawData/LdrawToData.cs#L219
     # https://github.com/rredford/LdrawToObj/blob/802924fb8d42145c4f07c10824e3a7f2292a6717/LdrawData/LdrawToData.cs#L260
-    @staticmethod
-    def handle_vertex_winding(child_node, matrix, winding):
-        vert_count = len(child_node.vertices)
-
-        # matrix = matrix @ matrices.gap_scale_matrix
-
-        vertices = []
-        if winding == "CW":
-            if vert_count == 3:
-                vertices = [
-                    matrix @ child_node.vertices[0],
-                    matrix @ child_node.vertices[2],
-                    matrix @ child_node.vertices[1],
-                ]
-            elif vert_count == 4:
-                vertices = [
-                    matrix @ child_node.vertices[0],
-                    matrix @ child_node.vertices[3],
-                    matrix @ child_node.vertices[2],
-                    matrix @ child_node.vertices[1],
-                ]
-                FaceData.__fix_bowties(vertices)
-        else:  # winding == "CCW" or winding is None:
-            if vert_count == 3:
-                vertices = [
-                    matrix @ child_node.vertices[0],
-                    matrix @ child_node.vertices[1],
-                    matrix @ child_node.vertices[2],
-                ]
-            elif vert_count == 4:
-                vertices = [
-                    matrix @ child_node.vertices[0],
-                    matrix @ child_node.vertices[1],
-                    matrix @ child_node.vertices[2],
-                    matrix @ child_node.vertices[3],
-                ]
-                FaceData.__fix_bowties(vertices)
-
-        return vertices
+    __face_windings = np.array((
+        ((0, 1, 2, 2), (0, 2, 1, 1)),
+        ((0, 1, 2, 3), (0, 3, 2, 1)),
+    ), dtype=np.intp)
 
-    # handle bowtie quadrilaterals - 6582.dat
-    # https://github.com/TobyLobster/ImportLDraw/pull/65/commits/3d8cebee74bf6d0447b616660cc989e870f00085
-    @staticmethod
-    def __fix_bowties(vertices):
-        nA = (vertices[1] - vertices[0]).cross(vertices[2] - vertices[0])
-        nB = (vertices[2] - vertices[1]).cross(vertices[3] - vertices[1])
-        nC = (vertices[3] - vertices[2]).cross(vertices[0] - vertices[2])
-        if nA.dot(nB) < 0:
-            vertices[2], vertices[3] = vertices[3], vertices[2]
-        elif nB.dot(nC) < 0:
-            vertices[2], vertices[1] = vertices[1], vertices[2]
+    def __init__(self, ldraw_file):
+        self.file = ldraw_file
+        # file.vertices in mesh space
+        self.vertices = None
+        self.clear()
+
+    # the lines that were added are cleared when they are added to a GeometryData
+    # the transformed vertices are kept for the lines that come after them
+    def clear(self):
+        self.edge_starts = []
+        self.edge_color_codes = []
+
+        self.face_starts = []
+        self.face_vertex_counts = []
+        self.face_reversed = []
+        self.face_color_codes = []
+        self.face_texmaps = []
+        self.face_pe_texmaps = []
+
+        self.line_starts = []
+        self.line_color_codes = []
+
+    def add_edge(self, command, color_code):
+        self.edge_starts.append(command.vertex_index)
+        self.edge_color_codes.append(color_code)
+
+    def add_face(self, command, color_code, winding, texmap=None, pe_texmap=None):
+        self.face_starts.append(command.vertex_index)
+        self.face_vertex_counts.append(command.vertex_count)
+        self.face_reversed.append(winding == "CW")
+        self.face_color_codes.append(color_code)
+        self.face_texmaps.append(texmap)
+        self.face_pe_texmaps.append(pe_texmap)
+
+    def add_line(self, command, color_code):
+        self.line_starts.append(command.vertex_index)
+        self.line_color_codes.append(color_code)
+
+    def is_empty(self):
+        return len(self.edge_starts) + len(self.face_starts) + len(self.line_starts) < 1
+
+    # the 4 rows of every face in file.vertices in winding order
+    def face_rows(self):
+        counts = np.array(self.face_vertex_counts, dtype=np.intp)
+        windings = GeometryBlock.__face_windings[counts - 3, np.array(self.face_reversed, dtype=np.intp)]
+        return np.array(self.face_starts, dtype=np.intp)[:, None] + windings, counts
 
 
 class GeometryData:
     """
     Raw mesh data used to build the final mesh.
+    Vertices are in mesh space, matrices.mesh_matrix has already been applied.
     """
 
-    def __init__(self):
+    # a local geometry_data is a subpart or primitive flattened in the space of its file
+    # bowties are only fixed once it's placed in a part with add_geometry
+    def __init__(self, local=False):
         self.key = None
         self.file = None
         self.bfc_certified = None
-        self.edge_data = []
-        self.face_data = []
-        self.line_data = []
-
-    def add_edge_data(self, vertices, color_code):
-        self.edge_data.append(FaceData(
-            vertices=vertices,
-            color_code=color_code,
-        ))
-
-    def add_face_data(self, vertices, color_code, texmap=None, pe_texmap=None):
-        self.face_data.append(FaceData(
-            vertices=vertices,
-            color_code=color_code,
-            texmap=texmap,
-            pe_texmap=pe_texmap,
-        ))
-
-    def add_line_data(self, vertices, color_code):
-        self.line_data.append(FaceData(
-            vertices=vertices,
-            color_code=color_code,
-        ))
+        self.local = local
+        # places geometry in the space of this geometry_data
+        self.matrix = matrices.identity_matrix if local else matrices.mesh_matrix
+
+        # each add_block adds an array to these lists, they are joined when they are read
+        self.__edge_blocks = []
+        self.edge_color_codes = []
+
+        self.__face_blocks = []
+        self.__face_vertex_count_blocks = []
+        self.face_color_codes = []
+        self.face_texmaps = []
+        self.face_pe_texmaps = []
+
+        self.__line_blocks = []
+        self.line_color_codes = []
+
+    # (E, 2, 3)
+    @property
+    def edge_vertices(self):
+        return GeometryData.__join(self.__edge_blocks, (0, 2, 3))
+
+    # (F, 4, 3), triangles repeat their last vertex
+    @property
+    def face_vertices(self):
+        return GeometryData.__join(self.__face_blocks, (0, 4, 3))
+
+    # (F,) 3 or 4
+    @property
+    def face_vertex_counts(self):
+        return GeometryData.__join(self.__face_vertex_count_blocks, (0,), dtype=np.intp)
+
+    # (L, 4, 3)
+    @property
+    def line_vertices(self):
+        return GeometryData.__join(self.__line_blocks, (0, 4, 3))
+
+    def face_count(self):
+        return len(self.face_color_codes)
+
+    # join the blocks into one array and keep that so it's only joined again after another add_block
+    @staticmethod
+    def __join(blocks, empty_shape, dtype=np.float64):
+        if len(blocks) < 1:
+            return np.empty(empty_shape, dtype=dtype)
+        if len(blocks) > 1:
+            blocks[:] = [np.concatenate(blocks)]
+        return blocks[0]
+
+    # matrix is the mathutils.Matrix that places the block in mesh space
+    # every vertex of the file is transformed with it the first time and then gathered into edges, faces and lines
+    # adding a block before each subfile is loaded keeps the lines in file order
+    def add_block(self, geometry_block, matrix):
+        if geometry_block.is_empty():
+            return
+
+        if geometry_block.vertices is None:
+            matrix = np.array(matrix, dtype=np.float64)
+            geometry_block.vertices = geometry_block.file.vertices @ matrix[:3, :3].T + matrix[:3, 3]
+        vertices = geometry_block.vertices
+
+        if len(geometry_block.edge_starts) > 0:
+            rows = np.array(geometry_block.edge_starts, dtype=np.intp)[:, None] + np.arange(2)
+            self.__edge_blocks.append(vertices[rows])
+            self.edge_color_codes.extend(geometry_block.edge_color_codes)
+
+        if len(geometry_block.face_starts) > 0:
+            rows, counts = geometry_block.face_rows()
+            faces = vertices[rows]
+            if not self.local:
+                GeometryData.__fix_bowties(faces, counts)
+            self.__face_blocks.append(faces)
+            self.__face_vertex_count_blocks.append(counts)
+            self.face_color_codes.extend(geometry_block.face_color_codes)
+            self.face_texmaps.extend(geometry_block.face_texmaps)
+            self.face_pe_texmaps.extend(geometry_block.face_pe_texmaps)
+
+        if len(geometry_block.line_starts) > 0:
+            rows = np.array(geometry_block.line_starts, dtype=np.intp)[:, None] + np.arange(4)
+            self.__line_blocks.append(vertices[rows])
+            self.line_color_codes.extend(geometry_block.line_color_codes)
+
+        geometry_block.clear()
+
+    # add a local geometry_data, matrix places it in the space of this one
+    # its color code 16 is replaced with color_code
+    def add_geometry(self, geometry_data, matrix, color_code):
+        matrix = np.array(matrix, dtype=np.float64)
+        rotation = matrix[:3, :3].T
+        translation = matrix[:3, 3]
+
+        if len(geometry_data.edge_color_codes) > 0:
+            self.__edge_blocks.append(geometry_data.edge_vertices @ rotation + translation)
+            self.edge_color_codes.extend(GeometryData.__replace_color(geometry_data.edge_color_codes, color_code))
+
+        if len(geometry_data.face_color_codes) > 0:
+            faces = geometry_data.face_vertices @ rotation + translation
+            counts = geometry_data.face_vertex_counts
+            if not self.local:
+                GeometryData.__fix_bowties(faces, counts)
+            self.__face_blocks.append(faces)
+            self.__face_vertex_count_blocks.append(counts)
+            self.face_color_codes.extend(GeometryData.__replace_color(geometry_data.face_color_codes, color_code))
+            self.face_texmaps.extend(geometry_data.face_texmaps)
+            self.face_pe_texmaps.extend(geometry_data.face_pe_texmaps)
+
+        if len(geometry_data.line_color_codes) > 0:
+            self.__line_blocks.append(geometry_data.line_vertices @ rotation + translation)
+            self.line_color_codes.extend(GeometryData.__replace_color(geometry_data.line_color_codes, color_code))
+
+    @staticmethod
+    def __replace_color(color_codes, color_code):
+        if color_code == "16":
+            return color_codes
+        return [color_code if c == "16" else c for c in color_codes]
+
+    # handle bowtie quadrilaterals - 6582.dat
+    # https://github.com/TobyLobster/ImportLDraw/pull/65/commits/3d8cebee74bf6d0447b616660cc989e870f00085
+    # swaps the vertices of the quads in faces in place
+    @staticmethod
+    def __fix_bowties(faces, counts):
+        quads = np.flatnonzero(counts == 4)
+        if len(quads) < 1:
+            return
+
+        v = faces[quads]
+        nA = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+        nB = np.cross(v[:, 2] - v[:, 1], v[:, 3] - v[:, 1])
+        nC = np.cross(v[:, 3] - v[:, 2], v[:, 0] - v[:, 2])
+
+        swap_2_3 = np.einsum('ij,ij->i', nA, nB) < 0
+        swap_1_2 = ~swap_2_3 & (np.einsum('ij,ij->i', nB, nC) < 0)
+
+        i = quads[swap_2_3]
+        faces[i] = faces[i][:, (0, 1, 3, 2)]
+        i = quads[swap_1_2]
+        faces[i] = faces[i][:, (0, 2, 1, 3)]
@@ -15,6 +15,15 @@ except ImportError as e:
     from definitions import APP_ROOT
 
 
+# run a generator to the end and return what it returns
+def run_to_end(generator):
+    while True:
+        try:
+            next(generator)
+        except StopIteration as e:
+            return e.value
+
+
 # remove multiple spaces
 def clean_line(line):
     return " ".join(line.split())
@@ -103,8 +112,9 @@ def finish_bmesh(bm, mesh):
     bm.free()
 
 
-def finish_mesh(mesh):
-    mesh.validate()
+def finish_mesh(mesh, validate=True):
+    if validate:
+        mesh.validate()
     mesh.update(calc_edges=True)
 
 
@@ -8,6 +8,10 @@ class ImportOptions:
     defaults["merge_distance"] = 0.05
     merge_distance = defaults["merge_distance"]
 
+    # meshes are built from arrays that are always valid, validating them is only a safety net
+    defaults["validate_meshes"] = True
+    validate_meshes = defaults["validate_meshes"]
+
     defaults["meta_bfc"] = True
     meta_bfc = defaults["meta_bfc"]
 
@@ -64,6 +68,18 @@ class ImportOptions:
     defaults['preserve_hierarchy'] = False
     preserve_hierarchy = defaults['preserve_hierarchy']
 
+    # only the steps first_step to last_step of the imported model are loaded, steps are counted from 1
+    # last_step 0 loads every step from first_step on
+    defaults["first_step"] = 1
+    first_step = defaults["first_step"]
+
+    defaults["last_step"] = 0
+    last_step = defaults["last_step"]
+
+    # every part is a point of one object that instances the parts with geometry nodes
+    defaults["instance_parts"] = False
+    instance_parts = defaults["instance_parts"]
+
     scale_strategy_choices = (
         ("mesh", "Scale mesh", "Apply import scaling to mesh. Recommended for rendering"),
         ("object", "Scale object", "Apply import scaling to object. Recommended for part editing"),
@@ -75,3 +91,15 @@ class ImportOptions:
     @staticmethod
     def scale_strategy_value():
         return ImportOptions.scale_strategy_choices[ImportOptions.scale_strategy][0]
+
+    defaults["use_parse_cache"] = True
+    use_parse_cache = defaults["use_parse_cache"]
+
+    defaults["prefetch_files"] = True
+    prefetch_files = defaults["prefetch_files"]
+
+    defaults["parse_in_processes"] = False
+    parse_in_processes = defaults["parse_in_processes"]
+
+    defaults["use_part_archive"] = True
+    use_part_archive = defaults["use_part_archive"]
@@ -10,6 +10,9 @@ class ImportSettings:
     settings_path = os.path.join('config', 'ImportOptions.json')
     settings = None
 
+    # settings that only apply to the next import, they go back to their defaults once it has read them
+    import_only_settings = ("first_step", "last_step")
+
     filesystem_defaults = FileSystem.defaults
     ldraw_color_defaults = LDrawColor.defaults
     import_options_defaults = ImportOptions.defaults
@@ -57,13 +60,19 @@ class ImportSettings:
     def save_settings(cls):
         helpers.write_json(cls.settings_path, cls.settings)
 
+    @classmethod
+    def reset_import_only_settings(cls):
+        for k in cls.import_only_settings:
+            cls.settings[k] = cls.default_settings[k]
+
     @classmethod
     def apply_settings(cls):
+        # settings saved by an older version won't have keys for newer options
         for k, v in cls.filesystem_defaults.items():
-            setattr(FileSystem, k, cls.settings[k])
+            setattr(FileSystem, k, cls.settings.get(k, v))
 
         for k, v in cls.ldraw_color_defaults.items():
-            setattr(LDrawColor, k, cls.settings[k])
+            setattr(LDrawColor, k, cls.settings.get(k, v))
 
         for k, v in cls.import_options_defaults.items():
-            setattr(ImportOptions, k, cls.settings[k])
+            setattr(ImportOptions, k, cls.settings.get(k, v))
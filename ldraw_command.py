@@ -0,0 +1,261 @@
+import mathutils
+
+from . import helpers
+
+# a file's body is built into a list of these records once, LDrawNode.load walks them for every reference to the file
+# every record has an integer opcode so the walk dispatches on ints instead of comparing strings
+# the values match the opcodes of the part archive
+SUBFILE = 1
+EDGE = 2
+TRIANGLE = 3
+QUAD = 4
+LINE = 5  # conditional line
+BFC = 16
+PRINT = 17
+COLOUR = 18
+STEP = 19
+SAVE = 20
+CLEAR = 21
+TEXMAP = 22
+PE_TEX_PATH = 23
+PE_TEX_INFO = 24
+PE_TEX_NEXT_SHEAR = 25
+
+# meta_command of a parsed command tuple -> opcode
+opcodes = {
+    "1": SUBFILE,
+    "2": EDGE,
+    "3": TRIANGLE,
+    "4": QUAD,
+    "5": LINE,
+    "bfc": BFC,
+    "print": PRINT,
+    "colour": COLOUR,
+    "step": STEP,
+    "save": SAVE,
+    "clear": CLEAR,
+    "texmap": TEXMAP,
+    "pe_tex_path": PE_TEX_PATH,
+    "pe_tex_info": PE_TEX_INFO,
+    "pe_tex_next_shear": PE_TEX_NEXT_SHEAR,
+}
+
+texture_meta_opcodes = {TEXMAP, PE_TEX_PATH, PE_TEX_INFO, PE_TEX_NEXT_SHEAR}
+
+
+def sign(value):
+    if value > 0:
+        return 1
+    if value < 0:
+        return -1
+    return 0
+
+
+class MetaCommand:
+    """
+    A meta command that has nothing to it but its opcode - STEP, SAVE, CLEAR and PE_TEX_NEXT_SHEAR.
+    """
+
+    __slots__ = ("opcode",)
+
+    def __init__(self, opcode):
+        self.opcode = opcode
+
+
+class SubfileCommand:
+    """
+    A type 1 line with its file already located.
+    """
+
+    __slots__ = ("opcode", "color_code", "file", "matrix", "determinant_sign")
+
+    def __init__(self, color_code, ldraw_file, matrix_values):
+        self.opcode = SUBFILE
+        self.color_code = color_code
+        self.file = ldraw_file
+
+        (x, y, z, a, b, c, d, e, f, g, h, i) = matrix_values
+        self.matrix = mathutils.Matrix((
+            (a, b, c, x),
+            (d, e, f, y),
+            (g, h, i, z),
+            (0, 0, 0, 1)
+        )).freeze()
+        # the sign of the determinant of a product is the product of the signs
+        # so the bfc winding below this line never needs the determinant of the accumulated matrix
+        self.determinant_sign = sign(self.matrix.determinant())
+
+
+class GeometryCommand:
+    """
+    A type 2, 3, 4 or 5 line as vertex_count rows of its file's vertices starting at vertex_index.
+    """
+
+    __slots__ = ("opcode", "color_code", "vertex_index", "vertex_count", "pe_uvs")
+
+    def __init__(self, opcode, color_code, vertex_index, vertex_count, clean_line):
+        self.opcode = opcode
+        self.color_code = color_code
+        self.vertex_index = vertex_index
+        self.vertex_count = vertex_count
+
+        # triangles can have the uvs of a PE_TEX_INFO after their vertices
+        self.pe_uvs = None
+        if opcode == TRIANGLE:
+            _params = clean_line.split()[2:]
+            if len(_params) == 15:
+                self.pe_uvs = tuple(
+                    mathutils.Vector((round(float(_params[i * 2 + 9]), 3), round(float(_params[i * 2 + 10]), 3))).freeze()
+                    for i in range(vertex_count)
+                )
+
+
+class BfcCommand:
+    """
+    A BFC meta command split into the options it has.
+    """
+
+    __slots__ = ("opcode", "certify", "nocertify", "clip", "noclip", "ccw", "cw", "invertnext", "only_invertnext")
+
+    def __init__(self, command):
+        _params = command.split()
+        self.opcode = BFC
+        self.certify = "CERTIFY" in _params
+        self.nocertify = "NOCERTIFY" in _params
+        self.clip = "CLIP" in _params
+        self.noclip = "NOCLIP" in _params
+        self.ccw = "CCW" in _params
+        self.cw = "CW" in _params
+        self.invertnext = "INVERTNEXT" in _params
+        # invert_next only carries over to the next line after a line that is just 0 BFC INVERTNEXT
+        self.only_invertnext = command == "INVERTNEXT"
+
+
+class PrintCommand:
+    __slots__ = ("opcode", "message")
+
+    def __init__(self, message):
+        self.opcode = PRINT
+        self.message = message
+
+
+# https://www.ldraw.org/documentation/ldraw-org-file-format-standards/language-extension-for-texture-mapping.html
+class TexmapCommand:
+    """
+    A TEXMAP meta command. START and NEXT have their points in the space of the file they're in.
+    """
+
+    __slots__ = ("opcode", "action", "method", "points", "angles", "texture", "glossmap")
+
+    # the number of values that come after the method, the texture and glossmap follow them
+    __value_counts = {
+        "PLANAR": 9,
+        "CYLINDRICAL": 10,
+        "SPHERICAL": 11,
+    }
+
+    def __init__(self, clean_line):
+        _params = clean_line.split()
+        self.opcode = TEXMAP
+        self.action = None
+        self.method = None
+        self.points = None
+        self.angles = None
+        self.texture = None
+        self.glossmap = None
+
+        if len(_params) == 3 and _params[2] in ("FALLBACK", "END"):
+            self.action = _params[2]
+            return
+
+        if len(_params) < 4 or _params[2] not in ("START", "NEXT"):
+            return
+
+        self.action = _params[2]
+        self.method = _params[3]
+
+        value_count = self.__value_counts.get(self.method)
+        if value_count is None:
+            return
+
+        _params = clean_line.split(maxsplit=4 + value_count)
+        values = tuple(map(float, _params[4:4 + value_count]))
+        self.points = tuple(mathutils.Vector(values[i:i + 3]).freeze() for i in range(0, 9, 3))
+        self.angles = values[9:]
+
+        texture_params = helpers.parse_csv_line(_params[4 + value_count], 2)
+        self.texture = texture_params[0]
+        self.glossmap = texture_params[1]
+        if self.glossmap == "":
+            self.glossmap = None
+
+
+class PETexPathCommand:
+    __slots__ = ("opcode", "path", "subfile_path")
+
+    def __init__(self, clean_line):
+        _params = clean_line.split()[2:]
+        self.opcode = PE_TEX_PATH
+        self.path = int(_params[0])
+        self.subfile_path = None
+        if len(_params) == 4:
+            self.subfile_path = int(_params[1])
+
+
+# PE_TEX_INFO bse64_str uses the file's uvs
+# PE_TEX_INFO x,y,z,a,b,c,d,e,f,g,h,i,bl/tl,tr/br,bse64_str defines a bounding box and its transformation
+# rotated 90 deg on x, similar to the original part export matrix
+class PETexInfoCommand:
+    __slots__ = ("opcode", "base64_str", "matrix", "matrix_inverse", "point_min", "point_max", "point_diff", "box_extents")
+
+    def __init__(self, clean_line):
+        _params = clean_line.split()[2:]
+        self.opcode = PE_TEX_INFO
+        self.base64_str = None
+        self.matrix = None
+        self.matrix_inverse = None
+        self.point_min = None
+        self.point_max = None
+        self.point_diff = None
+        self.box_extents = None
+
+        if len(_params) == 1:
+            self.base64_str = _params[0]
+        elif len(_params) == 17:
+            params = _params
+
+            x = float(params[0])
+            y = float(params[1])
+            z = -float(params[2])
+
+            a = float(params[3])
+            b = float(params[4])
+            c = -float(params[5])
+
+            d = float(params[6])
+            e = float(params[7])
+            f = -float(params[8])
+
+            g = -float(params[9])
+            h = -float(params[10])
+            i = float(params[11])
+
+            _matrix = mathutils.Matrix((
+                (a, b, c, x),
+                (d, e, f, y),
+                (g, h, i, z),
+                (0, 0, 0, 1)
+            ))
+
+            # this is the original transformation of the bounding box
+            self.matrix = _matrix.freeze()
+            self.matrix_inverse = _matrix.inverted().freeze()
+
+            point_min = mathutils.Vector((float(params[12]), float(params[13])))
+            point_max = mathutils.Vector((float(params[14]), float(params[15])))
+            self.point_min = point_min.freeze()
+            self.point_max = point_max.freeze()
+            self.point_diff = (point_max - point_min).freeze()
+            self.box_extents = (0.5 * mathutils.Vector((1, 1))).freeze()
+
+            self.base64_str = params[16]
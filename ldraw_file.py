@@ -1,13 +1,22 @@
 import mathutils
+import numpy as np
 
 import os
 import re
+import sys
+import mmap
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from .import_options import ImportOptions
 from .filesystem import FileSystem
-from .ldraw_node import LDrawNode
 from .ldraw_color import LDrawColor
+from .parse_cache import ParseCache
+from .part_archive import PartArchive
 from . import base64_handler
+from . import ldraw_command
 from . import helpers
 from . import ldraw_part_types
 from . import texmap
@@ -16,16 +25,58 @@ from . import matrices
 
 class LDrawFile:
     """
-    A file that has been loaded and its lines converted to header data and ldraw_nodes.
+    A file that has been loaded and its lines converted to header data and command records.
     """
 
     __unparsed_file_cache = {}
     __parsed_file_cache = {}
+    __missing_files = set()
+
+    # filename -> future of __read_source for files that are likely to be requested soon
+    # file opens are what takes the time on network shares and cold disks, so a few threads are enough
+    __prefetched_files = {}
+    __prefetch_pool = None
+    __prefetch_workers = 8
+
+    # mpds with fewer files than this aren't worth starting worker processes for
+    __process_parse_min_files = 16
+
+    # every get_file call versus the files that were actually read and built
+    reference_count = 0
+    unique_file_count = 0
+    missing_file_count = 0
+
+    # the attributes set by __parse_header and __parse_body that are stored in the parse cache
+    __header_attrs = [
+        "description", "name", "author", "part_type", "actual_part_type", "optional_qualifier", "update_date",
+        "license", "help", "category", "keywords", "cmdline", "history", "named", "geometry_commands",
+    ]
 
     @classmethod
     def reset_caches(cls):
+        cls.close_sources()
         cls.__unparsed_file_cache.clear()
         cls.__parsed_file_cache.clear()
+        cls.__missing_files.clear()
+        cls.reference_count = 0
+        cls.unique_file_count = 0
+        cls.missing_file_count = 0
+
+    # unmap the mpds that still have files that were never requested, so the files aren't held open after an import
+    # files that were prefetched but never requested are dropped
+    # a file of an mpd that is requested after this maps the mpd again
+    @classmethod
+    def close_sources(cls):
+        for ldraw_file in cls.__unparsed_file_cache.values():
+            if ldraw_file.__read_group is not None:
+                cls.__close_source(ldraw_file.__read_group)
+
+        for future in cls.__prefetched_files.values():
+            if future.cancel():
+                continue
+            if future.exception() is None and future.result() is not None:
+                cls.__close_source(future.result())
+        cls.__prefetched_files.clear()
 
     def __init__(self, filename):
         self.filename = filename
@@ -48,11 +99,51 @@ class LDrawFile:
         self.cmdline = None
         self.history = []
 
-        self.child_nodes = []
+        # plain tuples produced by __parse_header and __parse_body, turned into records by __build_records
+        # (meta_command, clean_line, ...command specific values)
+        self.commands = []
         self.geometry_commands = {}
 
+        # every vertex of the type 2, 3, 4 and 5 lines as one (N, 3) array
+        # the records of those lines hold where their rows start in vertex_index
+        self.vertices = None
+
+        # the body is everything from the first line that isn't a 0 line
+        # it is only parsed and built when records is first used
+        self.__body_start = 0
+        self.__read_group = None
+        self.__records = None
+
+        # where this file is in an mpd that hasn't been decoded yet
+        self.__spans = None
+
+        self.__has_texture_meta = None
+
+        # whether the body has type 2, 3, 4 or 5 lines and the filenames of its type 1 lines
+        # found with a regex when the file is decoded, so has_geometry doesn't need the body parsed
+        self.__geometry_scan = None
+        self.__has_geometry = None
+
         self.named = False
 
+    @property
+    def records(self):
+        return self.load_body()
+
+    # parse the body if it hasn't been parsed yet and build its records
+    # subfiles are only read when the records that reference them are built
+    def load_body(self):
+        if self.__records is None:
+            self.__records = []
+            self.__parse_body()
+            self.__build_records()
+        return self.__records
+
+    # the filenames this file references, without reading them
+    def subfile_names(self):
+        self.__parse_body()
+        return [command[4] for command in self.commands if command[0] == "1"]
+
     def __str__(self):
         return "\n".join([
             f"filename: {self.filename}",
@@ -82,6 +173,10 @@ class LDrawFile:
         if filename == alt_filename and ldraw_file is None:
             ldraw_file = LDrawFile.get_file(standard_filename)
 
+        # colors are defined in the body
+        if ldraw_file is not None:
+            ldraw_file.load_body()
+
         # import all materials
         # from .blender_materials import BlenderMaterials
         # for line in ldraw_file.lines:
@@ -92,175 +187,547 @@ class LDrawFile:
 
         return ldraw_file
 
+    # each file is read once per import and then shared by every line that references it
+    # only the header is parsed here, the body is parsed and built on first use of records
+    # so reading the headers of many files doesn't pay for their geometry
+    # files that can't be found are remembered so they aren't searched for again
     @classmethod
     def get_file(cls, filename):
-        ldraw_file = cls.__read_file(filename)
+        cls.reference_count += 1
+
+        ldraw_file = cls.__parsed_file_cache.get(filename)
+        if ldraw_file is not None:
+            return ldraw_file
+
+        if filename in cls.__missing_files:
+            return None
 
+        # mpd subfiles are already read by the time they are referenced
+        ldraw_file = cls.__unparsed_file_cache.pop(filename, None)
         if ldraw_file is None:
+            ldraw_file = cls.__read_file(filename)
+
+        if ldraw_file is None:
+            cls.__missing_files.add(filename)
+            cls.missing_file_count += 1
             return ldraw_file
 
-        ldraw_file.__parse_file()
+        ldraw_file.__materialize()
+
+        # the first file of an mpd is requested by its path but referenced by its FILE name
         cls.__parsed_file_cache[filename] = ldraw_file
+        cls.__parsed_file_cache[ldraw_file.filename] = ldraw_file
+        cls.__unparsed_file_cache.pop(ldraw_file.filename, None)
+        cls.unique_file_count += 1
         return ldraw_file
 
+    # a file that was prefetched is only added when it is requested
+    # so files are added in the same order with or without prefetching
     @classmethod
     def __read_file(cls, filename):
+        future = cls.__prefetched_files.pop(filename, None)
+        if future is not None:
+            source = future.result()
+        else:
+            source = cls.__read_source(filename)
+        return cls.__add_source(filename, source)
+
+    # read the dependencies of files whose subfile lines are known on the prefetch pool
+    # search path priority is kept because the pool uses the same FileSystem.locate
+    @classmethod
+    def __prefetch(cls, read_files):
+        if not ImportOptions.prefetch_files:
+            return
+
+        for read_file in read_files:
+            for filename in read_file.subfile_names():
+                if filename in cls.__parsed_file_cache:
+                    continue
+                if filename in cls.__unparsed_file_cache:
+                    continue
+                if filename in cls.__missing_files:
+                    continue
+                if filename in cls.__prefetched_files:
+                    continue
+
+                if cls.__prefetch_pool is None:
+                    cls.__prefetch_pool = ThreadPoolExecutor(max_workers=cls.__prefetch_workers)
+                cls.__prefetched_files[filename] = cls.__prefetch_pool.submit(cls.__read_source, filename)
+
+    # locate the file, then either restore it from the parse cache or index the files it contains
+    # this doesn't touch class state or bpy so it can run on the prefetch pool
+    @classmethod
+    def __read_source(cls, filename):
         filepath = FileSystem.locate(filename)
         if filepath is None:
             return None
 
-        with open(filepath, 'r', encoding='utf-8') as file:
-            hit_not_blank_line = False
-            is_mpd = None
-            no_file = False
-            first_mpd_filename = None
-            current_file = None
-            current_mpd_file = None
-            current_data_filename = None
-            current_data = None
-
-            for line in file:
-                clean_line = helpers.clean_line(line)
-                strip_line = line.strip()
-
-                if clean_line == "":
-                    continue
+        file_record = PartArchive.load(filename, filepath)
+        if file_record is not None:
+            return cls.__cached_source(filename, filepath, None, [file_record], [])
+
+        source = cls.__read_cached_source(filename, filepath)
+        if source is not None:
+            return source
+
+        source = {
+            "filepath": filepath,
+            "root": None,
+            "files": [],
+            "data": [],
+            "cached": False,
+            "mmap": None,
+            "pending": 0,
+        }
+
+        # mmap can't map an empty file
+        if os.path.getsize(filepath) == 0:
+            return source
+
+        with open(filepath, 'rb') as file:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # if the first non-blank line is 0 FILE or 0 !DATA, this is an mpd
+        mpd_line = None
+        first_line = cls.__first_line_pattern.search(mm)
+        if first_line is not None:
+            mpd_line = cls.__mpd_line_pattern.match(mm, first_line.start())
+        is_mpd = mpd_line is not None and mpd_line.group(3) is None
+
+        # not mpd -> regular ldr/dat file
+        if not is_mpd:
+            ldraw_file = LDrawFile(filename)
+            ldraw_file.__read_lines(mm, [(0, len(mm))])
+            ldraw_file.__parse_header()
+            source["files"].append(ldraw_file)
+            mm.close()
+            return source
+
+        source["mmap"] = mm
+        cls.__index_mpd(source, mm)
+        return source
+
+    # a line that isn't blank
+    __first_line_pattern = re.compile(rb'^[ \t\f\v]*[^\s]', re.MULTILINE)
+
+    # 0 FILE name, 0 NOFILE and 0 !DATA name lines
+    __mpd_line_pattern = re.compile(
+        rb'^[ \t\f\v]*0[ \t\f\v]+(?:(FILE|!DATA)[ \t\f\v]+([^\s][^\r\n]*?)|(NOFILE)[^\r\n]*?)[ \t\f\v]*\r?$',
+        re.MULTILINE,
+    )
+
+    # find where the files in an mpd start and end without decoding it
+    # a file is only decoded and its header parsed when it is first requested
+    # lines that follow a !DATA block belong to the file before it, like they did when the mpd was read line by line
+    @classmethod
+    def __index_mpd(cls, source, mm):
+        mpd_lines = list(cls.__mpd_line_pattern.finditer(mm))
 
-                # if we're working on a data block, keep adding to it
-                # until we reach a line that is not is_texmap_line
-                # at that point, process the data block
-                if current_data_filename is not None:
-                    if texmap.is_texmap_line(clean_line):
-                        if ImportOptions.meta_texmap:
-                            try:
-                                base64_data = texmap.clean_line(strip_line)
-                                current_data.append(base64_data)
-                            except IndexError as e:
-                                print(e)
-                                import traceback
-                                print(traceback.format_exc())
-                            continue
-                    else:
-                        base64_handler.named_png_from_base64_str(current_data_filename, "".join(current_data))
-                        current_data_filename = None
-                        current_data = None
-
-                is_file_line = clean_line.startswith("0 FILE ")
-                is_nofile_line = clean_line.startswith("0 NOFILE")
-                is_data_line = clean_line.startswith("0 !DATA ")
-                is_mpd_line = is_file_line or is_data_line
-
-                # if the first non-blank line is 0 FILE, this is an mpd
-                if not hit_not_blank_line:
-                    is_mpd = is_mpd_line
-
-                hit_not_blank_line = True
-
-                # clean up texmap geometry line prefixes
-                if ImportOptions.meta_texmap:
-                    line = texmap.clean_line(line)
-
-                # not mpd -> regular ldr/dat file
-                if not is_mpd:
-                    if current_file is None:
-                        current_file = LDrawFile(filename)
-                    current_file.lines.append(line)
-                    continue
+        current_mpd_file = None
+        for i, mpd_line in enumerate(mpd_lines):
+            start = mpd_line.end()
+            end = mpd_lines[i + 1].start() if i + 1 < len(mpd_lines) else len(mm)
 
-                if is_mpd_line:
-                    no_file = False
+            if mpd_line.group(3) is not None:
+                current_mpd_file = None
+                continue
 
-                if is_file_line:
-                    mpd_filename = strip_line.split(maxsplit=2)[2].lower()
-                    if first_mpd_filename is None:
-                        first_mpd_filename = mpd_filename
+            name = mpd_line.group(2).decode('utf-8')
 
-                    if current_mpd_file is not None:
-                        cls.__unparsed_file_cache[current_mpd_file.filename] = current_mpd_file
-                    current_mpd_file = LDrawFile(mpd_filename)
-                    continue
+            if mpd_line.group(1) == b"FILE":
+                mpd_filename = name.lower()
+                if source["root"] is None:
+                    source["root"] = mpd_filename
 
-                if is_nofile_line:
-                    no_file = True
-                    if current_mpd_file is not None:
-                        cls.__unparsed_file_cache[current_mpd_file.filename] = current_mpd_file
-                    current_mpd_file = None
-                    continue
+                current_mpd_file = LDrawFile(mpd_filename)
+                current_mpd_file.__spans = [(start, end)]
+                source["files"].append(current_mpd_file)
+                continue
 
-                if is_data_line:
-                    current_data_filename = strip_line.split(maxsplit=2)[2]
-                    current_data = []
-                    continue
+            start = cls.__read_data_block(source, mm, name, start, end)
+            if current_mpd_file is not None:
+                current_mpd_file.__spans.append((start, end))
 
-                if no_file:
-                    continue
+        source["pending"] = len(source["files"])
 
-                if current_mpd_file is not None:
-                    current_mpd_file.lines.append(line)
-                    continue
+    # keep adding to a data block until we reach a line that is not is_texmap_line
+    # returns where the lines that aren't part of the data block start
+    @staticmethod
+    def __read_data_block(source, mm, data_filename, start, end):
+        current_data = []
 
-            if current_data_filename is not None:
-                base64_handler.named_png_from_base64_str(current_data_filename, "".join(current_data))
-                current_data_filename = None
-                current_data = None
+        if ImportOptions.meta_texmap:
+            position = start
+            while position < end:
+                line_end = mm.find(b"\n", position, end)
+                if line_end == -1:
+                    line_end = end
+                strip_line = mm[position:line_end].decode('utf-8').strip()
 
-            # last file in mpd will not be added to the file cache if it doesn't end in 0 NOFILE
-            if current_mpd_file is not None:
-                cls.__unparsed_file_cache[current_mpd_file.filename] = current_mpd_file
+                if strip_line != "":
+                    if not texmap.is_texmap_line(helpers.clean_line(strip_line)):
+                        break
+                    current_data.append(texmap.clean_line(strip_line))
+
+                position = line_end + 1
+            start = min(position, end)
+
+        source["data"].append((data_filename, "".join(current_data)))
+        return start
+
+    # the lines of the given parts of the file, cleaned up the same way for every file
+    @staticmethod
+    def __decode_lines(mm, spans):
+        text = b"".join(mm[start:end] for start, end in spans).decode('utf-8')
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+        lines = []
+        for line in text.split("\n"):
+            if line.strip() == "":
+                continue
+
+            # clean up texmap geometry line prefixes
+            if ImportOptions.meta_texmap:
+                line = texmap.clean_line(line)
+            lines.append(line)
+        return lines
+
+    def __read_lines(self, mm, spans):
+        self.lines = self.__decode_lines(mm, spans)
+        self.__geometry_scan = self.__scan_geometry(self.lines)
+
+    # type 2, 3, 4 and 5 lines
+    __geometry_line_pattern = re.compile(r'^[ \t]*[2345][ \t]', re.MULTILINE)
+
+    # the filename of type 1 lines, which can have spaces in it
+    __subfile_line_pattern = re.compile(r'^[ \t]*1(?:[ \t]+[^\s]+){13}[ \t]+([^\s][^\n]*?)[ \t]*$', re.MULTILINE)
+
+    @classmethod
+    def __scan_geometry(cls, lines):
+        text = "\n".join(lines)
+        has_geometry_lines = cls.__geometry_line_pattern.search(text) is not None
+        subfile_names = [cls.__subfile_filename(match.group(1).lower()) for match in cls.__subfile_line_pattern.finditer(text)]
+        return has_geometry_lines, subfile_names
+
+    # decode an mpd file the first time it is requested, or restore all of it from the parse cache
+    # the mpd is unmapped once all of its files have been decoded
+    def __materialize(self):
+        if self.__spans is None:
+            return
+
+        source = self.__read_group
+        spans = self.__spans
+        self.__spans = None
+
+        file_record = ParseCache.load(source["filepath"], block=self.filename)
+        if file_record is not None:
+            self.__apply_record(file_record)
+            self.lines = file_record["lines"]
+            self.__read_group = None
+        else:
+            self.__read_lines(self.__source_mmap(source), spans)
+            self.__parse_header()
+
+        source["pending"] -= 1
+        if source["pending"] == 0:
+            self.__close_source(source)
+
+        if file_record is not None:
+            self.__prefetch([self])
+
+    @staticmethod
+    def __source_mmap(source):
+        if source["mmap"] is None:
+            with open(source["filepath"], 'rb') as file:
+                source["mmap"] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return source["mmap"]
+
+    @classmethod
+    def __close_source(cls, source):
+        if source.get("mmap") is not None:
+            source["mmap"].close()
+            source["mmap"] = None
+
+    # parse lines that have already been read, without locating, caching or building records
+    @classmethod
+    def parse_lines(cls, filename, lines):
+        ldraw_file = LDrawFile(filename)
+        ldraw_file.lines = lines
+        ldraw_file.__parse_header()
+        ldraw_file.__parse_lines(ldraw_file.__body_start)
+        return ldraw_file
+
+    # the parse cache record of a library file for PartArchive.compile
+    # files that hold more than one file or !DATA blocks can't be compiled
+    @classmethod
+    def read_record(cls, filename):
+        source = cls.__read_source(filename)
+        if source is None:
+            return None
+
+        file_record = None
+        if len(source["files"]) == 1 and len(source["data"]) == 0:
+            ldraw_file = source["files"][0]
+            if not source["cached"]:
+                ldraw_file.__read_group = source
+                ldraw_file.__materialize()
+                ldraw_file.__read_group = None
+                ldraw_file.__parse_lines(ldraw_file.__body_start)
+            file_record = ldraw_file.__cache_record()
+
+        cls.__close_source(source)
+        return file_record
+
+    # the update of the library as given in LDConfig.ldr, 0 !LDRAW_ORG Configuration UPDATE 2023-06
+    @classmethod
+    def library_version(cls):
+        ldraw_file = cls.get_file("LDConfig.ldr")
+        if ldraw_file is None:
+            return None
+        return ldraw_file.update_date
+
+    # runs in a worker process, so only the parse cache record is sent back
+    # its commands are packed into arrays like PartArchive stores them, which pickle as a few blocks of bytes
+    @classmethod
+    def parse_record(cls, filename, lines):
+        file_record = cls.parse_lines(filename, lines).__cache_record()
+
+        strings = {}
+        ops = array('i')
+        verts = array('d')
+        matrices = array('d')
+        PartArchive.pack_commands(file_record["commands"], lambda value: strings.setdefault(value, len(strings)), ops, verts, matrices)
+        file_record["commands"] = (ops, verts, matrices, list(strings))
+        return file_record
+
+    def __apply_record(self, file_record):
+        for k, v in file_record["header"].items():
+            setattr(self, k, v)
+        self.commands = file_record["commands"]
+
+    # rebuild the files that were read from filepath from the parse cache
+    @classmethod
+    def __read_cached_source(cls, filename, filepath):
+        entry = ParseCache.load(filepath)
+        if entry is None:
+            return None
+        return cls.__cached_source(filename, filepath, entry["root"], entry["files"], entry["data"])
 
-            if current_file is not None:
-                cls.__unparsed_file_cache[current_file.filename] = current_file
+    @classmethod
+    def __cached_source(cls, filename, filepath, first_mpd_filename, file_records, data_blocks):
+        read_files = []
+        for file_record in file_records:
+            # a regular ldr/dat file is named by whatever name it was requested with
+            if first_mpd_filename is None:
+                ldraw_file = LDrawFile(filename)
+            else:
+                ldraw_file = LDrawFile(file_record["filename"])
+
+            ldraw_file.__apply_record(file_record)
+            ldraw_file.lines = file_record["lines"]
+            read_files.append(ldraw_file)
+
+        return {
+            "filepath": filepath,
+            "root": first_mpd_filename,
+            "files": read_files,
+            "data": data_blocks,
+            "cached": True,
+        }
+
+    # make the files that were read available to get_file and return the one that was requested
+    # !DATA images are created here because they don't survive between blender sessions
+    # and bpy can't be used from the prefetch pool
+    @classmethod
+    def __add_source(cls, filename, source):
+        if source is None:
+            return None
 
-            if first_mpd_filename is not None:
-                filename = first_mpd_filename
+        for data_filename, base64_str in source["data"]:
+            base64_handler.named_png_from_base64_str(data_filename, base64_str)
+
+        # the files that were read together are parsed and stored in the parse cache together
+        # once the body of one of them is needed
+        for read_file in source["files"]:
+            if not source["cached"]:
+                read_file.__read_group = source
+            cls.__unparsed_file_cache[read_file.filename] = read_file
+
+        if source["cached"]:
+            cls.__prefetch(source["files"])
+
+        if source["root"] is not None:
+            filename = source["root"]
+
+        return cls.__unparsed_file_cache.get(filename)
+
+    def __cache_record(self):
+        header = {k: getattr(self, k) for k in self.__header_attrs}
+        # if there is no 0 Name: line, name comes from the filename the file was requested with
+        if not self.named:
+            del header["name"]
+
+        # blender_import.__load_materials needs the lines of configuration files
+        lines = []
+        if self.is_configuration():
+            lines = self.lines
+
+        return {
+            "filename": self.filename,
+            "header": header,
+            "commands": self.commands,
+            "lines": lines,
+        }
+
+    # the header is every line before the first line that isn't a 0 line
+    # header meta commands that come after that line are picked up when the body is parsed
+    def __parse_header(self):
+        self.__body_start = self.__parse_lines(0, header_only=True)
+
+    # parse the rest of the file and store it in the parse cache
+    # each file of an mpd is stored on its own, so the files that aren't used are never decoded
+    # files restored from the parse cache already have all of their commands
+    def __parse_body(self):
+        read_group = self.__read_group
+        if read_group is None:
+            return
+
+        # worker processes are only worth it for every file of the mpd that hasn't been parsed yet
+        read_files = [self]
+        if ImportOptions.parse_in_processes:
+            read_files = [read_file for read_file in read_group["files"] if read_file.__read_group is read_group]
+
+        for read_file in read_files:
+            read_file.__materialize()
+        read_files = [read_file for read_file in read_files if read_file.__read_group is not None]
+        for read_file in read_files:
+            read_file.__read_group = None
+
+        if not self.__parse_in_processes(read_files):
+            for read_file in read_files:
+                read_file.__parse_lines(read_file.__body_start)
+
+        # lines aren't needed once they are parsed
+        # except by blender_import.__load_materials, which reads configuration files line by line
+        for read_file in read_files:
+            if not read_file.is_configuration():
+                read_file.lines = []
+
+        if read_group["root"] is None:
+            ParseCache.store(read_group["filepath"], {
+                "root": None,
+                "files": [read_file.__cache_record() for read_file in read_files],
+                "data": read_group["data"],
+            })
+        else:
+            for read_file in read_files:
+                ParseCache.store(read_group["filepath"], read_file.__cache_record(), block=read_file.filename)
 
-            return cls.__unparsed_file_cache.get(filename)
+        self.__prefetch(read_files)
 
-    # create meta nodes when those commands affect the scene
+    # parse the files of a large mpd on every core
+    # workers are forked because importing the addon in a new process imports bpy, which only exists in blender
+    # fork is only used on linux, on macos system frameworks aren't safe to use after fork and windows has no fork
+    # a thread that holds a lock when the process forks leaves it locked in the worker forever
+    # so the prefetch pool is drained and shut down first, and if any other thread is running the files are parsed here
+    @classmethod
+    def __parse_in_processes(cls, read_files):
+        if not ImportOptions.parse_in_processes:
+            return False
+        if len(read_files) < cls.__process_parse_min_files:
+            return False
+        if not sys.platform.startswith("linux"):
+            return False
+
+        if cls.__prefetch_pool is not None:
+            cls.__prefetch_pool.shutdown(wait=True)
+            cls.__prefetch_pool = None
+        if threading.active_count() > 1:
+            return False
+
+        try:
+            filenames = [read_file.filename for read_file in read_files]
+            lines = [read_file.lines for read_file in read_files]
+            max_workers = os.cpu_count() or 1
+            chunksize = max(1, len(read_files) // (max_workers * 4))
+
+            mp_context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as pool:
+                file_records = list(pool.map(cls.parse_record, filenames, lines, chunksize=chunksize))
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
+            return False
+
+        # the headers were already parsed when the files were read
+        # the records have them again along with everything after them
+        for read_file, file_record in zip(read_files, file_records):
+            ops, verts, matrices, strings = file_record["commands"]
+            file_record["commands"] = PartArchive.unpack_commands(ops, verts, matrices, strings.__getitem__)
+            read_file.__apply_record(file_record)
+        return True
+
+    # record meta commands when those commands affect the scene
     # process meta command in place if it only affects the file
-    def __parse_file(self):
-        for line in self.lines:
+    # nothing here depends on other files so the result can be stored in the parse cache
+    # each line is split once and dispatched on its line type
+    # only 0 lines go through meta command matching
+    # returns the index of the line parsing stopped at
+    def __parse_lines(self, start, header_only=False):
+        lines = self.lines
+        for index in range(start, len(lines)):
+            line = lines[index]
             try:
-                clean_line = helpers.clean_line(line)
-                strip_line = line.strip()
-
-                if self.__line_description(strip_line): continue
-                if self.__line_name(clean_line, strip_line): continue
-                if self.__line_author(clean_line, strip_line): continue
-                if self.__line_part_type(clean_line, strip_line): continue
-                if self.__line_license(strip_line): continue
-                if self.__line_help(strip_line): continue
-                if self.__line_category(strip_line): continue
-                if self.__line_keywords(strip_line): continue
-                if self.__line_cmdline(strip_line): continue
-                if self.__line_history(strip_line): continue
-                if self.__line_comment(clean_line): continue
-                if self.__line_color(clean_line): continue
-                if self.__line_geometry(clean_line): continue
-                if self.__line_subfile(clean_line, strip_line): continue
-                if self.__line_bfc(clean_line, strip_line): continue
-                if self.__line_step(clean_line): continue
-                if self.__line_save(clean_line): continue
-                if self.__line_clear(clean_line): continue
-                if self.__line_print(clean_line): continue
-                if self.__line_texmap(clean_line): continue
-                if self.__line_stud_io(clean_line): continue
+                _params = line.split()
+                if len(_params) == 0:
+                    continue
+
+                if self.description is None:
+                    self.__line_description(line.strip())
+
+                line_type = _params[0]
+                if line_type == "0":
+                    self.__line_meta(line, _params)
+                elif header_only:
+                    return index
+                elif line_type == "1":
+                    self.__line_subfile(line, _params)
+                elif line_type in self.__geometry_line_types:
+                    self.__line_geometry(_params)
             except Exception as e:
                 print(e)
                 import traceback
                 print(traceback.format_exc())
                 continue
+        return len(lines)
+
+    __geometry_line_types = {"2", "3", "4", "5"}
 
-    # always return false so that the rest of the line types are parsed even if this is true
     def __line_description(self, strip_line):
-        if self.description is None:
-            parts = strip_line.split(maxsplit=1)
-            if len(parts) > 1:
-                str = parts[1]
-                self.description = str
-            else: # if there's no description, just use the filename
-                self.description = ""
-        return False
+        parts = strip_line.split(maxsplit=1)
+        if len(parts) > 1:
+            str = parts[1]
+            self.description = str
+        else: # if there's no description, just use the filename
+            self.description = ""
+
+    # name and author come first and part type is checked before any other meta command
+    # because it looks for its keywords anywhere in the line
+    def __line_meta(self, line, _params):
+        if len(_params) < 2:
+            return
+
+        clean_line = " ".join(_params)
+        strip_line = line.strip()
+
+        if self.__line_name(clean_line, strip_line): return
+        if self.__line_author(clean_line, strip_line): return
+        if self.__line_part_type(clean_line, strip_line): return
+
+        meta_handler = self.__meta_handlers.get(_params[1])
+        if meta_handler is not None:
+            meta_handler(self, clean_line, strip_line, _params)
 
     # name and author are allowed to be case insensitive
     # https://forums.ldraw.org/thread-23904-post-35984.html#pid35984
@@ -282,294 +749,249 @@ class LDrawFile:
     def __line_part_type(self, clean_line, strip_line):
         in_part_type = False
         for date_type in ["ORIGINAL", "UPDATE"]:
-            # print(strip_line)
-            try:
-                index = clean_line.index(date_type)
+            index = clean_line.find(date_type)
+            if index != -1:
                 date_string = clean_line[index:]
                 parts = date_string.split(maxsplit=1)
                 self.update_date = parts[1]
                 clean_line = clean_line[0:index]
                 in_part_type = True
-            except ValueError as e:
-                pass
 
         for optional_qualifier in ["Alias", "Physical_Colour", "Flexible_Section"]:
-            try:
-                index = strip_line.index(optional_qualifier)
+            index = strip_line.find(optional_qualifier)
+            if index != -1:
                 self.optional_qualifier = optional_qualifier
                 clean_line = clean_line[0:index]
                 in_part_type = True
-            except ValueError as e:
-                pass
 
         for part_type_prefix in ["0 !LDRAW_ORG ", "0 LDRAW_ORG "]:
-            try:
-                index = strip_line.index(part_type_prefix)
+            if part_type_prefix in strip_line:
                 parts = clean_line.split(maxsplit=2)
                 self.actual_part_type = parts[2].strip()
                 self.part_type = self.determine_part_type(self.actual_part_type)
                 in_part_type = True
-            except ValueError as e:
-                pass
 
         for part_type_prefix in ["0 Unofficial ", "0 Un-official "]:
-            try:
-                index = strip_line.index(part_type_prefix)
+            if part_type_prefix in strip_line:
                 parts = clean_line.split(maxsplit=1)
                 self.actual_part_type = parts[1].strip()
                 self.part_type = self.determine_part_type(self.actual_part_type)
                 in_part_type = True
-            except ValueError as e:
-                pass
 
         for part_type_prefix in ["0 Official LCAD "]:
-            try:
-                index = strip_line.index(part_type_prefix)
+            if part_type_prefix in strip_line:
                 parts = clean_line.split(maxsplit=4)
                 self.actual_part_type = parts[3].strip()
                 self.part_type = self.determine_part_type(self.actual_part_type)
                 in_part_type = True
-            except ValueError as e:
-                pass
 
         if in_part_type:
             return True
 
         return False
 
-    def __line_license(self, strip_line):
-        if strip_line.startswith("0 !LICENSE "):
+    def __line_license(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             self.license = strip_line.split(maxsplit=2)[2]
-            return True
-        return False
 
-    def __line_help(self, strip_line):
-        if strip_line.startswith("0 !HELP "):
+    def __line_help(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             self.help.append(strip_line.split(maxsplit=2)[2])
-            return True
-        return False
 
-    def __line_category(self, strip_line):
-        if strip_line.startswith("0 !CATEGORY "):
+    def __line_category(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             self.category.append(strip_line.split(maxsplit=2)[2])
-            return True
-        return False
 
-    def __line_keywords(self, strip_line):
-        if strip_line.startswith("0 !KEYWORDS "):
+    def __line_keywords(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             self.keywords += strip_line.split(maxsplit=2)[2].split(',')
-            return True
-        return False
 
-    def __line_cmdline(self, strip_line):
-        if strip_line.startswith("0 !CMDLINE "):
+    def __line_cmdline(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             self.cmdline = strip_line.split(maxsplit=2)[2]
-            return True
-        return False
 
-    def __line_history(self, strip_line):
-        if strip_line.startswith("0 !HISTORY "):
+    def __line_history(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             self.history.append(strip_line.split(maxsplit=4)[2:])
-            return True
-        return False
-
-    def __line_comment(self, clean_line):
-        if clean_line.startswith("0 //"):
-            return True
-        return False
 
     # TODO: add collection of colors specific to this file
-    def __line_color(self, clean_line):
-        if clean_line.startswith("0 !COLOUR "):
+    def __line_color(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
             if self.is_configuration():
-                LDrawColor.parse_color(clean_line)
+                self.commands.append(("colour", clean_line))
             else:
                 # TODO: add this color to this file's colors
                 # color = LDrawColor()
                 # color.parse_color_params(clean_line)
                 #  self.__colors[color.code] = color
                 ...
-            return True
-        return False
 
-    def __line_bfc(self, clean_line, strip_line):
-        if strip_line.startswith("0 BFC "):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "bfc"
-            ldraw_node.meta_args["command"] = strip_line.split(maxsplit=2)[2]
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
-
-    def __line_step(self, clean_line):
-        if clean_line.startswith("0 STEP"):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "step"
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
+    def __line_bfc(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
+            self.commands.append(("bfc", clean_line, " ".join(_params[2:])))
+
+    def __line_step(self, clean_line, strip_line, _params):
+        self.commands.append(("step", clean_line))
+
+    def __line_save(self, clean_line, strip_line, _params):
+        self.commands.append(("save", clean_line))
+
+    def __line_clear(self, clean_line, strip_line, _params):
+        self.commands.append(("clear", clean_line))
+
+    def __line_print(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
+            self.commands.append(("print", clean_line, clean_line.split(maxsplit=2)[2]))
+
+    def __line_texmap(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
+            self.commands.append(("texmap", clean_line))
+
+    def __line_pe_tex_path(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
+            self.commands.append(("pe_tex_path", clean_line))
+
+    def __line_pe_tex_info(self, clean_line, strip_line, _params):
+        if len(_params) > 2:
+            self.commands.append(("pe_tex_info", clean_line))
+
+    # TODO: find out what this does
+    def __line_pe_tex_next_shear(self, clean_line, strip_line, _params):
+        self.commands.append(("pe_tex_next_shear", clean_line))
+
+    # second token of a 0 line -> handler
+    # comments (0 //) and unknown meta commands have no handler and are skipped
+    __meta_handlers = {
+        "!LICENSE": __line_license,
+        "!HELP": __line_help,
+        "!CATEGORY": __line_category,
+        "!KEYWORDS": __line_keywords,
+        "!CMDLINE": __line_cmdline,
+        "!HISTORY": __line_history,
+        "!COLOUR": __line_color,
+        "BFC": __line_bfc,
+        "STEP": __line_step,
+        "SAVE": __line_save,
+        "CLEAR": __line_clear,
+        "PRINT": __line_print,
+        "WRITE": __line_print,
+        "!TEXMAP": __line_texmap,
+        "PE_TEX_PATH": __line_pe_tex_path,
+        "PE_TEX_INFO": __line_pe_tex_info,
+        "PE_TEX_NEXT_SHEAR": __line_pe_tex_next_shear,
+    }
+
+    def __line_subfile(self, line, _params):
+        color_code = _params[1]
+
+        matrix_values = tuple(map(float, _params[2:14]))
+
+        # allows for extra spaces in the filename
+        if len(_params) > 15:
+            filename = line.strip().split(maxsplit=14)[14].lower()
+        else:
+            filename = _params[14].lower()
 
-    def __line_save(self, clean_line):
-        if clean_line.startswith("0 SAVE"):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "save"
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
+        filename = self.__subfile_filename(filename)
 
-    def __line_clear(self, clean_line):
-        if clean_line.startswith("0 CLEAR"):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "clear"
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
+        self.commands.append(("1", " ".join(_params), color_code, matrix_values, filename))
 
-    def __line_print(self, clean_line):
-        if clean_line.startswith("0 PRINT ") or clean_line.startswith("0 WRITE "):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "print"
-            ldraw_node.meta_args["message"] = clean_line.split(maxsplit=2)[2]
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
-
-    def __line_texmap(self, clean_line):
-        if clean_line.startswith("0 !TEXMAP "):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "texmap"
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
-
-    def __line_stud_io(self, clean_line):
-        if clean_line.startswith("0 PE_TEX_PATH "):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "pe_tex_path"
-            self.child_nodes.append(ldraw_node)
-            return True
+    # filename = "stud-logo.dat"
+    # parts = filename.split(".") => ["stud-logo", "dat"]
+    # name = parts[0] => "stud-logo"
+    # name_parts = name.split('-') => ["stud", "logo"]
+    # stud_name = name_parts[0] => "stud"
+    # chosen_logo = special_bricks.chosen_logo => "logo5"
+    # ext = parts[1] => "dat"
+    # filename = f"{stud_name}-{chosen_logo}.{ext}" => "stud-logo5.dat"
+    @staticmethod
+    def __subfile_filename(filename):
+        if ImportOptions.display_logo and filename in ldraw_part_types.stud_names:
+            parts = filename.split('.')
+            name = parts[0]
+            name_parts = name.split('-')
+            stud_name = name_parts[0]
+            chosen_logo = ImportOptions.chosen_logo_value()
+            ext = parts[1]
+            filename = f"{stud_name}-{chosen_logo}.{ext}"
+        return filename
+
+    def __line_geometry(self, _params):
+        vertex_values = self.__parse_face(_params)
+
+        self.geometry_commands.setdefault(_params[0], 0)
+        self.geometry_commands[_params[0]] += 1
+
+        self.commands.append((_params[0], " ".join(_params), _params[1], vertex_values))
+
+    # 1.148 26.114 -19.076
+    # 6.9   25.8   -18.6
+    # 0     26     -19
+    # 2.121 26.44  -19.293
+    __vert_counts = {"2": 2, "3": 3, "4": 4, "5": 4}
 
-        if clean_line.startswith("0 PE_TEX_INFO "):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "pe_tex_info"
-            self.child_nodes.append(ldraw_node)
-            return True
+    @classmethod
+    def __parse_face(cls, _params):
+        value_count = cls.__vert_counts[_params[0]] * 3
+        values = tuple(map(float, _params[2:value_count + 2]))
+        if len(values) < value_count:
+            raise IndexError(f"expected {value_count} coordinates: {' '.join(_params)}")
+        return values
+
+    # build the records of the commands that affect the scene
+    # subfiles are located and loaded here rather than in __parse_body so that
+    # a cached parse is still correct after files it references are added or removed
+    # meta commands are parsed into their values here so walking the records for each reference doesn't parse lines again
+    def __build_records(self):
+        vertex_values = []
+        for command in self.commands:
+            try:
+                opcode = ldraw_command.opcodes[command[0]]
 
-        # TODO: find out what this does
-        if clean_line.startswith("0 PE_TEX_NEXT_SHEAR"):
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "pe_tex_next_shear"
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
+                if opcode == ldraw_command.SUBFILE:
+                    self.__build_subfile_record(command)
+                    continue
 
-    def __line_subfile(self, clean_line, strip_line):
-        if clean_line.startswith("1 "):
-            _params = clean_line.split(maxsplit=14)
-            _sparams = strip_line.split(maxsplit=14)
-
-            color_code = _params[1]
-
-            (x, y, z, a, b, c, d, e, f, g, h, i) = map(float, _params[2:14])
-            matrix = mathutils.Matrix((
-                (a, b, c, x),
-                (d, e, f, y),
-                (g, h, i, z),
-                (0, 0, 0, 1)
-            ))
-
-            # allows for extra spaces in the filename
-            filename = _sparams[14].lower()
-
-            # filename = "stud-logo.dat"
-            # parts = filename.split(".") => ["stud-logo", "dat"]
-            # name = parts[0] => "stud-logo"
-            # name_parts = name.split('-') => ["stud", "logo"]
-            # stud_name = name_parts[0] => "stud"
-            # chosen_logo = special_bricks.chosen_logo => "logo5"
-            # ext = parts[1] => "dat"
-            # filename = f"{stud_name}-{chosen_logo}.{ext}" => "stud-logo5.dat"
-            if ImportOptions.display_logo and filename in ldraw_part_types.stud_names:
-                parts = filename.split('.')
-                name = parts[0]
-                name_parts = name.split('-')
-                stud_name = name_parts[0]
-                chosen_logo = ImportOptions.chosen_logo_value()
-                ext = parts[1]
-                filename = f"{stud_name}-{chosen_logo}.{ext}"
-
-            ldraw_file = LDrawFile.get_file(filename)
-            if ldraw_file is None:
-                return True
+                if opcode <= ldraw_command.LINE:
+                    record = ldraw_command.GeometryCommand(opcode, command[2], len(vertex_values) // 3, len(command[3]) // 3, command[1])
+                    vertex_values.extend(command[3])
+                elif opcode == ldraw_command.COLOUR:
+                    LDrawColor.parse_color(command[1])
+                    continue
+                elif opcode == ldraw_command.BFC:
+                    record = ldraw_command.BfcCommand(command[2])
+                elif opcode == ldraw_command.PRINT:
+                    record = ldraw_command.PrintCommand(command[2])
+                elif opcode == ldraw_command.TEXMAP:
+                    record = ldraw_command.TexmapCommand(command[1])
+                elif opcode == ldraw_command.PE_TEX_PATH:
+                    record = ldraw_command.PETexPathCommand(command[1])
+                elif opcode == ldraw_command.PE_TEX_INFO:
+                    record = ldraw_command.PETexInfoCommand(command[1])
+                else:
+                    record = ldraw_command.MetaCommand(opcode)
+
+                self.__records.append(record)
+            except Exception as e:
+                print(e)
+                import traceback
+                print(traceback.format_exc())
+                continue
 
-            ldraw_node = LDrawNode()
-            ldraw_node.file = ldraw_file
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = "1"
-            ldraw_node.color_code = color_code
-            ldraw_node.matrix = matrix
-            self.child_nodes.append(ldraw_node)
+        self.vertices = np.array(vertex_values, dtype=np.float64).reshape(-1, 3)
 
-            if ldraw_file.is_geometry():
-                self.geometry_commands.setdefault(_params[0], 0)
-                self.geometry_commands[_params[0]] += 1
+    def __build_subfile_record(self, command):
+        _, clean_line, color_code, matrix_values, filename = command
 
-            return True
-        return False
+        ldraw_file = LDrawFile.get_file(filename)
+        if ldraw_file is None:
+            return
 
-    def __line_geometry(self, clean_line):
-        if (clean_line.startswith("2 ") or
-                clean_line.startswith("3 ") or
-                clean_line.startswith("4 ") or
-                clean_line.startswith("5 ")):
-            _params = clean_line.split()
-
-            self.geometry_commands.setdefault(_params[0], 0)
-            self.geometry_commands[_params[0]] += 1
-
-            ldraw_node = LDrawNode()
-            ldraw_node.line = clean_line
-            ldraw_node.meta_command = _params[0]
-            ldraw_node.color_code = _params[1]
-            ldraw_node.vertices = self.__parse_face(_params)
-            self.child_nodes.append(ldraw_node)
-            return True
-        return False
+        self.__records.append(ldraw_command.SubfileCommand(color_code, ldraw_file, matrix_values))
 
-    @staticmethod
-    def __parse_face(_params):
-        line_type = _params[0]
-        vert_count = 0
-        if line_type == "2":
-            vert_count = 2
-        elif line_type == "3":
-            vert_count = 3
-        elif line_type == "4":
-            vert_count = 4
-        elif line_type == "5":
-            # 1.148 26.114 -19.076
-            # 6.9   25.8   -18.6
-            # 0     26     -19
-            # 2.121 26.44  -19.293
-            vert_count = 4
-
-        verts = []
-        for i in range(vert_count):
-            x = float(_params[i * 3 + 2])
-            y = float(_params[i * 3 + 3])
-            z = float(_params[i * 3 + 4])
-            vertex = mathutils.Vector((x, y, z))
-            verts.append(vertex)
-        return verts
+        if ldraw_file.is_geometry():
+            self.geometry_commands.setdefault("1", 0)
+            self.geometry_commands["1"] += 1
 
     # if there's a line type specified, determine what that type is
     @staticmethod
@@ -636,5 +1058,49 @@ class LDrawFile:
     def is_geometry(self):
         return self.is_subpart() or self.is_primitive()
 
+    # a subfile line counts if it references a subpart or primitive, which only needs the header of that file
+    # files restored from the parse cache have their commands, the rest were scanned when they were decoded
     def has_geometry(self):
-        return sum(self.geometry_commands.values()) > 0
+        if self.__has_geometry is None:
+            if self.__geometry_scan is not None:
+                has_geometry_lines, subfile_names = self.__geometry_scan
+            else:
+                has_geometry_lines = any(self.geometry_commands.get(line_type, 0) > 0 for line_type in self.__geometry_line_types)
+                subfile_names = self.subfile_names()
+
+            self.__has_geometry = has_geometry_lines
+            for filename in subfile_names:
+                if self.__has_geometry:
+                    break
+                subfile = LDrawFile.get_file(filename)
+                self.__has_geometry = subfile is not None and subfile.is_geometry()
+        return self.__has_geometry
+
+    # whether this file or any file it references has TEXMAP or PE_TEX lines
+    # their geometry depends on where the file is placed, so it can't be flattened once and reused
+    # files are checked depth first with a stack, so a long chain of subfiles can't hit the recursion limit
+    def has_texture_meta(self):
+        if self.__has_texture_meta is not None:
+            return self.__has_texture_meta
+
+        # a file that references itself is only checked once
+        self.__has_texture_meta = False
+        stack = [(self, iter(self.records))]
+        while len(stack) > 0:
+            ldraw_file, records = stack[-1]
+            for record in records:
+                if record.opcode in ldraw_command.texture_meta_opcodes:
+                    ldraw_file.__has_texture_meta = True
+                elif record.opcode == ldraw_command.SUBFILE:
+                    subfile = record.file
+                    if subfile.__has_texture_meta is None:
+                        subfile.__has_texture_meta = False
+                        stack.append((subfile, iter(subfile.records)))
+                        break
+                    if subfile.__has_texture_meta:
+                        ldraw_file.__has_texture_meta = True
+            else:
+                stack.pop()
+                if ldraw_file.__has_texture_meta and len(stack) > 0:
+                    stack[-1][0].__has_texture_meta = True
+        return self.__has_texture_meta
@@ -0,0 +1,263 @@
+import bpy
+import mathutils
+import numpy as np
+
+from .ldraw_color import LDrawColor
+from . import group
+from . import ldraw_object
+
+# instead of an object for every part, every placement is a point of one mesh
+# that a geometry nodes modifier instances the parts on
+# each point has the transform of its part and the index of its prototype
+# a prototype is an object for each mesh and color in a collection that isn't in the view layer
+# the color of each point is stored on its instance, a material reads it with an Attribute node of the Instancer type
+
+part_index_attribute = "ldraw_part_index"
+rotation_attribute = "ldraw_rotation"
+scale_attribute = "ldraw_scale"
+color_attribute = "ldraw_color"
+
+# custom property of the instancer object that points to the prototype collection
+prototypes_key = "ldraw_prototypes"
+# custom property of a prototype with its index, the part index of the points that instance it
+prototype_index_key = "ldraw_prototype_index"
+
+instance_count = 0
+
+prototype_collection = None
+# (mesh pointer, color_code) -> index of its prototype
+__prototype_indices = {}
+__prototypes = []
+__locations = []
+__rotations = []
+__scales = []
+__part_indices = []
+__colors = []
+
+
+def reset_caches():
+    global instance_count
+    global prototype_collection
+
+    instance_count = 0
+    prototype_collection = None
+    __prototype_indices.clear()
+    __prototypes.clear()
+    __locations.clear()
+    __rotations.clear()
+    __scales.clear()
+    __part_indices.clear()
+    __colors.clear()
+
+
+# the prototypes are made the first time their mesh is placed with create_object and create_edge_obj
+# so they have the same props, modifiers and materials as the objects a normal import would make
+def add_instance(mesh, geometry_data, color_code, obj_matrix, edge_mesh=None):
+    global instance_count
+
+    matrix_world = ldraw_object.world_matrix(obj_matrix)
+    color = LDrawColor.get_color(color_code)
+
+    part_index = __prototype_index(mesh, color_code, lambda collection: ldraw_object.create_object(mesh, geometry_data, color_code, mathutils.Matrix.Identity(4), collection, False))
+    __add_point(part_index, matrix_world, color.linear_color_a)
+
+    # the edge mesh is the same for every color of a part, but the edge color isn't
+    if edge_mesh is not None:
+        def create_edge_prototype(collection):
+            obj = __prototypes[part_index]
+            edge_obj = ldraw_object.create_edge_obj(edge_mesh, geometry_data, color_code, obj, collection)
+            edge_obj.parent = None
+            return edge_obj
+
+        __add_point(__prototype_index(edge_mesh, color_code, create_edge_prototype), matrix_world, color.linear_edge_color_d)
+
+    instance_count += 1
+
+
+def __prototype_index(mesh, color_code, create_prototype):
+    key = (mesh.as_pointer(), color_code)
+    index = __prototype_indices.get(key)
+    if index is None:
+        index = len(__prototypes)
+        obj = create_prototype(__prototype_collection())
+        # collection info orders the objects of a collection by name
+        obj.name = f"{index:06d}_{mesh.name}"
+        obj.matrix_world = mathutils.Matrix.Identity(4)
+        obj[prototype_index_key] = index
+        __prototypes.append(obj)
+        __prototype_indices[key] = index
+    return index
+
+
+def __prototype_collection():
+    global prototype_collection
+
+    if prototype_collection is None:
+        prototype_collection = bpy.data.collections.new("LDraw Prototypes")
+        group.link_child(prototype_collection, group.get_scene_collection())
+        __exclude_collection(bpy.context.view_layer.layer_collection, prototype_collection)
+    return prototype_collection
+
+
+# the prototypes are only seen through the instancer
+def __exclude_collection(layer_collection, collection):
+    for child in layer_collection.children:
+        if child.collection == collection:
+            child.exclude = True
+            return True
+        if __exclude_collection(child, collection):
+            return True
+    return False
+
+
+# scale is negative on one axis for mirrored matrices, shear can't be instanced and is lost
+def __add_point(part_index, matrix_world, color):
+    location, rotation, scale = matrix_world.decompose()
+    __locations.append(location[:])
+    __rotations.append(rotation.to_euler()[:])
+    __scales.append(scale[:])
+    __part_indices.append(part_index)
+    __colors.append(color[:])
+
+
+# the object that instances every placement, None if nothing was placed
+def build(name, collection):
+    if len(__part_indices) < 1:
+        return None
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(__locations))
+    mesh.vertices.foreach_set("co", np.array(__locations, dtype=np.float32).ravel())
+
+    attribute = mesh.attributes.new(part_index_attribute, 'INT', 'POINT')
+    attribute.data.foreach_set("value", np.array(__part_indices, dtype=np.int32))
+    attribute = mesh.attributes.new(rotation_attribute, 'FLOAT_VECTOR', 'POINT')
+    attribute.data.foreach_set("vector", np.array(__rotations, dtype=np.float32).ravel())
+    attribute = mesh.attributes.new(scale_attribute, 'FLOAT_VECTOR', 'POINT')
+    attribute.data.foreach_set("vector", np.array(__scales, dtype=np.float32).ravel())
+    attribute = mesh.attributes.new(color_attribute, 'FLOAT_COLOR', 'POINT')
+    attribute.data.foreach_set("color", np.array(__colors, dtype=np.float32).ravel())
+    mesh.update()
+
+    obj = bpy.data.objects.new(name, mesh)
+    obj[prototypes_key] = prototype_collection
+    modifier = obj.modifiers.new("LDraw Instances", type='NODES')
+    modifier.node_group = __node_group(prototype_collection)
+    group.link_obj(collection, obj)
+    return obj
+
+
+def __node_group(collection):
+    node_group = bpy.data.node_groups.new("LDraw Instances", 'GeometryNodeTree')
+    if bpy.app.version < (4,):
+        node_group.inputs.new('NodeSocketGeometry', "Geometry")
+        node_group.outputs.new('NodeSocketGeometry', "Geometry")
+    else:
+        node_group.interface.new_socket("Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+        node_group.interface.new_socket("Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+
+    nodes = node_group.nodes
+    links = node_group.links
+
+    group_input = nodes.new('NodeGroupInput')
+    group_input.location = (-600, 0)
+    group_output = nodes.new('NodeGroupOutput')
+    group_output.location = (500, 0)
+
+    collection_info = nodes.new('GeometryNodeCollectionInfo')
+    collection_info.location = (-400, -100)
+    collection_info.transform_space = 'ORIGINAL'
+    collection_info.inputs["Collection"].default_value = collection
+    collection_info.inputs["Separate Children"].default_value = True
+    collection_info.inputs["Reset Children"].default_value = True
+
+    instance_on_points = nodes.new('GeometryNodeInstanceOnPoints')
+    instance_on_points.inputs["Pick Instance"].default_value = True
+
+    links.new(group_input.outputs[0], instance_on_points.inputs["Points"])
+    links.new(collection_info.outputs[0], instance_on_points.inputs["Instance"])
+    links.new(__named_attribute(nodes, part_index_attribute, 'INT', -300), instance_on_points.inputs["Instance Index"])
+    links.new(__named_attribute(nodes, rotation_attribute, 'FLOAT_VECTOR', -450), instance_on_points.inputs["Rotation"])
+    links.new(__named_attribute(nodes, scale_attribute, 'FLOAT_VECTOR', -600), instance_on_points.inputs["Scale"])
+
+    # the color of the point is read before the points become instances
+    store_color = nodes.new('GeometryNodeStoreNamedAttribute')
+    store_color.location = (250, 0)
+    store_color.data_type = 'FLOAT_COLOR'
+    store_color.domain = 'INSTANCE'
+    store_color.inputs["Name"].default_value = color_attribute
+    color_input = [socket for socket in store_color.inputs if socket.name == "Value" and socket.enabled][0]
+
+    links.new(instance_on_points.outputs["Instances"], store_color.inputs["Geometry"])
+    links.new(__named_attribute(nodes, color_attribute, 'FLOAT_COLOR', -750), color_input)
+    links.new(store_color.outputs["Geometry"], group_output.inputs[0])
+
+    return node_group
+
+
+# before blender 4 the node has an output for each data type and only the one of data_type is enabled
+def __named_attribute(nodes, name, data_type, y):
+    node = nodes.new('GeometryNodeInputNamedAttribute')
+    node.location = (-400, y)
+    node.data_type = data_type
+    node.inputs["Name"].default_value = name
+    return [output for output in node.outputs if output.enabled][0]
+
+
+def is_instancer(obj):
+    return obj is not None and obj.type == 'MESH' and obj.get(prototypes_key) is not None
+
+
+# turn the points of an instancer back into objects, the points that are selected in edit mode or every point
+# returns the objects that were made
+def realize(obj, selected_only=True):
+    prototypes = {o[prototype_index_key]: o for o in obj[prototypes_key].objects if prototype_index_key in o}
+    mesh = obj.data
+    count = len(mesh.vertices)
+
+    selected = np.zeros(count, dtype=bool)
+    mesh.vertices.foreach_get("select", selected)
+    if not selected_only or not selected.any():
+        selected[:] = True
+
+    part_indices = np.zeros(count, dtype=np.int32)
+    mesh.attributes[part_index_attribute].data.foreach_get("value", part_indices)
+    locations = np.zeros(count * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", locations)
+    rotations = np.zeros(count * 3, dtype=np.float32)
+    mesh.attributes[rotation_attribute].data.foreach_get("vector", rotations)
+    scales = np.zeros(count * 3, dtype=np.float32)
+    mesh.attributes[scale_attribute].data.foreach_get("vector", scales)
+    colors = np.zeros(count * 4, dtype=np.float32)
+    mesh.attributes[color_attribute].data.foreach_get("color", colors)
+
+    collection = obj.users_collection[0]
+    objects = []
+    for i in np.flatnonzero(selected).tolist():
+        prototype = prototypes[part_indices[i]]
+        new_obj = prototype.copy()
+        new_obj.name = prototype.data.name
+        del new_obj[prototype_index_key]
+        new_obj.matrix_world = obj.matrix_world @ mathutils.Matrix.LocRotScale(
+            locations[i * 3:i * 3 + 3],
+            mathutils.Euler(rotations[i * 3:i * 3 + 3]),
+            scales[i * 3:i * 3 + 3],
+        )
+        new_obj.color = colors[i * 4:i * 4 + 4]
+        group.link_obj(collection, new_obj)
+        objects.append(new_obj)
+
+    __remove_points(mesh, selected)
+    return objects
+
+
+def __remove_points(mesh, removed):
+    import bmesh
+
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bm.verts.ensure_lookup_table()
+    bmesh.ops.delete(bm, geom=[bm.verts[i] for i in np.flatnonzero(removed).tolist()], context='VERTS')
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.update()
@@ -1,29 +1,76 @@
 import bpy
 import bmesh
-import mathutils
+import numpy as np
 
 from .blender_materials import BlenderMaterials
 from .import_options import ImportOptions
+from .ldraw_color import LDrawColor
+from .structural_key import StructuralKey
 from . import special_bricks
 from . import strings
 from . import helpers
 from . import matrices
+from . import vertex_weld
 
 
+meshes_built = 0
+meshes_reused = 0
+
+# StructuralKey of geometry key, color code and mesh options -> mesh
+# every placement of a part in the same color after the first is an object that links to the same mesh
+__meshes = {}
+
+
+def reset_caches():
+    global meshes_built
+    global meshes_reused
+
+    meshes_built = 0
+    meshes_reused = 0
+    __meshes.clear()
+
+
+# everything other than the geometry and color that changes what create_mesh builds
+def __mesh_options():
+    return (
+        ImportOptions.remove_doubles,
+        ImportOptions.merge_distance,
+        ImportOptions.shade_smooth,
+        ImportOptions.smooth_type_value(),
+        ImportOptions.use_freestyle_edges,
+        ImportOptions.scale_strategy_value(),
+        ImportOptions.import_scale,
+        LDrawColor.use_alt_colors,
+    )
+
+
+# key is the StructuralKey of geometry_data
+# return_mesh always builds a new mesh because the caller owns it
 def create_mesh(key, geometry_data, color_code, return_mesh=False):
-    #mesh = bpy.data.meshes.get(key)
-    #if mesh is None or return_mesh:
-        #if mesh is None:
-    mesh = bpy.data.meshes.new(key)
+    global meshes_built
+    global meshes_reused
+
+    mesh_key = None
+    if not return_mesh:
+        mesh_key = StructuralKey.get((key, color_code, __mesh_options()))
+        mesh = __meshes.get(mesh_key)
+        if mesh is not None:
+            meshes_reused += 1
+            return mesh
+
+    mesh = bpy.data.meshes.new(key.name)
     mesh.name = geometry_data.file.name
     mesh[strings.ldraw_filename_key] = geometry_data.file.name
 
-    __process_bmesh(mesh, geometry_data, color_code)
+    # the vertices are already rotated and scaled by matrices.mesh_matrix
+    faces, loop_corners = __process_mesh_faces(mesh, geometry_data, color_code)
+    __process_bmesh(mesh, geometry_data, faces, loop_corners)
     __process_mesh_sharp_edges(mesh, geometry_data)
     __process_mesh(mesh)
 
-    mesh.transform(matrices.rotation_matrix)
-
+    meshes_built += 1
+    if mesh_key is not None:
+        __meshes[mesh_key] = mesh
     return mesh
 
 
@@ -37,9 +84,9 @@ def create_edge_mesh(key, geometry_data):
         e_faces = []
 
         i = 0
-        for edge_data in geometry_data.edge_data:
+        for vertices in geometry_data.edge_vertices.tolist():
             face_indices = []
-            for vertex in edge_data.vertices:
+            for vertex in vertices:
                 e_verts.append(vertex)
                 face_indices.append(i)
                 i += 1
@@ -51,143 +98,252 @@ def create_edge_mesh(key, geometry_data):
 
         mesh.from_pydata(e_verts, e_edges, e_faces)
         helpers.finish_mesh(mesh)
-        __scale_mesh(mesh)
 
     return mesh
 
 
+# with remove_doubles the faces are welded before the mesh is built, otherwise every face corner is its own vertex
+def __process_mesh_faces(mesh, geometry_data, color_code):
+    face_vertex_counts = geometry_data.face_vertex_counts
+    if ImportOptions.remove_doubles:
+        vertices, loop_vertex_indices, face_vertex_counts, faces, loop_corners = vertex_weld.weld_faces(
+            geometry_data.face_vertices,
+            face_vertex_counts,
+            __merge_distance(),
+        )
+    else:
+        # triangles repeat their last vertex, which isn't a corner
+        corners = np.arange(4) < face_vertex_counts[:, None]
+        vertices = geometry_data.face_vertices[corners]
+        loop_vertex_indices = np.arange(len(vertices))
+        faces = np.arange(len(face_vertex_counts))
+        loop_corners = np.nonzero(corners)[1]
+
+    # slots are added for faces that welding removed too
+    material_indices = __face_material_indices(mesh, geometry_data, color_code)
+    __fill_mesh(mesh, vertices, loop_vertex_indices, face_vertex_counts, material_indices[faces])
+    # texmaps project the corners where they were before welding, as float32 like the vertices of a mesh
+    loop_positions = np.asarray(geometry_data.face_vertices[np.repeat(faces, face_vertex_counts), loop_corners], dtype=np.float32)
+    __process_mesh_uvs(mesh, geometry_data, loop_positions, face_vertex_counts, faces)
+    return faces, loop_corners
+
+
+# fill an empty mesh with the vertices (V, 3), the vertex index of every face corner (L,) in face order,
+# the number of corners of each face (F,) and the material slot of each face (F,)
+def __fill_mesh(mesh, vertices, loop_vertex_indices, face_vertex_counts, material_indices):
+    face_count = len(face_vertex_counts)
+
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(vertices, dtype=np.float32).ravel())
+
+    mesh.loops.add(len(loop_vertex_indices))
+    mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loop_vertex_indices, dtype=np.int32))
+
+    mesh.polygons.add(face_count)
+    loop_starts = np.cumsum(face_vertex_counts) - face_vertex_counts
+    mesh.polygons.foreach_set("loop_start", loop_starts.astype(np.int32))
+    # blender 4 takes the size of each face from where the next one starts
+    if bpy.app.version < (4,):
+        mesh.polygons.foreach_set("loop_total", np.ascontiguousarray(face_vertex_counts, dtype=np.int32))
+    mesh.polygons.foreach_set("material_index", np.ascontiguousarray(material_indices, dtype=np.int32))
+    mesh.polygons.foreach_set("use_smooth", np.full(face_count, ImportOptions.shade_smooth, dtype=bool))
+
+    helpers.finish_mesh(mesh, validate=ImportOptions.validate_meshes)
+
+
+def __has_uvs(geometry_data):
+    return any(texmap is not None for texmap in geometry_data.face_texmaps) or __has_pe_uvs(geometry_data)
+
+
+def __has_pe_uvs(geometry_data):
+    return any(pe_texmap is not None for pe_texmap in geometry_data.face_pe_texmaps)
+
+
+# the position of every loop (L, 3), the number of corners of each face (F,) and the face of geometry_data each face is (F,)
+# the loops of all of the faces that share a texmap are projected at once
+# a mesh with any texmap gets a uv layer, loops without a texmap are at 0, 0
+def __process_mesh_uvs(mesh, geometry_data, loop_positions, face_vertex_counts, faces):
+    if not __has_uvs(geometry_data):
+        return
+
+    # texmap id -> index in texmaps
+    texmap_indices = {}
+    texmaps = []
+    face_texmap_indices = np.full(len(faces), -1, dtype=np.intp)
+    for j, i in enumerate(faces.tolist()):
+        texmap = geometry_data.face_texmaps[i]
+        if texmap is None:
+            continue
+        index = texmap_indices.get(texmap.id)
+        if index is None:
+            index = len(texmaps)
+            texmap_indices[texmap.id] = index
+            texmaps.append(texmap)
+        face_texmap_indices[j] = index
+
+    uvs = np.zeros((len(loop_positions), 2), dtype=np.float32)
+    loop_texmap_indices = np.repeat(face_texmap_indices, face_vertex_counts)
+    for index, texmap in enumerate(texmaps):
+        loops = loop_texmap_indices == index
+        texmap_uvs = texmap.uv_unwrap(loop_positions[loops])
+        if texmap_uvs is not None:
+            uvs[loops] = texmap_uvs
+
+    uv_layer = mesh.uv_layers.new()
+    uv_layer.data.foreach_set("uv", uvs.ravel())
+
+
 # https://b3d.interplanety.org/en/how-to-get-global-vertex-coordinates/
 # https://blender.stackexchange.com/questions/50160/scripting-low-level-join-meshes-elements-hopefully-with-bmesh
 # https://blender.stackexchange.com/questions/188039/how-to-join-only-two-objects-to-create-a-new-object-using-python
 # https://blender.stackexchange.com/questions/23905/select-faces-depending-on-material
-def __process_bmesh(mesh, geometry_data, color_code):
-    bm = __process_bmesh_faces(mesh, geometry_data, color_code)
+# only the steps that need a bmesh go through one
+# face i of the mesh is face faces[i] of geometry_data, loop_corners is the corner of its face every loop was
+def __process_bmesh(mesh, geometry_data, faces, loop_corners):
+    has_pe_uvs = __has_pe_uvs(geometry_data)
+    if not (has_pe_uvs or ImportOptions.smooth_type_value() == "bmesh_split"):
+        return
+
+    sharp = None
+    if ImportOptions.smooth_type_value() == "bmesh_split":
+        sharp = __sharp_edges(mesh, geometry_data)
+
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
     helpers.ensure_bmesh(bm)
-    __clean_bmesh(bm)
-    __process_bmesh_edges(bm, geometry_data)
+    if has_pe_uvs:
+        __process_bmesh_uvs(bm, geometry_data, faces, loop_corners)
+    __process_bmesh_edges(bm, sharp)
     helpers.finish_bmesh(bm, mesh)
-    helpers.finish_mesh(mesh)
+    helpers.finish_mesh(mesh, validate=ImportOptions.validate_meshes)
 
 
-# bpy.context.object.data.edges[6].use_edge_sharp = True
-# Create kd tree for fast "find nearest points" calculation
-# https://docs.blender.org/api/blender_python_api_current/mathutils.kdtree.html
-# https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.KDTree.html
-def __get_edge_indices(verts, geometry_data):
-    kd = mathutils.kdtree.KDTree(len(verts))
-    for i, v in enumerate(verts):
-        kd.insert(v.co, i)
-    kd.balance()
+# the edges of mesh that an edge line of geometry_data runs along (E,)
+# an edge is sharp if one end is near one end of a line and the other end is near the other
+# the ends of the lines are looked up on a grid of the vertex positions, so it's linear in edges
+def __sharp_edges(mesh, geometry_data):
+    sharp = np.zeros(len(mesh.edges), dtype=bool)
+    line_vertices = geometry_data.edge_vertices
+    if len(sharp) < 1 or len(line_vertices) < 1:
+        return sharp
+
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    edges = np.empty(len(sharp) * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edges)
+    edges = edges.reshape(-1, 2)
 
     # increase the distance to look for edges to merge
     # merge line type 2 edges at a greater distance than mesh edges
     # the rounded part in the seat of 4079.dat has a gap just wide
     # enough that 2x isn't enough
-    distance = ImportOptions.merge_distance
-    distance = ImportOptions.merge_distance * 2.1
-
-    edge_indices = set()
-
-    for edge_data in geometry_data.edge_data:
-        edge_verts = []
-        # for vertex in edge_data.vertices[0:2]:  # in case line_data is being used since it has 4 verts
-        for vertex in edge_data.vertices:
-            edge_verts.append(vertex)
-
-        edges0 = [index for (co, index, dist) in kd.find_range(edge_verts[0], distance)]
-        edges1 = [index for (co, index, dist) in kd.find_range(edge_verts[1], distance)]
-        for e0 in edges0:
-            for e1 in edges1:
-                edge_indices.add((e0, e1))
-                edge_indices.add((e1, e0))
-
-    return edge_indices
-
-
-def __process_bmesh_edges(bm, geometry_data):
+    distance = __merge_distance() * 2.1
+
+    # line end i is end i % 2 of line i // 2
+    ends, near_vertices = vertex_weld.points_within(vertices.reshape(-1, 3), line_vertices.reshape(-1, 3), distance)
+    end_count = len(line_vertices) * 2
+    near_keys = np.unique(near_vertices.astype(np.int64) * end_count + ends)
+
+    # the line ends near the first vertex of each edge
+    order = np.argsort(near_vertices, kind='stable')
+    vertex_ends = ends[order]
+    vertex_counts = np.bincount(near_vertices, minlength=len(vertices) // 3)
+    vertex_starts = np.cumsum(vertex_counts) - vertex_counts
+
+    counts = vertex_counts[edges[:, 0]]
+    total = int(counts.sum())
+    if total < 1:
+        return sharp
+    edge_indices = np.repeat(np.arange(len(edges)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    candidate_ends = vertex_ends[np.repeat(vertex_starts[edges[:, 0]], counts) + offsets]
+
+    # is the second vertex near the other end of the same line
+    other_keys = edges[edge_indices, 1].astype(np.int64) * end_count + (candidate_ends ^ 1)
+    found = np.minimum(np.searchsorted(near_keys, other_keys), len(near_keys) - 1)
+    matches = near_keys[found] == other_keys
+    sharp[edge_indices[matches]] = True
+    return sharp
+
+
+def __process_bmesh_edges(bm, sharp):
     if ImportOptions.smooth_type_value() == "bmesh_split":
-        edge_indices = __get_edge_indices(bm.verts, geometry_data)
-
-        # Find the appropriate mesh edges and make them sharp (i.e. not smooth)
-        edges = set()
-        # merge = set()
-        for edge in bm.edges:
-            v0 = edge.verts[0]
-            v1 = edge.verts[1]
-            i0 = v0.index
-            i1 = v1.index
-            if (i0, i1) in edge_indices:
-                edges.add(edge)
-
-        bmesh.ops.split_edges(bm, edges=list(edges))
+        # the edges of the bmesh are in the order of the edges of the mesh it was made from
+        bmesh.ops.split_edges(bm, edges=[bm.edges[i] for i in np.flatnonzero(sharp).tolist()])
+
+
+# the material slot of every face (F,), slots are added in the order their materials are first used
+# faces with the same color and textures have the same material, so each of those is resolved once
+def __face_material_indices(mesh, geometry_data, color_code):
+    part_slopes = special_bricks.get_part_slopes(geometry_data.file.name)
+    parts_cloth = special_bricks.get_parts_cloth(geometry_data.file.name)
+
+    # the parts of a face that BlenderMaterials keys its material on -> slot
+    slots = {}
+    material_indices = np.empty(geometry_data.face_count(), dtype=np.int32)
+    for i, (face_color_code, texmap, pe_texmap) in enumerate(zip(geometry_data.face_color_codes, geometry_data.face_texmaps, geometry_data.face_pe_texmaps)):
+        c = color_code if face_color_code == "16" else face_color_code
+        signature = (
+            c,
+            None if texmap is None else (texmap.method, texmap.texture, texmap.glossmap),
+            None if pe_texmap is None else pe_texmap.texture,
+        )
 
+        material_index = slots.get(signature)
+        if material_index is None:
+            material = BlenderMaterials.get_material(
+                color_code=c,
+                bfc_certified=geometry_data.bfc_certified,
+                part_slopes=part_slopes,
+                parts_cloth=parts_cloth,
+                texmap=texmap,
+                pe_texmap=pe_texmap,
+            )
 
-def __process_bmesh_faces(mesh, geometry_data, color_code):
-    bm = bmesh.new()
+            material_index = mesh.materials.find(material.name)
+            if material_index == -1:
+                # mesh.materials.append(None) #add blank slot
+                mesh.materials.append(material)
+                material_index = len(mesh.materials) - 1
+            slots[signature] = material_index
 
-    for face_data in geometry_data.face_data:
-        verts = [bm.verts.new(vertex) for vertex in face_data.vertices]
-        face = bm.faces.new(verts)
-
-        c = color_code if face_data.color_code == "16" else face_data.color_code
-
-        part_slopes = special_bricks.get_part_slopes(geometry_data.file.name)
-        parts_cloth = special_bricks.get_parts_cloth(geometry_data.file.name)
-        material = BlenderMaterials.get_material(
-            color_code=c,
-            bfc_certified=geometry_data.bfc_certified,
-            part_slopes=part_slopes,
-            parts_cloth=parts_cloth,
-            texmap=face_data.texmap,
-            pe_texmap=face_data.pe_texmap,
-        )
+        material_indices[i] = material_index
 
-        material_index = mesh.materials.find(material.name)
-        if material_index == -1:
-            # mesh.materials.append(None) #add blank slot
-            mesh.materials.append(material)
-            material_index = mesh.materials.find(material.name)
+    return material_indices
 
-        face.material_index = material_index
-        face.smooth = ImportOptions.shade_smooth
 
-        if face_data.texmap is not None:
-            face_data.texmap.uv_unwrap_face(bm, face)
+# texmap uvs are already in the uv layer, pe_texmap uvs replace them on their faces
+def __process_bmesh_uvs(bm, geometry_data, faces, loop_corners):
+    loop_corners = loop_corners.tolist()
+    loop_start = 0
+    for face, i in zip(bm.faces, faces.tolist()):
+        loop_end = loop_start + len(face.loops)
 
-        if face_data.pe_texmap is not None:
-            face_data.pe_texmap.uv_unwrap_face(bm, face)
+        pe_texmap = geometry_data.face_pe_texmaps[i]
+        if pe_texmap is not None:
+            pe_texmap.uv_unwrap_face(bm, face, loop_corners[loop_start:loop_end])
 
-    return bm
+        loop_start = loop_end
 
 
-def __clean_bmesh(bm):
-    if ImportOptions.remove_doubles:
-        bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=ImportOptions.merge_distance)
+# merge_distance is in LDraw units and the vertices are already scaled if the scale is applied to the mesh
+def __merge_distance():
+    if ImportOptions.scale_strategy_value() == "mesh":
+        return ImportOptions.merge_distance * ImportOptions.import_scale
+    return ImportOptions.merge_distance
 
 
 def __process_mesh_sharp_edges(mesh, geometry_data):
     if ImportOptions.smooth_type_value() == "edge_split" or ImportOptions.use_freestyle_edges:
-        edge_indices = __get_edge_indices(mesh.vertices, geometry_data)
-
-        for edge in mesh.edges:
-            v0 = edge.vertices[0]
-            v1 = edge.vertices[1]
-            if (v0, v1) in edge_indices:
-                if ImportOptions.smooth_type_value() == "edge_split":
-                    edge.use_edge_sharp = True
-                if ImportOptions.use_freestyle_edges:
-                    edge.use_freestyle_mark = True
+        # in blender 4 use_edge_sharp is the sharp_edge attribute
+        sharp = __sharp_edges(mesh, geometry_data)
+        if ImportOptions.smooth_type_value() == "edge_split":
+            mesh.edges.foreach_set("use_edge_sharp", sharp)
+        if ImportOptions.use_freestyle_edges:
+            mesh.edges.foreach_set("use_freestyle_mark", sharp)
 
 
 def __process_mesh(mesh):
     if ImportOptions.smooth_type_value() == "auto_smooth" or ImportOptions.smooth_type_value() == "bmesh_split":
         mesh.use_auto_smooth = ImportOptions.shade_smooth
         mesh.auto_smooth_angle = matrices.auto_smooth_angle
-    # scale here so edges can be marked sharp
-    __scale_mesh(mesh)
-
-
-def __scale_mesh(mesh):
-    if ImportOptions.scale_strategy_value() == "mesh":
-        aa = matrices.import_scale_matrix
-        mesh.transform(aa)
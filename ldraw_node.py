@@ -1,10 +1,14 @@
-import uuid
+import time
 import bpy
 
-from .geometry_data import GeometryData
+from .geometry_data import GeometryData, GeometryBlock
 from .import_options import ImportOptions
+from .structural_key import StructuralKey
 from . import group
+from . import helpers
+from . import ldraw_command
 from . import ldraw_mesh
+from . import ldraw_instancing
 from . import ldraw_object
 from . import ldraw_meta
 from . import matrices
@@ -12,33 +16,50 @@ from . import matrices
 
 class LDrawNode:
     """
-    A line of a file that has been processed into something usable.
+    A reference to a file while it is being walked, with the state that walking it builds up.
+    The lines of the file are the command records in file.records.
     """
 
     part_count = 0
     current_filename = ""
     current_model_filename = ""
 
-    key_map = {}
     geometry_datas = {}
+    # local geometry_datas of flattened subparts and primitives
+    # by (filename, accum_cull, accum_invert, negative determinant)
+    flat_geometry_datas = {}
+    flattened_count = 0
+    flat_reuse_count = 0
+
+    # traversal stats of the last load
+    visited_count = 0
+    peak_depth = 0
+    cycle_count = 0
+    traversal_seconds = 0.0
+    # parts placed by models, what the progress of an import counts
+    placed_count = 0
 
     @classmethod
     def reset_caches(cls):
         cls.part_count = 0
-        cls.key_map.clear()
         cls.geometry_datas.clear()
-
-    def __init__(self):
+        cls.flat_geometry_datas.clear()
+        cls.flattened_count = 0
+        cls.flat_reuse_count = 0
+        cls.visited_count = 0
+        cls.peak_depth = 0
+        cls.cycle_count = 0
+        cls.traversal_seconds = 0.0
+        cls.placed_count = 0
+
+    # a node is made for each subfile record that is walked, the root node is made by do_import
+    def __init__(self, ldraw_file=None, matrix=None, determinant_sign=1):
         self.is_root = False
         self.root_object = None
-        self.file = None
-        self.line = ""
-        self.color_code = "16"
-        self.matrix = matrices.identity_matrix
-        self.vertices = []
+        self.file = ldraw_file
+        self.matrix = matrix or matrices.identity_matrix
+        self.determinant_sign = determinant_sign
         self.bfc_certified = None
-        self.meta_command = None
-        self.meta_args = {}
 
         self.texmap_start = False
         self.texmap_next = False
@@ -52,6 +73,9 @@ class LDrawNode:
         self.subfile_pe_tex_infos = {}
         self.pe_tex_info = []
 
+    # the tree of nodes is walked with a stack of LoadFrames instead of recursion
+    # so deep or self referencing files can't hit the recursion limit
+    # returns the object, or mesh if return_mesh, of this node if it's a part
     def load(self,
              color_code="16",
              parent_matrix=None,
@@ -62,11 +86,128 @@ class LDrawNode:
              parent_collection=None,
              return_mesh=False,
              ):
+        return helpers.run_to_end(self.walk(color_code, parent_matrix, accum_matrix, geometry_data, accum_cull, accum_invert, parent_collection, return_mesh))
 
+    # load as a generator that yields after each part is finished so the walk can be spread over time
+    # LDrawNode.placed_count is the number of parts finished so far
+    # returns what load returns
+    def walk(self,
+             color_code="16",
+             parent_matrix=None,
+             accum_matrix=None,
+             geometry_data=None,
+             accum_cull=True,
+             accum_invert=False,
+             parent_collection=None,
+             return_mesh=False,
+             ):
+
+        start = time.perf_counter()
+
+        result = None
+        frame = self.__start_frame(color_code, color_code, parent_matrix, 1, accum_matrix, geometry_data, accum_cull, accum_invert, parent_collection, return_mesh)
+        stack = []
+        # the files on the stack, a file that references one of them would never finish
+        loading_files = set()
+        if frame is not None:
+            stack.append(frame)
+            loading_files.add(self.file)
+
+        while len(stack) > 0:
+            if len(stack) > LDrawNode.peak_depth:
+                LDrawNode.peak_depth = len(stack)
+
+            frame = stack[-1]
+            child_frame = frame.node.__next_frame(frame, loading_files)
+            if child_frame is not None:
+                stack.append(child_frame)
+                loading_files.add(child_frame.node.file)
+                continue
+
+            stack.pop()
+            loading_files.discard(frame.node.file)
+            result = frame.node.__finish_frame(frame)
+
+            # parts placed by a model, not subparts that are their own objects with preserve_hierarchy
+            if frame.is_top and (len(stack) < 1 or stack[-1].geometry_data is None):
+                LDrawNode.placed_count += 1
+                # the time spent waiting for the next step isn't traversal time
+                if len(stack) > 0:
+                    LDrawNode.traversal_seconds += time.perf_counter() - start
+                    yield
+                    start = time.perf_counter()
+
+        LDrawNode.traversal_seconds += time.perf_counter() - start
+        return result
+
+    # the number of parts a load of ldraw_file places, without loading it
+    # only the records of models are read, parts aren't looked into
+    @staticmethod
+    def count_parts(ldraw_file):
+        counts = {}
+        # (file, expanded)
+        stack = [(ldraw_file, False)]
+        while len(stack) > 0:
+            file, expanded = stack.pop()
+
+            if file.is_edge_logo() and not ImportOptions.display_logo:
+                counts[file] = 0
+                continue
+
+            if file.is_like_part():
+                counts[file] = 1
+                continue
+
+            if file is ldraw_file:
+                children = LDrawNode.__step_subfiles(file)
+            else:
+                children = [record.file for record in file.records if record.opcode == ldraw_command.SUBFILE]
+
+            if expanded:
+                counts[file] = sum(counts.get(child, 0) for child in children)
+                continue
+
+            if file in counts:
+                continue
+            # a model that references itself counts as 0 until it's done, like the walk skips it
+            counts[file] = 0
+            stack.append((file, True))
+            for child in children:
+                if child not in counts:
+                    stack.append((child, False))
+
+        return counts[ldraw_file]
+
+    # the files the steps of the root file that are imported reference
+    @staticmethod
+    def __step_subfiles(ldraw_file):
+        subfiles = []
+        step = 1
+        for record in ldraw_file.records:
+            if record.opcode == ldraw_command.STEP:
+                step += 1
+                if not LDrawNode.in_last_step(step):
+                    break
+            elif record.opcode == ldraw_command.SUBFILE and step >= ImportOptions.first_step:
+                subfiles.append(record.file)
+        return subfiles
+
+    # whether step is at or before ImportOptions.last_step, 0 imports every step
+    @staticmethod
+    def in_last_step(step):
+        return ImportOptions.last_step < 1 or step <= ImportOptions.last_step
+
+    # everything that happens before the child nodes of this node are walked
+    # returns None if there is nothing left to do for this node
+    # parent_determinant_sign is the sign of the determinant of parent_matrix
+    # color_code is the color that lines are resolved with, which is 16 inside a part
+    # part_color_code is what 16 means here, the color a part that starts here is placed with
+    def __start_frame(self, color_code, part_color_code, parent_matrix, parent_determinant_sign, accum_matrix, geometry_data, accum_cull, accum_invert, parent_collection, return_mesh=False):
         if self.file.is_edge_logo() and not ImportOptions.display_logo:
-            return
+            return None
 
         LDrawNode.current_filename = self.file.name
+        LDrawNode.visited_count += 1
 
         # keep track of the matrix and color up to this point
         # parent_matrix is the previous level's transform
@@ -83,16 +224,10 @@ class LDrawNode:
         current_matrix = parent_matrix @ self.matrix
         child_accum_matrix = accum_matrix @ current_matrix
         child_matrix = current_matrix
+        # the sign of the determinant of child_matrix, which is all bfc needs of it
+        child_determinant_sign = parent_determinant_sign * self.determinant_sign
 
-        # current_color_code is the color_code up to this point
-        current_color_code = color_code
-
-        # when a part is used on its own and also treated as a subpart like with a shortcut, the part will not render in the shortcut
-        # obj_key is essentially a list of attributes that are unique to parts that share the same file
-        # texmap parts are defined as parts so it should be safe to exclude that from the key
-        # pe_tex_info is defined like an mpd so mutliple instances sharing the same part name will share the same texture unless it is included in the key
-        # the only thing unique about a geometry_data object is its filename and whether it has pe_tex_info
-        geometry_data_key = LDrawNode.__build_key(self.file.name, color_code=current_color_code, pe_tex_info=self.pe_tex_info)
+        geometry_data_key = None
 
         # if there's no geometry_data and some part type, it's a top level part so start collecting geometry
         # there are occasions where files with part_type of model have geometry so you can't rely on its part_type
@@ -124,7 +259,21 @@ class LDrawNode:
         if top_part:
             # top-level part
             LDrawNode.part_count += 1
+
+            # when a part is used on its own and also treated as a subpart like with a shortcut, the part will not render in the shortcut
+            # obj_key is essentially a list of attributes that are unique to parts that share the same file
+            # texmap parts are defined as parts so it should be safe to exclude that from the key
+            # pe_tex_info is defined like an mpd so mutliple instances sharing the same part name will share the same texture unless it is included in the key
+            # the only thing unique about a geometry_data object is its filename and whether it has pe_tex_info
+            # color isn't part of it, the part is walked with color 16 and 16 is only replaced when its mesh is built
+            # subparts that are their own objects are only created while a part is walked
+            # so with preserve_hierarchy the color stays in the key and a part is walked for every color it's placed in
+            key_color_code = None
+            if ImportOptions.preserve_hierarchy:
+                key_color_code = part_color_code
+            geometry_data_key = LDrawNode.__build_key(self.file.name, color_code=key_color_code, pe_tex_info=self.pe_tex_info)
             geometry_data = LDrawNode.geometry_datas.get(geometry_data_key)
+            color_code = "16"
             if self.is_root:
               current_matrix = current_matrix @ matrices.reverse_rotation_matrix
             # clean up floating point errors
@@ -133,6 +282,7 @@ class LDrawNode:
                     current_matrix[i][j] = round(current_matrix[i][j], 6)
 
             child_matrix = matrices.identity_matrix
+            child_determinant_sign = 1
 
         if top_part:
             # creature_015_mangreengraysuitmustache.ldr is a BFC NOCERTIFY model which causes parts used by it to be NOCERTIFY everywhere
@@ -151,139 +301,284 @@ class LDrawNode:
         # if geometry_data exists, this is a top level part that has already been processed so don't process this key again
 
         is_top = top_part or part_model
+
+        frame = LoadFrame(self)
+        frame.color_code = color_code
+        frame.part_color_code = part_color_code
+        frame.parent_matrix = parent_matrix
+        frame.accum_matrix = accum_matrix
+        frame.current_matrix = current_matrix
+        frame.child_matrix = child_matrix
+        frame.child_accum_matrix = child_accum_matrix
+        frame.child_determinant_sign = child_determinant_sign
+        frame.geometry_data_key = geometry_data_key
+        frame.accum_cull = accum_cull
+        frame.accum_invert = accum_invert
+        frame.collection = collection
+        frame.is_top = is_top
+        frame.part_model = part_model
+        frame.return_mesh = return_mesh
+        frame.geometry_data = geometry_data
+
         if not is_top or geometry_data is None:
             if is_top:
                 geometry_data = GeometryData()
-
-            local_cull = True
-            winding = "CCW"
-            invert_next = False
-
-            subfile_line_index = 0
-            for child_node in self.file.child_nodes:
-                # self.texmap_fallback will only be true if ImportOptions.meta_texmap == True and you're on a fallback line
-                # if ImportOptions.meta_texmap == False, it will always be False
-                if child_node.meta_command in ["1", "2", "3", "4", "5"] and not self.texmap_fallback:
-                    child_current_color = LDrawNode.__determine_color(color_code, child_node.color_code)
-                    if child_node.meta_command == "1":
+                frame.geometry_data = geometry_data
+            elif self.__can_flatten(geometry_data):
+                if not self.__start_flattened(frame, geometry_data):
+                    return None
+                geometry_data = frame.geometry_data
+
+            # the geometry lines of this file are transformed into mesh space together
+            # before each subfile and after the last line
+            frame.records = self.file.records
+            frame.geometry_block = GeometryBlock(self.file)
+            frame.geometry_matrix = frame.child_matrix
+            if geometry_data is not None:
+                frame.geometry_matrix = geometry_data.matrix @ frame.child_matrix
+
+        return frame
+
+    # walk the records of frame until a subfile has to be loaded, which is returned as a new frame
+    # returns None once every record has been walked
+    def __next_frame(self, frame, loading_files):
+        records = frame.records
+        geometry_data = frame.geometry_data
+        geometry_block = frame.geometry_block
+        color_code = frame.color_code
+        child_matrix = frame.child_matrix
+        accum_cull = frame.accum_cull
+        accum_invert = frame.accum_invert
+        local_cull = frame.local_cull
+        winding = frame.winding
+        invert_next = frame.invert_next
+
+        child_frame = None
+        while child_frame is None and frame.record_index < len(records):
+            record = records[frame.record_index]
+            frame.record_index += 1
+            opcode = record.opcode
+
+            # self.texmap_fallback will only be true if ImportOptions.meta_texmap == True and you're on a fallback line
+            # if ImportOptions.meta_texmap == False, it will always be False
+            if opcode <= ldraw_command.LINE:
+                if self.texmap_fallback:
+                    pass
+                elif self.is_root and frame.step < ImportOptions.first_step:
+                    # the lines of the steps before the first step aren't loaded
+                    if opcode == ldraw_command.SUBFILE:
+                        frame.subfile_line_index += 1
+                elif opcode == ldraw_command.SUBFILE:
+                    if record.file in loading_files:
+                        LDrawNode.cycle_count += 1
+                        print(f"{record.file.name} in {self.file.name} references a file that is already being loaded, skipping it")
+                    else:
+                        child_node = LDrawNode(record.file, record.matrix, record.determinant_sign)
                         child_node.texmap = self.texmap
 
                         # if we have no pe_tex_info, try to get one from pe_tex_infos otherwise keep using the one we have
                         # custom minifig head > 3626tex.dat (has no pe_tex) > 3626texshell.dat
                         if len(self.pe_tex_info) < 1:
-                            child_node.pe_tex_info = self.pe_tex_infos.get(subfile_line_index, [])
+                            child_node.pe_tex_info = self.pe_tex_infos.get(frame.subfile_line_index, [])
                         else:
                             child_node.pe_tex_info = self.pe_tex_info
 
-                        subfile_pe_tex_infos = self.subfile_pe_tex_infos.get(subfile_line_index, {})
-                        # don't replace the collection in case this file already has pe_tex_infos
+                        subfile_pe_tex_infos = self.subfile_pe_tex_infos.get(frame.subfile_line_index, {})
                         for k, v in subfile_pe_tex_infos.items():
                             child_node.pe_tex_infos.setdefault(k, v)
 
-                        child_node.load(
-                            color_code=child_current_color,
+                        if geometry_data is not None:
+                            geometry_data.add_block(geometry_block, frame.geometry_matrix)
+
+                        # the child is loaded once the rest of this line is processed
+                        # nothing below uses what loading it changes
+                        child_frame = child_node.__start_frame(
+                            color_code=LDrawNode.__determine_color(color_code, record.color_code),
+                            part_color_code=LDrawNode.__determine_color(frame.part_color_code, record.color_code),
                             parent_matrix=child_matrix,
-                            accum_matrix=child_accum_matrix,
+                            parent_determinant_sign=frame.child_determinant_sign,
+                            accum_matrix=frame.child_accum_matrix,
                             geometry_data=geometry_data,
                             accum_cull=self.bfc_certified and accum_cull and local_cull,
                             accum_invert=(accum_invert ^ invert_next),  # xor
-                            parent_collection=collection,
-                        )
-                        # for node in child_node.load(
-                        #         color_code=child_current_color,
-                        #         parent_matrix=child_matrix,
-                        #         geometry_data=geometry_data,
-                        #         accum_cull=self.bfc_certified and accum_cull and local_cull,
-                        #         accum_invert=(accum_invert ^ invert_next),  # xor
-                        #         parent_collection=collection,
-                        # ):
-                        #     yield node
-
-                        subfile_line_index += 1
-                    elif child_node.meta_command == "2":
-                        ldraw_meta.meta_edge(
-                            child_node,
-                            child_current_color,
-                            child_matrix,
-                            geometry_data,
-                        )
-                    elif child_node.meta_command in ["3", "4"]:
-                        _winding = None
-                        if self.bfc_certified and accum_cull and local_cull:
-                            _winding = winding
-
-                        ldraw_meta.meta_face(
-                            self,
-                            child_node,
-                            child_current_color,
-                            child_matrix,
-                            geometry_data,
-                            _winding,
+                            parent_collection=frame.collection,
                         )
-                    elif child_node.meta_command == "5":
-                        ldraw_meta.meta_line(
-                            child_node,
-                            child_current_color,
-                            child_matrix,
-                            geometry_data,
-                        )
-                elif child_node.meta_command == "bfc":
-                    # does it make sense for models to have bfc info? maybe if that model has geometry, but then it would be treated like a part
-                    if ImportOptions.meta_bfc:
-                        local_cull, winding, invert_next = ldraw_meta.meta_bfc(self, child_node, child_matrix, local_cull, winding, invert_next, accum_invert)
-                elif child_node.meta_command == "texmap":
-                    ldraw_meta.meta_texmap(self, child_node, child_matrix)
-                elif child_node.meta_command.startswith("pe_tex_"):
-                    ldraw_meta.meta_pe_tex(self, child_node, child_matrix)
-
-                if self.texmap_next:
-                    ldraw_meta.set_texmap_end(self)
-
-                if child_node.meta_command != "bfc":
-                    invert_next = False
-                elif child_node.meta_command == "bfc" and child_node.meta_args["command"] != "INVERTNEXT":
-                    invert_next = False
-
-        if is_top:
-            # geometry_data will not be None if this is a new mesh
-            # geometry_data will be None if the mesh already exists
-            if geometry_data_key not in LDrawNode.geometry_datas and geometry_data is not None:
-                geometry_data.key = geometry_data_key
-                geometry_data.file = self.file
-                geometry_data.bfc_certified = self.bfc_certified
-                LDrawNode.geometry_datas[geometry_data_key] = geometry_data
-            geometry_data = LDrawNode.geometry_datas[geometry_data_key]
 
+                    frame.subfile_line_index += 1
+                elif opcode == ldraw_command.EDGE:
+                    ldraw_meta.meta_edge(
+                        record,
+                        LDrawNode.__determine_color(color_code, record.color_code),
+                        geometry_block,
+                    )
+                elif opcode == ldraw_command.LINE:
+                    ldraw_meta.meta_line(
+                        record,
+                        LDrawNode.__determine_color(color_code, record.color_code),
+                        geometry_block,
+                    )
+                else:
+                    _winding = None
+                    if self.bfc_certified and accum_cull and local_cull:
+                        _winding = winding
+
+                    ldraw_meta.meta_face(
+                        self,
+                        record,
+                        LDrawNode.__determine_color(color_code, record.color_code),
+                        geometry_block,
+                        _winding,
+                    )
+            elif opcode == ldraw_command.BFC:
+                # does it make sense for models to have bfc info? maybe if that model has geometry, but then it would be treated like a part
+                if ImportOptions.meta_bfc:
+                    local_cull, winding, invert_next = ldraw_meta.meta_bfc(self, record, frame.child_determinant_sign, local_cull, winding, invert_next, accum_invert)
+            elif opcode == ldraw_command.TEXMAP:
+                # texmap points have to be in the same space as the vertices they're projected on
+                ldraw_meta.meta_texmap(self, record, frame.geometry_matrix)
+            elif opcode in ldraw_command.texture_meta_opcodes:
+                ldraw_meta.meta_pe_tex(self, record, child_matrix)
+            elif opcode == ldraw_command.STEP:
+                if self.is_root:
+                    frame.step += 1
+                    # nothing after the last step is walked
+                    if not LDrawNode.in_last_step(frame.step):
+                        frame.record_index = len(records)
+
+            if self.texmap_next:
+                ldraw_meta.set_texmap_end(self)
+
+            if opcode != ldraw_command.BFC or not record.only_invertnext:
+                invert_next = False
+
+        frame.local_cull = local_cull
+        frame.winding = winding
+        frame.invert_next = invert_next
+        return child_frame
+
+    # everything that happens after the child nodes of this node are walked
+    def __finish_frame(self, frame):
+        geometry_data = frame.geometry_data
+        if frame.geometry_block is not None and geometry_data is not None:
+            geometry_data.add_block(frame.geometry_block, frame.geometry_matrix)
+
+        if frame.flat_key is not None:
+            LDrawNode.flat_geometry_datas[frame.flat_key] = geometry_data
+            LDrawNode.flattened_count += 1
+            frame.flat_parent.add_geometry(geometry_data, frame.flat_matrix, frame.flat_color_code)
+            return None
+
+        if not frame.is_top:
+            return None
+
+        color_code = frame.part_color_code
+        collection = frame.collection
+        geometry_data_key = frame.geometry_data_key
+        part_model = frame.part_model
+        parent_matrix = frame.parent_matrix
+        accum_matrix = frame.accum_matrix
+        current_matrix = frame.current_matrix
+        child_matrix = frame.child_matrix
+        return_mesh = frame.return_mesh
+
+        # geometry_data will not be None if this is a new mesh
+        # geometry_data will be None if the mesh already exists
+        if geometry_data_key not in LDrawNode.geometry_datas and geometry_data is not None:
+            geometry_data.key = geometry_data_key
+            geometry_data.file = self.file
+            geometry_data.bfc_certified = self.bfc_certified
+            LDrawNode.geometry_datas[geometry_data_key] = geometry_data
+        geometry_data = LDrawNode.geometry_datas[geometry_data_key]
+
+        obj_matrix = current_matrix
+
+        if part_model:
+            obj_matrix = self.matrix
+            obj_matrix = parent_matrix
             obj_matrix = current_matrix
+            obj_matrix = child_matrix
+            obj_matrix = accum_matrix @ self.matrix
 
-            if part_model:
-                obj_matrix = self.matrix
-                obj_matrix = parent_matrix
-                obj_matrix = current_matrix
-                obj_matrix = child_matrix
-                obj_matrix = accum_matrix @ self.matrix
-
-            if ImportOptions.preserve_hierarchy and self.file.is_subpart():
-              obj_matrix = parent_matrix  @ self.matrix
-
-            # blender mesh data is unique also based on color
-            # this means a geometry_data for a file is created only once, but a mesh is created for every color that uses that geometry_data
-            key = geometry_data.key
-            mesh = ldraw_mesh.create_mesh(key, geometry_data, color_code, return_mesh=return_mesh)
-            if return_mesh:
-                return mesh
-            obj = ldraw_object.create_object(mesh, geometry_data, color_code, obj_matrix, collection, self.is_root)
-
+        if ImportOptions.preserve_hierarchy and self.file.is_subpart():
+          obj_matrix = parent_matrix  @ self.matrix
+
+        # blender mesh data is unique also based on color
+        # this means a geometry_data for a file is created only once, but a mesh is created for every color that uses that geometry_data
+        key = geometry_data.key
+        mesh = ldraw_mesh.create_mesh(key, geometry_data, color_code, return_mesh=return_mesh)
+        if return_mesh:
+            return mesh
+
+        # the placement becomes a point of the instancer that ldraw_instancing.build makes after the walk
+        # preserve_hierarchy needs the objects of the subparts to be real objects
+        if ImportOptions.instance_parts and not ImportOptions.preserve_hierarchy and not self.is_root:
+            edge_mesh = None
             if ImportOptions.import_edges:
-                edge_key = f"e_{geometry_data.key}"
-                edge_mesh = ldraw_mesh.create_edge_mesh(edge_key, geometry_data)
-                edge_obj = ldraw_object.create_edge_obj(edge_mesh, geometry_data, color_code, obj, collection)
-
-            # if LDrawNode.part_count == 1:
-            #     raise BaseException("done")
-
-            # yield obj
-            return obj
+                edge_mesh = ldraw_mesh.create_edge_mesh(f"e_{geometry_data.key.name}", geometry_data)
+            ldraw_instancing.add_instance(mesh, geometry_data, color_code, obj_matrix, edge_mesh)
+            return None
+
+        obj = ldraw_object.create_object(mesh, geometry_data, color_code, obj_matrix, collection, self.is_root)
+
+        if ImportOptions.import_edges:
+            edge_key = f"e_{geometry_data.key.name}"
+            edge_mesh = ldraw_mesh.create_edge_mesh(edge_key, geometry_data)
+            edge_obj = ldraw_object.create_edge_obj(edge_mesh, geometry_data, color_code, obj, collection)
+
+        # if LDrawNode.part_count == 1:
+        #     raise BaseException("done")
+
+        # yield obj
+        return obj
+
+    # subparts and primitives are only walked once for each state that changes their geometry
+    # the first reference flattens the file into a local geometry_data in the space of the file
+    # and every reference after that only transforms it into place
+    def __can_flatten(self, geometry_data):
+        if geometry_data is None:
+            return False
+        # subparts become top level parts that are their own objects
+        if ImportOptions.preserve_hierarchy:
+            return False
+        if not self.file.is_geometry():
+            return False
+        if self.texmap is not None or len(self.pe_tex_info) > 0 or len(self.pe_tex_infos) > 0:
+            return False
+        return not self.file.has_texture_meta()
+
+    # meta_bfc reverses the winding of every file below a matrix with a negative determinant
+    # so those files are flattened mirrored, which keeps the determinants below them the same sign
+    # there is no winding at all below a degenerate matrix, those files are just walked
+    # the mirrored local_matrix has the same determinant sign as child_matrix, so child_determinant_sign stays as it is
+    # returns False if the flattened geometry was already there and has been added to geometry_data
+    def __start_flattened(self, frame, geometry_data):
+        determinant_sign = frame.child_determinant_sign
+        if determinant_sign == 0:
+            return True
+
+        local_matrix = matrices.identity_matrix
+        if determinant_sign < 0:
+            local_matrix = matrices.mirror_matrix
+
+        key = (self.file.filename, bool(frame.accum_cull), bool(frame.accum_invert), determinant_sign < 0)
+        placed_matrix = geometry_data.matrix @ frame.child_matrix @ local_matrix
+
+        flat_geometry_data = LDrawNode.flat_geometry_datas.get(key)
+        if flat_geometry_data is not None:
+            LDrawNode.flat_reuse_count += 1
+            geometry_data.add_geometry(flat_geometry_data, placed_matrix, frame.color_code)
+            return False
+
+        # walk the file in its own space with color 16 left for add_geometry to replace
+        frame.flat_key = key
+        frame.flat_parent = geometry_data
+        frame.flat_matrix = placed_matrix
+        frame.flat_color_code = frame.color_code
+        frame.color_code = "16"
+        frame.child_matrix = local_matrix
+        frame.child_accum_matrix = local_matrix
+        frame.geometry_data = GeometryData(local=True)
+        return True
 
     # set the working color code to this file's
     # color code if it isn't color code 16
@@ -298,21 +593,73 @@ class LDrawNode:
     # such as 32527.dat (mirror of 32528.dat) will render
     @staticmethod
     def __build_key(filename, color_code=None, pe_tex_info=None, matrix=None):
-        _key = (filename, color_code,)
+        _key = (filename,)
+
+        if color_code is not None:
+            _key += (color_code,)
 
         if pe_tex_info is not None:
             for p in pe_tex_info:
                 _key += ((p.point_min, p.point_max, p.matrix, p.image),)
 
         if matrix is not None:
-            _key += (matrix,)
+            _key += (StructuralKey.plain(matrix),)
 
-        str_key = str(_key)
-        if len(str_key) < 60:
-            return str(str_key)
+        return StructuralKey.get(_key, label=filename)
+
+
+class LoadFrame:
+    """
+    The state of one node on the LDrawNode.load stack.
+    """
 
-        key = LDrawNode.key_map.get(_key)
-        if key is None:
-            LDrawNode.key_map[_key] = str(uuid.uuid4())
-            key = LDrawNode.key_map.get(_key)
-        return key
+    __slots__ = (
+        "node",
+        "color_code",
+        "part_color_code",
+        "parent_matrix",
+        "accum_matrix",
+        "current_matrix",
+        "child_matrix",
+        "child_accum_matrix",
+        "child_determinant_sign",
+        "geometry_data",
+        "geometry_data_key",
+        "accum_cull",
+        "accum_invert",
+        "collection",
+        "is_top",
+        "part_model",
+        "return_mesh",
+        "records",
+        "record_index",
+        "local_cull",
+        "winding",
+        "invert_next",
+        "subfile_line_index",
+        "step",
+        "geometry_block",
+        "geometry_matrix",
+        "flat_key",
+        "flat_parent",
+        "flat_matrix",
+        "flat_color_code",
+    )
+
+    def __init__(self, node):
+        self.node = node
+        self.geometry_data = None
+        self.records = ()
+        self.record_index = 0
+        self.local_cull = True
+        self.winding = "CCW"
+        self.invert_next = False
+        self.subfile_line_index = 0
+        # steps are counted from 1 in the file of the root node
+        self.step = 1
+        self.geometry_block = None
+        self.geometry_matrix = None
+        self.flat_key = None
+        self.flat_parent = None
+        self.flat_matrix = None
+        self.flat_color_code = None
@@ -54,12 +54,16 @@ def create_edge_obj(mesh, geometry_data, color_code, obj, collection):
     return edge_obj
 
 def __process_top_object_matrix(obj, obj_matrix, is_root):
+    obj.matrix_world = world_matrix(obj_matrix)
 
+
+# the matrix_world of an object placed at obj_matrix
+def world_matrix(obj_matrix):
     matrix_world = matrices.import_scale_matrix @ obj_matrix
-    obj.matrix_world = matrix_world
 
     if ImportOptions.scale_strategy_value() == "mesh":
-        obj.matrix_world = matrix_world @ matrices.import_scale_matrix.inverted()
+        matrix_world = matrix_world @ matrices.import_scale_matrix.inverted()
+    return matrix_world
 
 
 def __process_top_object_edges(obj):
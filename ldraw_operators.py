@@ -9,6 +9,7 @@ from .ldraw_color import LDrawColor
 from . import matrices
 from . import blender_import
 from . import ldraw_export
+from . import ldraw_instancing
 
 def ensure_directory_exists(file_path):
     # Split the file path into directory and file components
@@ -108,6 +109,29 @@ class ReimportOperator(bpy.types.Operator):
 
         return {'FINISHED'}
 
+class RealizeInstancesOperator(bpy.types.Operator):
+    """Turn the instanced parts of the points selected in edit mode, or of every point, into objects"""
+    bl_idname = "export_ldraw.realize_instances"
+    bl_label = "Realize instances"
+    bl_options = {'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return ldraw_instancing.is_instancer(context.active_object)
+
+    def execute(self, context):
+        obj = context.active_object
+
+        # the selection of the points is only written to the mesh when edit mode is left
+        if obj.mode == 'EDIT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+
+        objects = ldraw_instancing.realize(obj)
+        self.report({'INFO'}, f"Realized {len(objects)} instances")
+
+        return {'FINISHED'}
+
+
 class BatchExportOperator(bpy.types.Operator):
     """Batch export selected parts"""
     bl_idname = "export_ldraw.batch_export"
@@ -266,6 +290,7 @@ classesToRegister = [
     SnapToBrickOperator,
     SnapToPlateOperator,
     ReimportOperator,
+    RealizeInstancesOperator,
     BatchExportOperator,
     RemoveBevelOperator,
     AddBevelOperator,
@@ -14,10 +14,27 @@ auto_smooth_angle = math.radians(auto_smooth_angle_deg)  # 1.56905
 identity_matrix = mathutils.Matrix.Identity(4).freeze()
 rotation_matrix = mathutils.Matrix.Rotation(math.radians(-90), 4, 'X').freeze()  # rotate -90 degrees on X axis to make -Y up
 reverse_rotation_matrix = mathutils.Matrix.Rotation(math.radians(90), 4, 'X').freeze()  # rotate 90 degrees on X axis to make Y up
+mirror_matrix = mathutils.Matrix((
+    (-1, 0, 0, 0),
+    (0, 1, 0, 0),
+    (0, 0, 1, 0),
+    (0, 0, 0, 1),
+)).freeze()  # mirror on X, its own inverse
 import_scale_matrix = mathutils.Matrix.Scale(ImportOptions.import_scale, 4).freeze()
 
+# applied to every vertex as geometry is collected so meshes don't have to be transformed after they're built
+# the rotation to blender's axes and the import scale if it's applied to the mesh
+mesh_matrix = rotation_matrix
+# LDraw's y axis in mesh space
+mesh_y_axis = (rotation_matrix @ mathutils.Vector((0.0, 1.0, 0.0))).freeze()
+
 
 def reset_caches():
     global import_scale_matrix
+    global mesh_matrix
 
     import_scale_matrix = mathutils.Matrix.Scale(ImportOptions.import_scale, 4).freeze()
+
+    mesh_matrix = rotation_matrix
+    if ImportOptions.scale_strategy_value() == "mesh":
+        mesh_matrix = (rotation_matrix @ import_scale_matrix).freeze()
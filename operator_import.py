@@ -6,8 +6,13 @@ import os
 from .import_settings import ImportSettings
 from .import_options import ImportOptions
 from .filesystem import FileSystem
+from .ldraw_file import LDrawFile
 from .ldraw_node import LDrawNode
+from .parse_cache import ParseCache
+from .part_archive import PartArchive
 from . import blender_import
+from . import ldraw_mesh
+from . import ldraw_instancing
 
 
 class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
@@ -51,7 +56,7 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
 
     case_sensitive_filesystem: bpy.props.BoolProperty(
         name="Case-sensitive filesystem",
-        description="Filesystem is case sensitive",
+        description="Filesystem is case sensitive. The library folders are indexed so files are found whatever the case of their names",
         **ImportSettings.settings_dict('case_sensitive_filesystem'),
     )
 
@@ -89,6 +94,12 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
         min=0.0,
     )
 
+    validate_meshes: bpy.props.BoolProperty(
+        name="Validate meshes",
+        description="Check every mesh for invalid geometry after it is built. Slower",
+        **ImportSettings.settings_dict('validate_meshes'),
+    )
+
     shade_smooth: bpy.props.BoolProperty(
         name="Shade smooth",
         description="Shade smooth",
@@ -174,48 +185,132 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
         **ImportSettings.settings_dict('preserve_hierarchy'),
     )
 
+    first_step: bpy.props.IntProperty(
+        name="First step",
+        description="Only import the model from this step on",
+        options={'SKIP_SAVE'},
+        **ImportSettings.settings_dict('first_step'),
+        min=1,
+    )
+
+    last_step: bpy.props.IntProperty(
+        name="Last step",
+        description="Only import the model up to and including this step. 0 imports every step",
+        options={'SKIP_SAVE'},
+        **ImportSettings.settings_dict('last_step'),
+        min=0,
+    )
+
+    instance_parts: bpy.props.BoolProperty(
+        name="Instance parts",
+        description="Import every part as a point of one object that instances the parts with geometry nodes. For very large models. Ignored if Preserve hierarchy is enabled",
+        **ImportSettings.settings_dict('instance_parts'),
+    )
+
+    use_parse_cache: bpy.props.BoolProperty(
+        name="Use parse cache",
+        description="Store parsed files on disk and reuse them until the file changes",
+        **ImportSettings.settings_dict('use_parse_cache'),
+    )
+
+    prefetch_files: bpy.props.BoolProperty(
+        name="Prefetch files",
+        description="Read the files a file references on background threads before they are needed",
+        **ImportSettings.settings_dict('prefetch_files'),
+    )
+
+    parse_in_processes: bpy.props.BoolProperty(
+        name="Parse in processes",
+        description="Parse the files of large MPDs on every core. Not available on Windows",
+        **ImportSettings.settings_dict('parse_in_processes'),
+    )
+
+    use_part_archive: bpy.props.BoolProperty(
+        name="Use part archive",
+        description="Read library parts from the archive compiled by tools/precompile_library.py if there is one",
+        **ImportSettings.settings_dict('use_part_archive'),
+    )
+
     profile: bpy.props.BoolProperty(
         name="Profile",
         description="Profile import performance",
         default=False
     )
 
+    # only an import started from the file browser is modal
+    # a script calling the operator gets the whole import before the call returns
+    modal_import: bpy.props.BoolProperty(
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=False
+    )
+
     def invoke(self, context, _event):
+        self.modal_import = True
         context.window_manager.fileselect_add(self)
         ImportSettings.load_settings()
         return {'RUNNING_MODAL'}
 
-    # _timer = None
-    # __i = 0
-    #
-    # def modal(self, context, event):
-    #     if event.type in {'RIGHTMOUSE', 'ESC'}:
-    #         self.cancel(context)
-    #         return {'CANCELLED'}
-    #
-    #     if event.type == 'TIMER':
-    #         try:
-    #             for i in range(10000):
-    #                 next(self.__i)
-    #         except StopIteration as e:
-    #             self.cancel(context)
-    #
-    #     return {'PASS_THROUGH'}
-    #
-    # def cancel(self, context):
-    #     wm = context.window_manager
-    #     wm.event_timer_remove(self._timer)
+    # how long each timer tick of a modal import may walk before the ui gets to redraw
+    # objects are still made and linked one at a time as their parts are placed, the ticks only bound the time between redraws
+    tick_seconds = 1 / 30
+
+    _timer = None
+    _steps = None
+    _snapshot = None
+    _start = 0.0
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.cancel(context)
+            blender_import.rollback_data(self._snapshot)
+            print("Import cancelled")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        tick_end = time.perf_counter() + self.tick_seconds
+        try:
+            while time.perf_counter() < tick_end:
+                done, total = next(self._steps)
+        except StopIteration:
+            self._steps = None
+            self.__finish_modal(context)
+            self.__print_stats(time.perf_counter() - self._start)
+            return {'FINISHED'}
+        except Exception:
+            # a half imported scene is removed like it is when the user cancels
+            self.cancel(context)
+            blender_import.rollback_data(self._snapshot)
+            raise
+
+        if total > 0:
+            context.window_manager.progress_update(100 * done / total)
+        context.workspace.status_text_set(f"Importing {os.path.basename(self.filepath)}: {done}/{total} parts, Esc to cancel")
+        return {'RUNNING_MODAL'}
+
+    # stop the import, also called by blender when the window closes or another file is loaded
+    # what was imported so far is only removed when the user pressed Esc or the import failed
+    def cancel(self, context):
+        if self._steps is None:
+            return
+        self._steps.close()
+        self._steps = None
+        self.__finish_modal(context)
+
+    def __finish_modal(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
 
     def execute(self, context):
-        start = time.perf_counter()
+        if 0 < self.last_step < self.first_step:
+            self.report({'ERROR'}, f"Last step {self.last_step} is before first step {self.first_step}")
+            ImportSettings.reset_import_only_settings()
+            return {'CANCELLED'}
 
-        # bpy.ops.object.mode_set(mode='OBJECT')
-
-        # wm = context.window_manager
-        # self._timer = wm.event_timer_add(0.01, window=context.window)
-        # wm.modal_handler_add(self)
-        # self.__i = blender_import.do_import(bpy.path.abspath(self.filepath))
-        # return {'RUNNING_MODAL'}
+        start = time.perf_counter()
 
         # https://docs.python.org/3/library/profile.html
         if self.profile:
@@ -231,21 +326,49 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
             stats.sort_stats(pstats.SortKey.TIME)
             stats.print_stats()
             stats.dump_stats(filename=prof_output)
-        else:
+        elif not self.modal_import or bpy.app.background or context.window is None:
+            # called from a script, or there is no event loop to drive a modal import
             blender_import.do_import(bpy.path.abspath(self.filepath))
+        else:
+            if context.mode != 'OBJECT':
+                bpy.ops.object.mode_set(mode='OBJECT')
+
+            self._start = start
+            self._snapshot = blender_import.snapshot_data()
+            self._steps = blender_import.import_steps(bpy.path.abspath(self.filepath))
+
+            wm = context.window_manager
+            wm.progress_begin(0, 100)
+            self._timer = wm.event_timer_add(0.01, window=context.window)
+            wm.modal_handler_add(self)
+            return {'RUNNING_MODAL'}
 
+        self.__print_stats(time.perf_counter() - start)
+        return {'FINISHED'}
+
+    def __print_stats(self, elapsed):
         print("")
         print("======Import Complete======")
         print(self.filepath)
         print(f"Part count: {LDrawNode.part_count}")
-        end = time.perf_counter()
-        elapsed = (end - start)
+        print(f"Files: {LDrawFile.unique_file_count} unique, {LDrawFile.reference_count} references, {LDrawFile.missing_file_count} missing")
+        print(f"Flattened subparts: {LDrawNode.flattened_count} flattened, {LDrawNode.flat_reuse_count} reused")
+        print(f"Meshes: {ldraw_mesh.meshes_built} built, {ldraw_mesh.meshes_reused} reused")
+        if ldraw_instancing.instance_count > 0:
+            print(f"Instances: {ldraw_instancing.instance_count} placements of {len(ldraw_instancing.prototype_collection.objects)} prototypes")
+        if LDrawNode.traversal_seconds > 0:
+            nodes_per_second = round(LDrawNode.visited_count / LDrawNode.traversal_seconds)
+            print(f"Traversal: {LDrawNode.visited_count} nodes, {nodes_per_second} nodes/s, peak depth {LDrawNode.peak_depth}")
+        if LDrawNode.cycle_count > 0:
+            print(f"Skipped {LDrawNode.cycle_count} references to files that were already being loaded")
+        if ImportOptions.use_parse_cache:
+            print(f"Parse cache: {ParseCache.hits} hits, {ParseCache.misses} misses")
+        if PartArchive.hits > 0 or PartArchive.misses > 0:
+            print(f"Part archive: {PartArchive.hits} hits, {PartArchive.misses} misses")
         print(f"elapsed: {elapsed}")
         print("===========================")
         print("")
 
-        return {'FINISHED'}
-
     # https://docs.blender.org/api/current/bpy.types.UILayout.html
     def draw(self, context):
         space_factor = 0.3
@@ -259,6 +382,10 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
         layout.separator(factor=space_factor)
         col = layout.column()
         col.prop(self, "profile")
+        col.prop(self, "use_parse_cache")
+        col.prop(self, "prefetch_files")
+        col.prop(self, "parse_in_processes")
+        col.prop(self, "use_part_archive")
 
         layout.separator(factor=space_factor)
         col = layout.column()
@@ -277,12 +404,16 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator):
         col.label(text="Cleanup Options")
         col.prop(self, "remove_doubles")
         col.prop(self, "merge_distance")
+        col.prop(self, "validate_meshes")
         col.prop(self, "shade_smooth")
         col.prop(self, "smooth_type")
 
         layout.separator(factor=space_factor)
         col = layout.column()
         col.prop(self, "preserve_hierarchy")
+        col.prop(self, "first_step")
+        col.prop(self, "last_step")
+        col.prop(self, "instance_parts")
         
 
 
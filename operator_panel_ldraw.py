@@ -82,6 +82,7 @@ class CO_PT_ldraw_eo_panel(bpy.types.Panel):
         col.operator(ldraw_operators.SnapToBrickOperator.bl_idname)
         col.operator(ldraw_operators.SnapToPlateOperator.bl_idname)
         col.operator(ldraw_operators.ResetGridOperator.bl_idname)
+        col.operator(ldraw_operators.RealizeInstancesOperator.bl_idname)
 
 
 class CO_PT_ldraw_cu_panel(bpy.types.Panel):
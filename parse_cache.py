@@ -0,0 +1,104 @@
+import os
+import pickle
+import hashlib
+import threading
+from pathlib import Path
+
+from .definitions import APP_ROOT
+from .import_options import ImportOptions
+
+
+class ParseCache:
+    """
+    Parsed file contents stored on disk so files that haven't changed don't have to be read and parsed again.
+    """
+
+    # bump this whenever the layout of an entry or of the parsed command records changes
+    version = 2
+
+    cache_path = os.path.join('config', 'cache', 'parsed')
+
+    hits = 0
+    misses = 0
+    # load is also called from the LDrawFile prefetch pool
+    __count_lock = threading.Lock()
+
+    @classmethod
+    def reset_caches(cls):
+        cls.hits = 0
+        cls.misses = 0
+
+    # only the options that change what __read_file and __parse_lines produce belong here
+    # meta_texmap strips the texmap prefix from lines and keeps !DATA blocks
+    # display_logo and chosen_logo replace stud filenames in subfile lines
+    # PartArchive is keyed by the same options
+    @staticmethod
+    def options_key():
+        return (
+            ImportOptions.meta_texmap,
+            ImportOptions.display_logo,
+            ImportOptions.chosen_logo_value(),
+        )
+
+    @staticmethod
+    def __source_stat(filepath):
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    # each file of an mpd is its own entry, named by block
+    @classmethod
+    def __entry_path(cls, filepath, block):
+        key = repr((cls.version, os.path.normcase(os.path.abspath(filepath)), block, cls.options_key()))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(APP_ROOT, cls.cache_path, digest[:2], f"{digest}.pickle")
+
+    @classmethod
+    def load(cls, filepath, block=None):
+        if not ImportOptions.use_parse_cache:
+            return None
+
+        entry = None
+        try:
+            entry_path = cls.__entry_path(filepath, block)
+            if os.path.isfile(entry_path):
+                with open(entry_path, 'rb') as file:
+                    entry = pickle.load(file)
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
+            entry = None
+
+        # a file that was edited after it was cached will have a different mtime or size
+        if entry is not None:
+            if entry.get("version") != cls.version or entry.get("stat") != cls.__source_stat(filepath):
+                entry = None
+
+        with cls.__count_lock:
+            if entry is None:
+                cls.misses += 1
+            else:
+                cls.hits += 1
+        return entry
+
+    @classmethod
+    def store(cls, filepath, entry, block=None):
+        if not ImportOptions.use_parse_cache:
+            return
+
+        try:
+            entry["version"] = cls.version
+            entry["stat"] = cls.__source_stat(filepath)
+
+            entry_path = cls.__entry_path(filepath, block)
+            Path(os.path.dirname(entry_path)).mkdir(parents=True, exist_ok=True)
+
+            # write to a temporary file first so an interrupted import can't leave a truncated entry behind
+            tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
@@ -0,0 +1,394 @@
+import os
+import json
+import mmap
+import struct
+import threading
+import zlib
+from array import array
+from pathlib import Path
+
+from .definitions import APP_ROOT
+from .import_options import ImportOptions
+from .parse_cache import ParseCache
+from . import ldraw_command
+
+
+class PartArchive:
+    """
+    Library parts compiled ahead of time into one file that is memory mapped at import instead of parsing their text.
+    """
+
+    # bump this whenever the layout of the archive or of the parsed command records changes
+    version = 3
+    magic = b"LDPA"
+
+    archive_path = os.path.join('config', 'cache', 'parts.ldpa')
+
+    hits = 0
+    misses = 0
+    # load is also called from the LDrawFile prefetch pool
+    __count_lock = threading.Lock()
+
+    __mm = None
+    __sections = None
+    __index_size = 0
+    # the folders parts were compiled from whose mtime has changed since, only their parts are checked one by one
+    __changed_dirs = set()
+
+    # magic, version, length of the json meta data that follows
+    __header_struct = struct.Struct("<4sII")
+
+    # name, source path, header json, then the start and count of the part's
+    # ops, vertices and matrices in items of their section, then the source mtime_ns and size
+    __part_struct = struct.Struct("<IIIIIIIIIqq")
+
+    # ops are (opcode, a, b, c)
+    # 1: color, filename, matrix offset
+    # 2-5: color, vertex offset, line or -1
+    # meta commands: clean_line, extra value or -1, unused
+    # opcodes are the same as the opcodes of the command records
+    __meta_opcodes = {k: v for k, v in ldraw_command.opcodes.items() if v >= ldraw_command.BFC}
+    __meta_commands = {v: k for k, v in __meta_opcodes.items()}
+
+    __vert_counts = {2: 6, 3: 9, 4: 12, 5: 12}
+
+    @classmethod
+    def reset_caches(cls):
+        cls.hits = 0
+        cls.misses = 0
+
+    @classmethod
+    def full_path(cls):
+        return os.path.join(APP_ROOT, cls.archive_path)
+
+    @staticmethod
+    def __key(filename):
+        return filename.replace("\\", "/").lower()
+
+    @staticmethod
+    def __hash(key):
+        return zlib.crc32(key.encode('utf-8'))
+
+    # map the archive if it was compiled from this library with the current options
+    # library_version is LDrawFile.library_version()
+    # adding, removing or replacing a file changes the mtime of its folder, so the folders are checked once here
+    # and only the parts in folders that changed are checked against their source file when they are loaded
+    @classmethod
+    def open(cls, library_version):
+        cls.close()
+        if not ImportOptions.use_part_archive:
+            return False
+
+        full_path = cls.full_path()
+        if not os.path.isfile(full_path):
+            return False
+
+        try:
+            with open(full_path, 'rb') as file:
+                mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, meta_length = cls.__header_struct.unpack_from(mm, 0)
+            meta = None
+            if magic == cls.magic and version == cls.version:
+                meta = json.loads(mm[cls.__header_struct.size:cls.__header_struct.size + meta_length].decode('utf-8'))
+
+            if meta is None:
+                print(f"{full_path} was written by a different version, compile it again")
+            elif meta["library_version"] != library_version:
+                print(f"{full_path} is for library {meta['library_version']}, not {library_version}, compile it again")
+                meta = None
+            elif meta["options"] != list(ParseCache.options_key()):
+                meta = None
+
+            if meta is None:
+                mm.close()
+                return False
+
+            cls.__mm = mm
+            cls.__sections = meta["sections"]
+            cls.__index_size = meta["index_size"]
+            cls.__changed_dirs = {path for path, mtime_ns in meta["dirs"].items() if cls.__dir_mtime(path) != mtime_ns}
+            return True
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
+            cls.close()
+            return False
+
+    @classmethod
+    def close(cls):
+        if cls.__mm is not None:
+            cls.__mm.close()
+        cls.__mm = None
+        cls.__sections = None
+        cls.__index_size = 0
+        cls.__changed_dirs = set()
+
+    @staticmethod
+    def __dir_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    # the parse cache record of filename if it is in the archive and filepath is the file it was compiled from
+    @classmethod
+    def load(cls, filename, filepath):
+        mm = cls.__mm
+        if mm is None:
+            return None
+
+        file_record = None
+        try:
+            file_record = cls.__load_record(mm, filename, filepath)
+        except Exception as e:
+            print(e)
+            import traceback
+            print(traceback.format_exc())
+
+        with cls.__count_lock:
+            if file_record is None:
+                cls.misses += 1
+            else:
+                cls.hits += 1
+        return file_record
+
+    @classmethod
+    def __load_record(cls, mm, filename, filepath):
+        part_id = cls.__find(mm, cls.__key(filename))
+        if part_id is None:
+            return None
+
+        sections = cls.__sections
+        part_offset = sections["parts"][0] + part_id * cls.__part_struct.size
+        (
+            name_id, path_id, header_id,
+            ops_start, ops_count, verts_start, verts_count, matrices_start, matrices_count,
+            mtime_ns, size,
+        ) = cls.__part_struct.unpack_from(mm, part_offset)
+
+        # a file in the model's directory or a part that was updated after compiling has to be read as text
+        path = cls.__string(mm, path_id)
+        if os.path.normcase(os.path.abspath(path)) != os.path.normcase(os.path.abspath(filepath)):
+            return None
+        if os.path.dirname(path) in cls.__changed_dirs:
+            stat = os.stat(filepath)
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+                return None
+
+        ops = array('i')
+        ops_offset = sections["ops"][0] + ops_start * ops.itemsize
+        ops.frombytes(mm[ops_offset:ops_offset + ops_count * ops.itemsize])
+
+        verts = array('d')
+        verts_offset = sections["verts"][0] + verts_start * verts.itemsize
+        verts.frombytes(mm[verts_offset:verts_offset + verts_count * verts.itemsize])
+
+        matrices = array('d')
+        matrices_offset = sections["matrices"][0] + matrices_start * matrices.itemsize
+        matrices.frombytes(mm[matrices_offset:matrices_offset + matrices_count * matrices.itemsize])
+
+        commands = cls.unpack_commands(ops, verts, matrices, lambda string_id: cls.__string(mm, string_id))
+
+        return {
+            "filename": cls.__string(mm, name_id),
+            "header": json.loads(cls.__string(mm, header_id)),
+            "commands": commands,
+            "lines": [],
+        }
+
+    # append the command tuples of a parse cache record to ops, verts and matrices
+    # string_id(value) returns where value is in the table of strings the ops refer to
+    # the lines of subfile and geometry commands are only kept by the text parser
+    # nothing reads them after parsing, except the uvs of triangles with PE_TEX_INFO
+    @classmethod
+    def pack_commands(cls, commands, string_id, ops, verts, matrices):
+        verts_start = len(verts)
+        matrices_start = len(matrices)
+        for command in commands:
+            meta_command = command[0]
+            if meta_command == "1":
+                ops.extend((1, string_id(command[2]), string_id(command[4]), len(matrices) - matrices_start))
+                matrices.extend(command[3])
+            elif meta_command in ("2", "3", "4", "5"):
+                line_id = -1
+                if meta_command == "3" and len(command[1].split()) > 11:
+                    line_id = string_id(command[1])
+                ops.extend((int(meta_command), string_id(command[2]), len(verts) - verts_start, line_id))
+                verts.extend(command[3])
+            elif len(command) > 2:
+                ops.extend((cls.__meta_opcodes[meta_command], string_id(command[1]), string_id(command[2]), 0))
+            else:
+                ops.extend((cls.__meta_opcodes[meta_command], string_id(command[1]), -1, 0))
+
+    # the command tuples that pack_commands packed, string(string_id) returns a string from its table
+    @classmethod
+    def unpack_commands(cls, ops, verts, matrices, string):
+        verts = verts.tolist()
+        matrices = matrices.tolist()
+
+        commands = []
+        for i in range(0, len(ops), 4):
+            opcode, a, b, c = ops[i:i + 4]
+            if opcode == 1:
+                commands.append(("1", "", string(a), tuple(matrices[c:c + 12]), string(b)))
+            elif opcode in cls.__vert_counts:
+                commands.append((str(opcode), "" if c == -1 else string(c), string(a), tuple(verts[b:b + cls.__vert_counts[opcode]])))
+            elif b == -1:
+                commands.append((cls.__meta_commands[opcode], string(a)))
+            else:
+                commands.append((cls.__meta_commands[opcode], string(a), string(b)))
+        return commands
+
+    # open addressing with linear probing, a slot holds part id + 1 and 0 is empty
+    @classmethod
+    def __find(cls, mm, key):
+        index_offset = cls.__sections["index"][0]
+        mask = cls.__index_size - 1
+        slot = cls.__hash(key) & mask
+        for _ in range(cls.__index_size):
+            value = struct.unpack_from("<I", mm, index_offset + slot * 4)[0]
+            if value == 0:
+                return None
+
+            part_id = value - 1
+            name_id = struct.unpack_from("<I", mm, cls.__sections["parts"][0] + part_id * cls.__part_struct.size)[0]
+            if cls.__string(mm, name_id) == key:
+                return part_id
+            slot = (slot + 1) & mask
+        return None
+
+    @classmethod
+    def __string(cls, mm, string_id):
+        offsets_offset = cls.__sections["string_offsets"][0]
+        start, end = struct.unpack_from("<II", mm, offsets_offset + string_id * 4)
+        strings_offset = cls.__sections["strings"][0]
+        return mm[strings_offset + start:strings_offset + end].decode('utf-8')
+
+    # compile every .dat in FileSystem.library_index, which build_search_paths has to have filled already
+    # read_record is LDrawFile.read_record, passed in because ldraw_file imports this module
+    @classmethod
+    def compile(cls, library_index, read_record, library_version):
+        strings = {}
+        parts = []
+        index = {}
+        dirs = {}
+        part_ids = {}
+        ops = array('i')
+        verts = array('d')
+        matrices = array('d')
+
+        def string_id(value):
+            _id = strings.get(value)
+            if _id is None:
+                _id = len(strings)
+                strings[value] = _id
+            return _id
+
+        keys = sorted(key for key in library_index if key.endswith(".dat"))
+        for i, key in enumerate(keys):
+            if i % 1000 == 0:
+                print(f"{i}/{len(keys)}")
+
+            # the same file can be indexed under more than one name
+            filepath = library_index[key]
+            part_id = part_ids.get(filepath)
+            if part_id is not None:
+                index[cls.__key(key)] = part_id
+                continue
+
+            file_record = read_record(key)
+            if file_record is None:
+                continue
+
+            ops_start = len(ops)
+            verts_start = len(verts)
+            matrices_start = len(matrices)
+
+            cls.pack_commands(file_record["commands"], string_id, ops, verts, matrices)
+
+            stat = os.stat(filepath)
+            dirs.setdefault(os.path.dirname(filepath), cls.__dir_mtime(os.path.dirname(filepath)))
+            part_id = len(parts)
+            parts.append(cls.__part_struct.pack(
+                string_id(cls.__key(key)),
+                string_id(filepath),
+                string_id(json.dumps(file_record["header"])),
+                ops_start, len(ops) - ops_start,
+                verts_start, len(verts) - verts_start,
+                matrices_start, len(matrices) - matrices_start,
+                stat.st_mtime_ns, stat.st_size,
+            ))
+            part_ids[filepath] = part_id
+            index[cls.__key(key)] = part_id
+
+        index_size = 1
+        while index_size < len(index) * 2:
+            index_size *= 2
+        slots = array('I', [0] * index_size)
+        for key, part_id in index.items():
+            slot = cls.__hash(key) & (index_size - 1)
+            while slots[slot] != 0:
+                slot = (slot + 1) & (index_size - 1)
+            slots[slot] = part_id + 1
+
+        string_offsets = array('I', [0])
+        string_blob = bytearray()
+        for value in strings:
+            string_blob += value.encode('utf-8')
+            string_offsets.append(len(string_blob))
+
+        blocks = [
+            ("parts", b"".join(parts)),
+            ("index", slots.tobytes()),
+            ("ops", ops.tobytes()),
+            ("verts", verts.tobytes()),
+            ("matrices", matrices.tobytes()),
+            ("string_offsets", string_offsets.tobytes()),
+            ("strings", bytes(string_blob)),
+        ]
+
+        cls.__write(cls.full_path(), blocks, {
+            "library_version": library_version,
+            "options": list(ParseCache.options_key()),
+            "index_size": index_size,
+            "dirs": dirs,
+            "part_count": len(parts),
+        })
+        return len(parts), len(index)
+
+    # sections are aligned to 8 bytes after the header and meta data
+    # the offsets depend on the length of the meta data, so it is sized with placeholder offsets first
+    @classmethod
+    def __write(cls, full_path, blocks, meta):
+        def layout(meta_length):
+            sections = {}
+            offset = cls.__header_struct.size + meta_length
+            for name, data in blocks:
+                offset = (offset + 7) & ~7
+                sections[name] = [offset, len(data)]
+                offset += len(data)
+            return sections
+
+        meta["sections"] = layout(0)
+        meta_length = len(json.dumps(meta).encode('utf-8'))
+        while True:
+            meta["sections"] = layout(meta_length)
+            meta_bytes = json.dumps(meta).encode('utf-8')
+            if len(meta_bytes) <= meta_length:
+                break
+            meta_length = len(meta_bytes)
+        meta_bytes = meta_bytes.ljust(meta_length)
+
+        Path(os.path.dirname(full_path)).mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first so an interrupted compile can't leave a truncated archive behind
+        tmp_path = f"{full_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(cls.__header_struct.pack(cls.magic, cls.version, meta_length))
+            file.write(meta_bytes)
+            for name, data in blocks:
+                file.seek(meta["sections"][name][0])
+                file.write(data)
+        os.replace(tmp_path, full_path)
@@ -0,0 +1,69 @@
+import hashlib
+
+
+class StructuralKey:
+    """
+    A key made of plain values, interned so equal keys are the same object and their hash is only computed once.
+    name is derived from the values alone, so it is the same in every session and can name datablocks and cached files.
+    """
+
+    __slots__ = ("values", "hash", "name")
+
+    __interned = {}
+
+    # long labels are cut so names stay under blender's 63 character limit
+    __label_length = 40
+    __digest_size = 8
+
+    @classmethod
+    def reset_caches(cls):
+        cls.__interned.clear()
+
+    # values are hashable plain values or frozen mathutils vectors and matrices, which are turned into tuples of floats
+    # label and name are not part of the key, name replaces the derived name when it's already derived from values
+    @classmethod
+    def get(cls, values, label=None, name=None):
+        key = cls.__interned.get(values)
+        if key is None:
+            key = cls(cls.plain(values), label, name)
+            cls.__interned[values] = key
+        return key
+
+    @classmethod
+    def plain(cls, value):
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        if isinstance(value, StructuralKey):
+            return value.values
+        return tuple(cls.plain(v) for v in value)
+
+    def __init__(self, values, label=None, name=None):
+        self.values = values
+        self.hash = hash(values)
+
+        if name is not None:
+            self.name = name
+            return
+
+        # repr of str, int, float, bool, None and tuples of them doesn't change between sessions, hash() of str does
+        digest = hashlib.blake2b(repr(values).encode('utf-8'), digest_size=self.__digest_size).hexdigest()
+        if label is None:
+            self.name = digest
+        else:
+            self.name = f"{label[:self.__label_length]}-{digest}"
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, StructuralKey):
+            return NotImplemented
+        return self.hash == other.hash and self.values == other.values
+
+    def __repr__(self):
+        return f"StructuralKey{self.values!r}"
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,299 @@
+"""
+Checks vertex_weld against brute force and against bmesh.ops.remove_doubles, which it replaced.
+
+The brute force checks only need NumPy:
+python -m pytest tests
+
+The remove_doubles checks need Blender's bpy module and an LDraw library, they are skipped without them:
+LDRAW_PATH=path/to/ldraw python -m pytest tests
+"""
+
+import collections
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ADDON_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+ADDON_NAME = os.path.basename(ADDON_ROOT)
+
+# vertex_weld only needs NumPy, so it is imported on its own instead of through the addon, which needs bpy
+sys.path.insert(0, ADDON_ROOT)
+import vertex_weld
+
+# ImportOptions.merge_distance
+MERGE_DISTANCE = 0.05
+
+# parts with studs, curved surfaces, NOCLIP sections and coincident faces
+LIBRARY_PARTS = [
+    "3001.dat",
+    "3024.dat",
+    "3062b.dat",
+    "3626c.dat",
+    "3941.dat",
+    "4073.dat",
+    "6141.dat",
+    "30374.dat",
+]
+
+
+# float32 positions, clustered so there are exact duplicates, near pairs and groups that chain
+def clustered_vertices(seed, count):
+    rng = np.random.default_rng(seed)
+    centers = rng.integers(-10, 10, size=(count // 4, 3)).astype(np.float32)
+    vertices = centers[rng.integers(0, len(centers), size=count)]
+    jitter = rng.random(count) < 0.5
+    vertices[jitter] += rng.normal(0, MERGE_DISTANCE, size=(int(jitter.sum()), 3)).astype(np.float32)
+    return vertices
+
+
+# the squared distance of every pair, in float32 in the same order as vertex_weld
+def squared_distances(a, b):
+    d = a[:, None, :] - b[None, :, :]
+    return d[:, :, 0] * d[:, :, 0] + d[:, :, 1] * d[:, :, 1] + d[:, :, 2] * d[:, :, 2]
+
+
+# every vertex in order merges the vertices within distance that haven't been merged yet,
+# unless it was merged into an earlier vertex itself
+def brute_force_weld(vertices, distance):
+    vertices = np.asarray(vertices, dtype=np.float32)
+    near = squared_distances(vertices, vertices) <= np.float32(distance) * np.float32(distance)
+
+    merged_into = {}
+    for i in range(len(vertices)):
+        if merged_into.get(i, i) != i:
+            continue
+        found = False
+        for j in np.flatnonzero(near[i]).tolist():
+            if j != i and j not in merged_into:
+                merged_into[j] = i
+                found = True
+        if found:
+            merged_into[i] = i
+
+    welded_indices = np.array([merged_into.get(i, i) for i in range(len(vertices))], dtype=np.intp)
+    kept = np.unique(welded_indices)
+    return np.searchsorted(kept, welded_indices), kept
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("distance", [0.0, MERGE_DISTANCE, 0.5])
+def test_weld_vertices_matches_brute_force(seed, distance):
+    vertices = clustered_vertices(seed, 400)
+    vertex_indices, kept = vertex_weld.weld_vertices(vertices, distance)
+    expected_indices, expected_kept = brute_force_weld(vertices, distance)
+    np.testing.assert_array_equal(kept, expected_kept)
+    np.testing.assert_array_equal(vertex_indices, expected_indices)
+
+
+def test_weld_vertices_empty():
+    vertex_indices, kept = vertex_weld.weld_vertices(np.empty((0, 3)), MERGE_DISTANCE)
+    assert len(vertex_indices) == 0
+    assert len(kept) == 0
+
+
+# a vertex within distance of two vertices that aren't within distance of each other
+# is merged into the first and the second stays
+def test_weld_vertices_does_not_chain():
+    vertices = [(0, 0, 0), (0.04, 0, 0), (0.08, 0, 0)]
+    vertex_indices, kept = vertex_weld.weld_vertices(vertices, MERGE_DISTANCE)
+    np.testing.assert_array_equal(vertex_indices, [0, 0, 1])
+    np.testing.assert_array_equal(kept, [0, 2])
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("distance", [0.0, MERGE_DISTANCE, 0.5])
+def test_points_within_matches_brute_force(seed, distance):
+    points = clustered_vertices(seed, 300)
+    queries = clustered_vertices(seed + 100, 200)
+    query_indices, point_indices = vertex_weld.points_within(points, queries, distance)
+
+    near = squared_distances(queries, points) <= np.float32(distance) * np.float32(distance)
+    expected = set(zip(*(indices.tolist() for indices in np.nonzero(near))))
+    assert set(zip(query_indices.tolist(), point_indices.tolist())) == expected
+    assert len(query_indices) == len(expected)
+    assert np.all(np.diff(query_indices) >= 0)
+
+
+def test_points_within_empty():
+    query_indices, point_indices = vertex_weld.points_within(np.empty((0, 3)), [(0, 0, 0)], MERGE_DISTANCE)
+    assert len(query_indices) == 0
+    assert len(point_indices) == 0
+
+
+# face_vertices (F, 4, 3) and face_vertex_counts (F,) like GeometryData, triangles repeat their last vertex
+def face_arrays(faces):
+    face_vertices = np.array([list(face) + [face[-1]] * (4 - len(face)) for face in faces], dtype=np.float32)
+    face_vertex_counts = np.array([len(face) for face in faces], dtype=np.intp)
+    return face_vertices, face_vertex_counts
+
+
+SQUARE = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)]
+# the square again with the opposite winding and corners within merge distance of the square's
+REVERSED_SQUARE = [(0.01, 0, 0), (0, 1.01, 0), (1, 1, 0), (1, 0, 0)]
+# a triangle whose last two corners are within merge distance, it collapses to an edge
+COLLAPSED_TRIANGLE = [(2, 0, 0), (3, 0, 0), (3.01, 0, 0)]
+
+
+def test_weld_faces_keeps_first_of_opposite_windings():
+    face_vertices, face_vertex_counts = face_arrays([SQUARE, REVERSED_SQUARE])
+    vertices, loop_vertex_indices, counts, faces, loop_corners = vertex_weld.weld_faces(face_vertices, face_vertex_counts, MERGE_DISTANCE)
+    np.testing.assert_array_equal(faces, [0])
+    np.testing.assert_array_equal(counts, [4])
+    np.testing.assert_array_equal(vertices[loop_vertex_indices], np.array(SQUARE, dtype=np.float32))
+    np.testing.assert_array_equal(loop_corners, [0, 1, 2, 3])
+
+
+def test_weld_faces_drops_collapsed_faces():
+    face_vertices, face_vertex_counts = face_arrays([SQUARE, COLLAPSED_TRIANGLE])
+    vertices, loop_vertex_indices, counts, faces, loop_corners = vertex_weld.weld_faces(face_vertices, face_vertex_counts, MERGE_DISTANCE)
+    np.testing.assert_array_equal(faces, [0])
+    np.testing.assert_array_equal(counts, [4])
+    # the vertices of the collapsed triangle are still welded, but no face uses them
+    assert len(vertices) == 6
+    assert set(loop_vertex_indices.tolist()) == {0, 1, 2, 3}
+
+
+@pytest.fixture(scope="module")
+def bmesh():
+    pytest.importorskip("bpy")
+    return importlib.import_module("bmesh")
+
+
+def remove_doubles(bmesh, face_vertices, face_vertex_counts, distance):
+    bm = bmesh.new()
+    for corners, count in zip(face_vertices, face_vertex_counts):
+        bm.faces.new([bm.verts.new(co) for co in corners[:count]])
+    bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=distance)
+    return bm
+
+
+# the vertex counts, face counts and positions of weld_faces and remove_doubles are the same,
+# and every face is on the same vertices
+# the differences are the ones weld_faces is documented to have:
+# - which vertex of a group keeps its position, remove_doubles picks it in kd-tree order,
+#   so positions are compared within distance
+# - of two faces on the same vertices with opposite windings either can be left by remove_doubles,
+#   so faces are compared by their vertices and not their winding
+# - the vertices of loose edges left by collapsed faces are not counted, weld_faces doesn't keep them
+def assert_matches_remove_doubles(bmesh, face_vertices, face_vertex_counts, distance):
+    vertices, loop_vertex_indices, counts, _faces, _loop_corners = vertex_weld.weld_faces(face_vertices, face_vertex_counts, distance)
+    used = np.unique(loop_vertex_indices)
+
+    bm = remove_doubles(bmesh, face_vertices, face_vertex_counts, distance)
+    bm.verts.index_update()
+    bm_vertices = np.array([tuple(v.co) for v in bm.verts if v.link_faces], dtype=np.float32).reshape(-1, 3)
+    bm_indices = {v.index: i for i, v in enumerate(v for v in bm.verts if v.link_faces)}
+    bm_faces = [[bm_indices[v.index] for v in f.verts] for f in bm.faces]
+
+    assert len(used) == len(bm_vertices)
+    assert len(counts) == len(bm_faces)
+
+    # the nearest welded vertex of every remove_doubles vertex, each one is matched once
+    query_indices, point_indices = vertex_weld.points_within(vertices[used], bm_vertices, distance)
+    nearest = np.full(len(bm_vertices), -1, dtype=np.intp)
+    nearest_distance = np.full(len(bm_vertices), np.inf)
+    d = np.linalg.norm(bm_vertices[query_indices] - vertices[used][point_indices], axis=1)
+    for query, point, dist in zip(query_indices.tolist(), point_indices.tolist(), d.tolist()):
+        if dist < nearest_distance[query]:
+            nearest[query] = point
+            nearest_distance[query] = dist
+    assert np.all(nearest >= 0)
+    assert len(np.unique(nearest)) == len(nearest)
+
+    welded = np.searchsorted(used, loop_vertex_indices)
+    starts = np.cumsum(counts) - counts
+    weld_face_keys = collections.Counter(tuple(sorted(welded[start:start + count].tolist())) for start, count in zip(starts, counts))
+    bm_face_keys = collections.Counter(tuple(sorted(nearest[face].tolist())) for face in bm_faces)
+    assert weld_face_keys == bm_face_keys
+    return bm
+
+
+def test_opposite_windings_match_remove_doubles(bmesh):
+    face_vertices, face_vertex_counts = face_arrays([SQUARE, REVERSED_SQUARE])
+    assert_matches_remove_doubles(bmesh, face_vertices, face_vertex_counts, MERGE_DISTANCE)
+
+    # the same faces the other way round, remove_doubles doesn't always keep the first of them
+    triangle = SQUARE[:3]
+    face_vertices, face_vertex_counts = face_arrays([triangle, list(reversed(triangle))])
+    assert_matches_remove_doubles(bmesh, face_vertices, face_vertex_counts, MERGE_DISTANCE)
+
+
+def test_collapsed_faces_match_remove_doubles_without_loose_edges(bmesh):
+    face_vertices, face_vertex_counts = face_arrays([SQUARE, COLLAPSED_TRIANGLE])
+    bm = assert_matches_remove_doubles(bmesh, face_vertices, face_vertex_counts, MERGE_DISTANCE)
+    # remove_doubles leaves the collapsed triangle as a loose edge
+    assert len([e for e in bm.edges if not e.link_faces]) == 1
+
+
+@pytest.fixture(scope="module")
+def addon():
+    bpy = pytest.importorskip("bpy")
+
+    ldraw_path = os.environ.get("LDRAW_PATH")
+    if not ldraw_path or not os.path.isdir(ldraw_path):
+        pytest.skip("set LDRAW_PATH to an LDraw library")
+
+    sys.path.insert(0, os.path.dirname(ADDON_ROOT))
+    ImportSettings = importlib.import_module(f"{ADDON_NAME}.import_settings").ImportSettings
+    ImportOptions = importlib.import_module(f"{ADDON_NAME}.import_options").ImportOptions
+    blender_import = importlib.import_module(f"{ADDON_NAME}.blender_import")
+    ldraw_props = importlib.import_module(f"{ADDON_NAME}.ldraw_props")
+
+    # the faces are imported without welding so every face corner is its own vertex
+    saved_settings = ImportSettings.settings
+    save_settings = ImportSettings.save_settings
+    ImportSettings.save_settings = classmethod(lambda cls: None)
+    ImportSettings.settings = dict(ImportSettings.default_settings)
+    ImportSettings.settings["ldraw_path"] = ldraw_path
+    ImportSettings.settings["studio_ldraw_path"] = ""
+    ImportSettings.settings["remove_doubles"] = False
+    ImportSettings.settings["import_scale"] = 1.0
+    # a modifier smooths the mesh instead of splitting its vertices
+    ImportSettings.settings["smooth_type"] = [choice[0] for choice in ImportOptions.smooth_type_choices].index("edge_split")
+
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    ldraw_props.register()
+    yield bpy, blender_import, ldraw_path
+    ldraw_props.unregister()
+
+    ImportSettings.save_settings = save_settings
+    ImportSettings.settings = saved_settings
+
+
+# the faces of a mesh as face_vertices (F, 4, 3) and face_vertex_counts (F,)
+def mesh_face_arrays(mesh):
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    loop_vertex_indices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertex_indices)
+    face_vertex_counts = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", face_vertex_counts)
+
+    face_vertex_counts = face_vertex_counts.astype(np.intp)
+    corners = np.arange(4) < face_vertex_counts[:, None]
+    face_vertices = np.empty((len(face_vertex_counts), 4, 3), dtype=np.float32)
+    face_vertices[corners] = co.reshape(-1, 3)[loop_vertex_indices]
+    face_vertices[face_vertex_counts == 3, 3] = face_vertices[face_vertex_counts == 3, 2]
+    return face_vertices, face_vertex_counts
+
+
+@pytest.mark.parametrize("part", LIBRARY_PARTS)
+def test_weld_faces_matches_remove_doubles_on_library_parts(addon, bmesh, part):
+    bpy, blender_import, ldraw_path = addon
+
+    filepath = os.path.join(ldraw_path, "parts", part)
+    if not os.path.isfile(filepath):
+        pytest.skip(f"{part} is not in {ldraw_path}")
+
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+    blender_import.do_import(filepath)
+
+    meshes = [mesh for mesh in bpy.data.meshes if len(mesh.polygons) > 0]
+    assert len(meshes) > 0
+    for mesh in meshes:
+        face_vertices, face_vertex_counts = mesh_face_arrays(mesh)
+        assert_matches_remove_doubles(bmesh, face_vertices, face_vertex_counts, MERGE_DISTANCE)
@@ -0,0 +1,81 @@
+"""
+Compiles every .dat in the configured LDraw library into the part archive that imports read instead of parsing text.
+
+Blender provides bpy and mathutils, so run it with Blender from anywhere:
+blender --background --factory-startup --python tools/precompile_library.py -- [options]
+
+The library paths and options saved by the import dialog are used unless they are given here.
+Run it again after updating the library, imports ignore an archive that was compiled for another library update.
+Parts in folders that changed since compiling are checked one by one and read as text if they changed,
+but a part edited in place doesn't change its folder, so compile again after editing parts.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+ADDON_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.dirname(ADDON_ROOT))
+ADDON_NAME = os.path.basename(ADDON_ROOT)
+
+ImportSettings = importlib.import_module(f"{ADDON_NAME}.import_settings").ImportSettings
+FileSystem = importlib.import_module(f"{ADDON_NAME}.filesystem").FileSystem
+LDrawFile = importlib.import_module(f"{ADDON_NAME}.ldraw_file").LDrawFile
+PartArchive = importlib.import_module(f"{ADDON_NAME}.part_archive").PartArchive
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="precompile_library.py")
+    parser.add_argument("--ldraw-path")
+    parser.add_argument("--studio-ldraw-path")
+    parser.add_argument("--resolution", choices=[choice[0] for choice in FileSystem.resolution_choices])
+    parser.add_argument("--prefer-studio", action="store_true", default=None)
+    parser.add_argument("--prefer-unofficial", action="store_true", default=None)
+    args = parser.parse_args(argv)
+
+    ImportSettings.load_settings()
+    ImportSettings.apply_settings()
+
+    if args.ldraw_path is not None:
+        FileSystem.ldraw_path = args.ldraw_path
+    if args.studio_ldraw_path is not None:
+        FileSystem.studio_ldraw_path = args.studio_ldraw_path
+    if args.resolution is not None:
+        FileSystem.resolution = [choice[0] for choice in FileSystem.resolution_choices].index(args.resolution)
+    if args.prefer_studio is not None:
+        FileSystem.prefer_studio = args.prefer_studio
+    if args.prefer_unofficial is not None:
+        FileSystem.prefer_unofficial = args.prefer_unofficial
+
+    # the archive has every part of the library index, which is only built on case sensitive filesystems
+    FileSystem.case_sensitive_filesystem = True
+
+    FileSystem.reset_caches()
+    LDrawFile.reset_caches()
+    FileSystem.build_search_paths()
+
+    library_version = LDrawFile.library_version()
+    print(f"library {FileSystem.ldraw_path} update {library_version}")
+
+    start = time.perf_counter()
+    part_count, name_count = PartArchive.compile(
+        FileSystem.library_index,
+        LDrawFile.read_record,
+        library_version,
+    )
+    elapsed = time.perf_counter() - start
+
+    full_path = PartArchive.full_path()
+    print(f"{part_count} parts under {name_count} names in {elapsed:.1f}s")
+    print(f"written: {full_path} ({os.path.getsize(full_path):,} bytes)")
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if "--" in args:
+        args = args[args.index("--") + 1:]
+    else:
+        args = args[1:]
+    main(args)
@@ -0,0 +1,244 @@
+import numpy as np
+
+# merges vertices closer than a distance like bmesh.ops.remove_doubles, but on arrays before the mesh exists
+# positions are compared as float32 like they are in a mesh
+# in a group of vertices within distance of each other the first one is kept and the rest are merged into it
+# a vertex that another vertex was merged into is never merged itself, so there are no chains
+
+# the cells of the grid are at least distance wide so vertices within distance are in the same or neighboring cells
+# this many cells on each axis keeps the key of a cell within int64
+__max_cells = 1 << 20
+
+# the neighboring cells that come after a cell, each pair of neighboring cells is looked at once
+__neighbor_offsets = np.array([
+    (x, y, z)
+    for x in (-1, 0, 1)
+    for y in (-1, 0, 1)
+    for z in (-1, 0, 1)
+    if (x, y, z) > (0, 0, 0)
+], dtype=np.int64)
+
+# a cell and all of its neighbors
+__all_offsets = np.array([
+    (x, y, z)
+    for x in (-1, 0, 1)
+    for y in (-1, 0, 1)
+    for z in (-1, 0, 1)
+], dtype=np.int64)
+
+
+# vertices (V, 3)
+# returns the index of the welded vertex of every vertex (V,) and the index in vertices of every welded vertex (W,)
+# welded vertices are in the order of the vertices they are
+def weld_vertices(vertices, distance):
+    vertices = np.asarray(vertices, dtype=np.float32)
+    if len(vertices) < 1:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # identical positions are merged first, they're almost every weld
+    positions, first_indices, inverse = np.unique(vertices, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    targets = np.arange(len(positions))
+    if distance > 0 and len(positions) > 1:
+        # the rest are resolved in the order of the first vertex at each position
+        order = np.argsort(first_indices, kind='stable')
+        positions = positions[order]
+        first_indices = first_indices[order]
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        inverse = rank[inverse]
+        targets = __merge_near(positions, distance)
+
+    # the original index of the position every vertex is merged into
+    welded_indices = first_indices[targets[inverse]]
+    kept = np.unique(welded_indices)
+    return np.searchsorted(kept, welded_indices), kept
+
+
+# the index of the position each position is merged into, positions that aren't merged are their own target
+def __merge_near(positions, distance):
+    a, b = __near_pairs(positions, distance)
+    targets = np.arange(len(positions))
+    if len(a) < 1:
+        return targets
+
+    # every pair in both directions, grouped by the position that comes first
+    searches = np.concatenate((a, b))
+    neighbors = np.concatenate((b, a))
+    order = np.lexsort((neighbors, searches))
+    searches = searches[order].tolist()
+    neighbors = neighbors[order].tolist()
+
+    # position -> the position it is merged into, a position that others were merged into is its own
+    merged_into = {}
+    start = 0
+    while start < len(searches):
+        search = searches[start]
+        end = start
+        while end < len(searches) and searches[end] == search:
+            end += 1
+
+        if merged_into.get(search, search) == search:
+            found = False
+            for neighbor in neighbors[start:end]:
+                if neighbor not in merged_into:
+                    merged_into[neighbor] = search
+                    found = True
+            if found:
+                merged_into[search] = search
+        start = end
+
+    for position, target in merged_into.items():
+        targets[position] = target
+    return targets
+
+
+# every pair of positions within distance of each other, as two arrays of indices with a < b
+def __near_pairs(positions, distance):
+    low = positions.min(axis=0)
+    extent = float((positions.max(axis=0) - low).max())
+    cell_size = max(distance, extent / (__max_cells - 2))
+
+    cells = np.floor((positions - low) / cell_size).astype(np.int64)
+    dims = cells.max(axis=0) + 2
+    keys = __cell_keys(cells, dims)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    pair_a = []
+    pair_b = []
+
+    # positions in the same cell
+    a, b = __cell_pairs(np.arange(len(positions)), sorted_keys, order, keys)
+    same = a < b
+    pair_a.append(a[same])
+    pair_b.append(b[same])
+
+    for offset in __neighbor_offsets:
+        neighbor_cells = cells + offset
+        inside = np.all(neighbor_cells >= 0, axis=1)
+        indices = np.flatnonzero(inside)
+        a, b = __cell_pairs(indices, sorted_keys, order, __cell_keys(neighbor_cells[inside], dims))
+        pair_a.append(a)
+        pair_b.append(b)
+
+    a = np.concatenate(pair_a)
+    b = np.concatenate(pair_b)
+
+    # the distance is compared in float32 like bmesh does
+    d = positions[a] - positions[b]
+    near = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2] <= np.float32(distance) * np.float32(distance)
+    a = a[near]
+    b = b[near]
+    return np.minimum(a, b), np.maximum(a, b)
+
+
+# every pair of a query and a point within distance of each other,
+# as the indices of the queries (P,) and of the points (P,), in query order
+def points_within(points, queries, distance):
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, 3)
+    if len(points) < 1 or len(queries) < 1:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    low = np.minimum(points.min(axis=0), queries.min(axis=0))
+    high = np.maximum(points.max(axis=0), queries.max(axis=0))
+    # all at one position with no distance is any cell size
+    cell_size = max(distance, float((high - low).max()) / (__max_cells - 3)) or 1.0
+
+    # a border of empty cells so the neighbors of every cell have a key
+    point_cells = np.floor((points - low) / cell_size).astype(np.int64) + 1
+    query_cells = np.floor((queries - low) / cell_size).astype(np.int64) + 1
+    dims = np.maximum(point_cells.max(axis=0), query_cells.max(axis=0)) + 2
+
+    keys = __cell_keys(point_cells, dims)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    pair_a = []
+    pair_b = []
+    indices = np.arange(len(queries))
+    for offset in __all_offsets:
+        a, b = __cell_pairs(indices, sorted_keys, order, __cell_keys(query_cells + offset, dims))
+        pair_a.append(a)
+        pair_b.append(b)
+
+    a = np.concatenate(pair_a)
+    b = np.concatenate(pair_b)
+
+    d = queries[a] - points[b]
+    near = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2] <= np.float32(distance) * np.float32(distance)
+    a = a[near]
+    b = b[near]
+    order = np.argsort(a, kind='stable')
+    return a[order], b[order]
+
+
+def __cell_keys(cells, dims):
+    return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+
+# the pairs of each of indices with every position whose cell key is the matching one of keys
+def __cell_pairs(indices, sorted_keys, order, keys):
+    starts = np.searchsorted(sorted_keys, keys, side='left')
+    counts = np.searchsorted(sorted_keys, keys, side='right') - starts
+    total = int(counts.sum())
+    if total < 1:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    a = np.repeat(indices, counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = order[np.repeat(starts, counts) + offsets]
+    return a, b
+
+
+# face_vertices (F, 4, 3) and face_vertex_counts (F,) of a GeometryData
+# welds the corners of the faces and removes the faces that become degenerate or duplicates of an earlier face
+# returns the welded vertices (V, 3), the vertex index of every corner that is left (L,) in face order,
+# the number of corners of each face that is left (F',), the index of each face that is left (F',)
+# and the index within its face of every corner that is left (L,)
+def weld_faces(face_vertices, face_vertex_counts, distance):
+    face_vertex_counts = np.asarray(face_vertex_counts, dtype=np.intp)
+    # triangles repeat their last vertex, which isn't a corner
+    corners = np.arange(4) < face_vertex_counts[:, None]
+    corner_vertices = face_vertices[corners]
+    loop_faces = np.repeat(np.arange(len(face_vertex_counts)), face_vertex_counts)
+    loop_corners = np.nonzero(corners)[1]
+
+    vertex_indices, kept = weld_vertices(corner_vertices, distance)
+    vertices = np.asarray(corner_vertices[kept], dtype=np.float32)
+    loop_vertex_indices = vertex_indices
+
+    # a corner that is the same vertex as the one before it in its face is gone
+    loop_starts = np.cumsum(face_vertex_counts) - face_vertex_counts
+    previous = np.arange(len(loop_vertex_indices)) - 1
+    first = loop_starts[face_vertex_counts > 0]
+    previous[first] = first + face_vertex_counts[face_vertex_counts > 0] - 1
+    keep_loops = loop_vertex_indices != loop_vertex_indices[previous]
+
+    counts = np.bincount(loop_faces[keep_loops], minlength=len(face_vertex_counts))
+
+    # faces with less than 3 corners left or a vertex twice are removed
+    # the 4 vertices of a face sorted, a triangle has -1 first
+    sorted_faces = np.full((len(face_vertex_counts), 4), -1, dtype=np.intp)
+    kept_loops = np.flatnonzero(keep_loops)
+    kept_positions = np.arange(len(kept_loops)) - np.repeat(np.cumsum(counts) - counts, counts)
+    valid = counts >= 3
+    fits = valid[loop_faces[kept_loops]]
+    sorted_faces[loop_faces[kept_loops][fits], kept_positions[fits]] = loop_vertex_indices[kept_loops][fits]
+    sorted_faces.sort(axis=1)
+    repeated = np.any((sorted_faces[:, 1:] == sorted_faces[:, :-1]) & (sorted_faces[:, 1:] >= 0), axis=1)
+    valid &= ~repeated
+
+    # a face with the same vertices as an earlier face is removed, whatever their winding
+    faces = np.flatnonzero(valid)
+    _, first_faces = np.unique(sorted_faces[faces], axis=0, return_index=True)
+    faces = faces[np.sort(first_faces)]
+
+    keep_faces = np.zeros(len(face_vertex_counts), dtype=bool)
+    keep_faces[faces] = True
+    keep_loops &= keep_faces[loop_faces]
+
+    return vertices, loop_vertex_indices[keep_loops], counts[faces], faces, loop_corners[keep_loops]